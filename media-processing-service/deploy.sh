@@ -10,6 +10,21 @@ GCS_BUCKET_NAME="brandverse-media-exports"
 IMAGE_TAG=$(date +%Y%m%d-%H%M%S)
 AR_IMAGE_PATH="${REGION}-docker.pkg.dev/${PROJECT_ID}/${AR_REPO}/${IMAGE_NAME}:${IMAGE_TAG}"
 SERVICE_NAME="media-processing-svc"
+# Optional Filestore (NFS) share for the export ledger, e.g. LEDGER_NFS="10.0.0.2:/exports".
+# Without it the ledger lives in the instance's in-memory /tmp and is lost when it's recycled.
+# Every instance resumes the unfinished jobs it finds in the ledger, so a shared ledger means one instance
+LEDGER_NFS="${LEDGER_NFS:-}"
+ENV_VARS="GCS_BUCKET_NAME=$GCS_BUCKET_NAME"
+LEDGER_ARGS=()
+if [ -n "$LEDGER_NFS" ]; then
+  ENV_VARS="$ENV_VARS,EXPORT_LEDGER_PATH=/mnt/ledger/export-ledger.sqlite3"
+  LEDGER_ARGS=(
+    --execution-environment gen2
+    --max-instances 1
+    --add-volume "name=ledger,type=nfs,location=$LEDGER_NFS"
+    --add-volume-mount "volume=ledger,mount-path=/mnt/ledger"
+  )
+fi
 
 echo "========================================"
 echo "Media Processing Service Deployment"
@@ -17,6 +32,7 @@ echo "========================================"
 echo "Image: $IMAGE_NAME:$IMAGE_TAG"
 echo "Service: $SERVICE_NAME"
 echo "Region: $REGION"
+echo "Ledger: ${LEDGER_NFS:-in-memory /tmp (not durable)}"
 echo "========================================"
 
 echo ""
@@ -35,7 +51,8 @@ gcloud run deploy $SERVICE_NAME \
   --cpu 2 \
   --timeout 600 \
   --update-secrets="SUPABASE_URL=SUPABASE_URL:latest,SUPABASE_SERVICE_ROLE_KEY=SUPABASE_SERVICE_ROLE_KEY:latest" \
-  --set-env-vars="GCS_BUCKET_NAME=$GCS_BUCKET_NAME" \
+  --set-env-vars="$ENV_VARS" \
+  "${LEDGER_ARGS[@]}" \
   --ingress=all \
   --project $PROJECT_ID
 
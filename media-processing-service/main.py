@@ -6,25 +6,58 @@ Uses FFmpeg for lossless video operations.
 
 Endpoints:
 - POST /video/export - Trim and concatenate video clips (lossless)
+- POST /video/export/jobs - Start an export in the background
+- GET /video/export/jobs/{job_id} - Export job status
+- GET /video/export/jobs/{job_id}/events - Export job progress (Server-Sent Events)
+- GET /media/probe - Stream layout of a source
+- GET /media/keyframes - Keyframe index of a source
+- GET /cache/stats - Cache counters
 - GET /health - Health check
 """
 
+import io
 import os
+import sys
 import asyncio
-import subprocess
 import uuid
 import shutil
+import time
+import json
+import hashlib
+import contextvars
+import base64
+import bisect
+import struct
+import math
+import heapq
+import itertools
+import functools
+import urllib.parse
+import sqlite3
+import threading
 import aiohttp
 import aiofiles
-from datetime import datetime
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from fractions import Fraction
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from supabase import create_client, Client
+import google.auth
+from google.auth.credentials import AnonymousCredentials
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage as gcs_storage
+from google.cloud.storage.retry import DEFAULT_RETRY as GCS_RETRY
 
 # ============================================
 # Configuration
@@ -32,20 +65,165 @@ from google.cloud import storage as gcs_storage
 
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-WORK_DIR = Path("/tmp/media-processing")
+SUPABASE_BUCKET = "media-studio-videos"
+# Supabase uploads go through the resumable (TUS) endpoint one chunk at a time, so an
+# upload holds at most one chunk in memory; Supabase requires 6MB chunks
+SUPABASE_UPLOAD_CHUNK_BYTES = 6 * 1024 * 1024
+STORAGE_CALL_CONCURRENCY = int(os.environ.get("STORAGE_CALL_CONCURRENCY", "8"))  # Blocking Supabase/GCS SDK calls at once
+SUPABASE_UPLOAD_RETRIES = int(os.environ.get("SUPABASE_UPLOAD_RETRIES", "3"))  # Per chunk, resuming from the server's offset
+WORK_DIR = Path(os.environ.get("WORK_DIR", "/tmp/media-processing"))
 
 # GCS configuration for large files (> 50MB)
 GCS_BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME", "brandverse-media-exports")
 GCS_LARGE_FILE_THRESHOLD = 50 * 1024 * 1024  # 50MB in bytes
+# Uploads use resumable sessions sent in chunks, so a transient failure resumes from the
+# last committed chunk; big files go up as parallel parts composed into one object.
+# Set STORAGE_EMULATOR_HOST (e.g. http://localhost:9023) to upload to a local emulator
+GCS_UPLOAD_CHUNK_BYTES = int(os.environ.get("GCS_UPLOAD_CHUNK_BYTES", str(16 * 1024 * 1024)))
+GCS_UPLOAD_PARTS = int(os.environ.get("GCS_UPLOAD_PARTS", "4"))  # Parallel parts, at most 32 (1 = one stream)
+GCS_PARALLEL_UPLOAD_MIN_BYTES = int(os.environ.get("GCS_PARALLEL_UPLOAD_MIN_BYTES", str(100 * 1024 * 1024)))
+GCS_UPLOAD_PARTS_PREFIX = "upload-parts"  # Parts orphaned by a crash are deleted by the bucket lifecycle rule
+# Export output: 'file' renders output.mp4 to disk, then uploads it; 'stream' pipes fragmented MP4
+# from a single-pass render straight into a resumable GCS upload when the output is estimated
+# to need GCS (and for previews), so the upload runs while the encode does
+EXPORT_UPLOAD_MODE = os.environ.get("EXPORT_UPLOAD_MODE", "file")
+STREAM_MUX_ARGS = ["-f", "mp4", "-movflags", "frag_keyframe+empty_moov+default_base_moof"]
+ESTIMATE_BITS_PER_PIXEL = 0.1  # Size estimate for sources with no known bitrate
+# HLS exports (outputFormat 'hls'): fMP4 (CMAF) segments and playlists published to GCS as they
+# are written. The ladder lists height:max video kbps rungs; renditions below the output size
+# are added on request, and the full-size rendition is capped by the rung at or above its height
+HLS_SEGMENT_SECONDS = float(os.environ.get("HLS_SEGMENT_SECONDS", "4"))
+HLS_LADDER = os.environ.get("HLS_LADDER", "1080:6000,720:3000,480:1500,360:800")
+HLS_PUBLISH_INTERVAL_SECONDS = 1.0  # How often new segments are looked for while encoding
+
+# Source downloads: one pooled keep-alive HTTP session shared for the app's lifetime
+DOWNLOAD_CONCURRENCY = int(os.environ.get("DOWNLOAD_CONCURRENCY", "4"))  # Parallel downloads per job
+HTTP_POOL_LIMIT = int(os.environ.get("HTTP_POOL_LIMIT", "32"))  # Total pooled connections
+HTTP_KEEPALIVE_SECONDS = float(os.environ.get("HTTP_KEEPALIVE_SECONDS", "60"))
+DOWNLOAD_CHUNK_SIZE = 256 * 1024  # 256KB read chunks
+
+# Persistent on-instance cache of source media, shared by all endpoints
+SOURCE_CACHE_ENABLED = os.environ.get("SOURCE_CACHE_ENABLED", "true").lower() == "true"
+SOURCE_CACHE_DIR = Path(os.environ.get("SOURCE_CACHE_DIR", "/tmp/media-processing-cache"))
+SOURCE_CACHE_MAX_BYTES = int(os.environ.get("SOURCE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))  # 1GB
+SOURCE_CACHE_REVALIDATE_SECONDS = float(os.environ.get("SOURCE_CACHE_REVALIDATE_SECONDS", "300"))
+
+# FFmpeg/ffprobe run as asyncio subprocesses; excess requests queue for a slot
+FFMPEG_MAX_PROCESSES = int(os.environ.get("FFMPEG_MAX_PROCESSES", "2"))  # Concurrent encoder processes
+FFPROBE_MAX_PROCESSES = int(os.environ.get("FFPROBE_MAX_PROCESSES", "8"))
+
+# Chunked encoding: long outputs are split at safe boundaries (keyframes, outside
+# transitions) and the chunks encoded in parallel, each on a share of the cores.
+# A chunked encode holds one FFmpeg slot; its chunks share ENCODE_CHUNK_WORKERS processes
+ENCODE_CHUNK_SECONDS = float(os.environ.get("ENCODE_CHUNK_SECONDS", "30"))  # 0 = always one process
+ENCODE_CHUNK_WORKERS = int(os.environ.get("ENCODE_CHUNK_WORKERS", str(max(2, (os.cpu_count() or 2) // 2))))
+ENCODE_CHUNK_THREADS = max(1, (os.cpu_count() or 1) // max(1, ENCODE_CHUNK_WORKERS))  # Encoder threads per chunk
+
+# Media metadata (probe results, keyframe indexes) is computed once per content.
+# 'pyav' probes in-process when PyAV is installed; 'ffprobe' spawns one process per probe
+PROBE_BACKEND = os.environ.get("PROBE_BACKEND", "ffprobe")
+MEDIA_MEMO_MEMORY_ENTRIES = 256  # Per kind, in memory; cached sources also keep theirs on disk
+SOURCE_DURATION_TOLERANCE_SECONDS = 0.1  # Probed vs client-reported sourceDuration mismatch worth logging
+
+# Trimming: 'smart' stream-copies whole GOPs and re-encodes only the partial GOPs at
+# the cut points; 'accurate' re-encodes the whole trimmed range
+TRIM_MODE = os.environ.get("TRIM_MODE", "smart")
+SMART_TRIM_MIN_COPY_SECONDS = 1.0  # Below this much copyable video, a full re-encode is cheaper
+
+# Trimmed clip segments all share one encoding (and always carry an audio track),
+# so any mix of them - cached or fresh - can be joined with stream copy. A keyframe
+# every couple of seconds keeps the re-encoded span around each transition short
+SEGMENT_KEYFRAME_SECONDS = 2
+SEGMENT_H264_PROFILE = "High"  # As probed
+SEGMENT_VIDEO_ENCODE_ARGS = [
+    "-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-pix_fmt", "yuv420p", "-profile:v", "high",
+    "-force_key_frames", f"expr:gte(t,n_forced*{SEGMENT_KEYFRAME_SECONDS})",
+]
+SEGMENT_AUDIO_ENCODE_ARGS = ["-c:a", "aac", "-b:a", "192k", "-ar", "48000", "-ac", "2"]
+SEGMENT_SILENCE_SOURCE = "anullsrc=r=48000:cl=stereo"
+
+# Text overlays: 'windowed' re-encodes only the keyframe-aligned windows where an
+# overlay is visible and stream-copies the rest; 'full' re-encodes the whole video
+OVERLAY_RENDER_MODE = os.environ.get("OVERLAY_RENDER_MODE", "windowed")
+OVERLAY_WINDOW_MAX_FRACTION = 0.6  # Above this share of re-encoded video, a full pass is simpler and as fast
+# Transitions: 'overlap' re-encodes only the keyframe-aligned overlap around each
+# transition and stream-copies the clip bodies; 'full' re-encodes the whole join
+TRANSITION_RENDER_MODE = os.environ.get("TRANSITION_RENDER_MODE", "overlap")
+# 'raster' draws each distinct caption once to a transparent PNG and composites them with
+# one overlay filter; 'drawtext' lays out every caption on every frame
+TEXT_OVERLAY_RENDERER = os.environ.get("TEXT_OVERLAY_RENDERER", "raster")
+TEXT_LAYER_CACHE_DIR = SOURCE_CACHE_DIR / "text-layers"
+TEXT_LAYER_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Intermediate render outputs (trimmed segments, joined timelines) reused across exports
+RENDER_CACHE_DIR = SOURCE_CACHE_DIR / "renders"
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))  # 1GB, 0 = off
+
+# Background export jobs
+EXPORT_JOB_TTL_SECONDS = float(os.environ.get("EXPORT_JOB_TTL_SECONDS", "3600"))  # Keep finished jobs pollable
+SSE_HEARTBEAT_SECONDS = 15.0  # Keep-alive comment interval so proxies don't drop idle streams
+EXPORT_DEDUP_SECONDS = float(os.environ.get("EXPORT_DEDUP_SECONDS", "600"))  # Reuse identical finished exports (0 = off)
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", "4"))  # Exports rendering at once; the rest wait queued
+# Durable job ledger: every export and each stage it has finished, so a restarted instance
+# resumes unfinished exports. Keep it (and WORK_DIR) on a persistent volume to survive
+# instance replacement, not just process restarts
+EXPORT_LEDGER_PATH = Path(os.environ.get("EXPORT_LEDGER_PATH", str(WORK_DIR / "export-ledger.sqlite3")))
+EXPORT_MAX_ATTEMPTS = 3  # Runs of one export (resumes included) before it's failed for good
+# WORK_DIR is in memory on Cloud Run: an export starts only once its estimated peak footprint
+# fits the budget and the free space, and its intermediates are deleted as soon as the last
+# stage reading them has finished
+WORK_DIR_MAX_BYTES = int(os.environ.get("WORK_DIR_MAX_BYTES", "0"))  # 0 = 75% of WORK_DIR's filesystem
+WORK_DIR_RECHECK_SECONDS = 5.0  # How often a waiting export looks at the free space again
+SOURCE_SIZE_HEAD_TIMEOUT_SECONDS = 3.0  # HEADs for sizes not known locally; past it, size from duration
+
+# Export rendering: 'single_pass' compiles the whole timeline into one FFmpeg run,
+# 'multi_pass' trims, concatenates and overlays in separate encodes
+EXPORT_RENDER_MODE = os.environ.get("EXPORT_RENDER_MODE", "single_pass")
+FILTER_SCRIPT_MIN_CHARS = 4000  # Longer filter graphs go through -filter_complex_script
+EXPORT_VIDEO_ENCODE_ARGS = ["-c:v", "libx264", "-preset", "fast", "-crf", "18", "-pix_fmt", "yuv420p"]
+EXPORT_AUDIO_ENCODE_ARGS = ["-c:a", "aac", "-b:a", "192k"]
+EXPORT_AUDIO_SAMPLE_RATE = 48000
+
+# Preview renders: small, fast single-pass encodes for checking an edit in the editor.
+# Not added to the media library; uploaded under a GCS prefix with a short lifecycle rule
+PREVIEW_DEFAULT_HEIGHT = 360  # Output height when the request has no previewDimensions
+PREVIEW_VIDEO_ENCODE_ARGS = ["-c:v", "libx264", "-preset", "ultrafast", "-crf", "30", "-pix_fmt", "yuv420p"]
+PREVIEW_AUDIO_ENCODE_ARGS = ["-c:a", "aac", "-b:a", "96k"]
+PREVIEW_STORAGE_PREFIX = os.environ.get("PREVIEW_STORAGE_PREFIX", "previews")
 
 # ============================================
 # FastAPI App Setup
 # ============================================
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create long-lived clients on startup and close them on shutdown."""
+    await open_http_session()
+    source_cache.load()
+    render_cache.load()
+    text_layer_cache.load()
+    font_registry.build()
+    work_dir_budget.open()
+    await asyncio.to_thread(open_storage_clients)
+    export_ledger.open()
+    await export_jobs.restore()
+    try:
+        yield
+    finally:
+        await export_jobs.shutdown()
+        await source_cache.flush()
+        await render_cache.flush()
+        await text_layer_cache.flush()
+        export_ledger.close()
+        await asyncio.to_thread(close_storage_clients)
+        await close_http_session()
+
+
 app = FastAPI(
     title="Media Processing Service",
     description="Video and image processing API with FFmpeg",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS - allow all origins for now (can restrict later)
@@ -114,11 +292,34 @@ class VideoExportRequest(BaseModel):
     textOverlays: Optional[List[TextOverlay]] = None
     transitions: Optional[List[Transition]] = None  # Transitions between clips
     previewDimensions: Optional[PreviewDimensions] = None  # Preview container size from web editor
+    renderMode: Optional[str] = None  # 'single_pass' or 'multi_pass' (defaults to EXPORT_RENDER_MODE)
+    preview: bool = False  # Low-resolution draft render, not saved to the media library
+    outputFormat: Optional[str] = None  # 'mp4' (default) or 'hls'
+    hlsLadder: bool = False  # HLS only: add the lower-resolution renditions of HLS_LADDER
     userId: str
     companyId: Optional[str] = None
     projectName: Optional[str] = "Exported Video"
 
 
+class UploadStats(BaseModel):
+    """Throughput of an output upload."""
+    storage: str  # 'gcs' or 'supabase'
+    bytes: int
+    seconds: float
+    bytesPerSecond: float
+    parts: int = 1  # Parallel parts composed into the object
+    streamed: bool = False  # Uploaded while the encoder was still writing it
+
+
+class DownloadStats(BaseModel):
+    """Throughput of a single source download."""
+    url: str
+    bytes: int
+    seconds: float
+    bytesPerSecond: float
+    cacheHit: bool = False
+
+
 class VideoExportResponse(BaseModel):
     success: bool
     videoUrl: Optional[str] = None
@@ -127,1094 +328,5100 @@ class VideoExportResponse(BaseModel):
     mediaFileId: Optional[str] = None
     processingTimeMs: Optional[int] = None
     storageType: Optional[str] = None  # 'supabase' or 'gcs'
+    downloads: Optional[List[DownloadStats]] = None  # Per-source download throughput
+    upload: Optional[UploadStats] = None  # Output upload throughput
+    deduplicated: bool = False  # Result came from an identical export instead of a new render
+    preview: bool = False  # Draft render in short-lived storage, no media record
     error: Optional[str] = None
 
 
+class ExportJobSubmitResponse(BaseModel):
+    jobId: str
+    status: str
+    statusUrl: str
+    eventsUrl: str
+    deduplicated: bool = False  # An identical export was already running or recently finished
+
+
+class EncodeProgress(BaseModel):
+    """Live progress of the FFmpeg process currently running for a job."""
+    stage: str
+    frames: int
+    fps: float
+    speed: float  # Multiple of realtime
+    outTimeSeconds: float
+    totalSeconds: Optional[float] = None
+    percent: Optional[float] = None
+    etaSeconds: Optional[float] = None
+    elapsedSeconds: float
+
+
+class MediaStream(BaseModel):
+    index: int
+    codecType: str  # 'video', 'audio', ...
+    codecName: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    frameRate: Optional[str] = None  # e.g. '30000/1001'
+    pixFmt: Optional[str] = None
+    profile: Optional[str] = None  # e.g. 'High'
+    level: Optional[int] = None  # e.g. 40 for H.264 level 4.0
+    sampleRate: Optional[int] = None
+    channels: Optional[int] = None
+    channelLayout: Optional[str] = None
+    duration: Optional[float] = None
+
+
+class MediaInfo(BaseModel):
+    duration: float = 0.0
+    formatName: Optional[str] = None
+    bitRate: Optional[int] = None
+    streams: List[MediaStream] = []
+
+    @property
+    def video(self) -> Optional[MediaStream]:
+        return next((st for st in self.streams if st.codecType == "video"), None)
+
+    @property
+    def audio(self) -> Optional[MediaStream]:
+        return next((st for st in self.streams if st.codecType == "audio"), None)
+
+    @property
+    def has_audio(self) -> bool:
+        return self.audio is not None
+
+    @property
+    def dimensions(self) -> tuple[int, int]:
+        """(width, height) of the first video stream, 1920x1080 if unknown."""
+        video = self.video
+        return (video.width or 1920, video.height or 1080) if video else (1920, 1080)
+
+    @property
+    def frame_rate(self) -> str:
+        video = self.video
+        return video.frameRate if video and video.frameRate else "30"
+
+
+class KeyframeEntry(BaseModel):
+    time: float
+    offset: Optional[int] = None  # Byte offset of the keyframe packet
+
+
+class KeyframeIndexResponse(BaseModel):
+    contentId: Optional[str] = None
+    count: int
+    averageGopSeconds: Optional[float] = None
+    keyframes: List[KeyframeEntry]
+    # Only when ?at= is given: nearest keyframes around that time
+    at: Optional[float] = None
+    keyframeBefore: Optional[float] = None
+    keyframeAfter: Optional[float] = None
+
+
+class ExportJobStatus(BaseModel):
+    jobId: str
+    status: str  # 'queued', 'running', 'completed', 'failed'
+    stage: str  # Current pipeline stage, see EXPORT_STAGES
+    percent: float  # Overall progress 0-100
+    createdAt: str
+    updatedAt: str
+    encode: Optional[EncodeProgress] = None  # Latest FFmpeg progress within the job
+    playbackUrl: Optional[str] = None  # HLS exports: master playlist, playable while still rendering
+    result: Optional[VideoExportResponse] = None  # Set once the job has finished
+
+
 # ============================================
 # Helper Functions
 # ============================================
 
+# Long-lived storage/database clients (created in the lifespan hook, lazily as a fallback).
+# Their SDKs are blocking, so calls go through a bounded executor instead of the event loop
+_supabase_client: Optional[Client] = None
+_gcs_client: Optional[gcs_storage.Client] = None
+_storage_executor: Optional[ThreadPoolExecutor] = None
+
+
 def get_supabase_client() -> Client:
-    """Create Supabase client with service role key."""
+    """
+    Return the app-wide Supabase client (service role key), creating it on first use.
+
+    The client keeps its PostgREST and storage HTTP clients, and with them a
+    pool of keep-alive connections, for the app's lifetime.
+    """
+    global _supabase_client
     if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
         raise HTTPException(
             status_code=500,
             detail="Supabase credentials not configured"
         )
-    return create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+    if _supabase_client is None:
+        _supabase_client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+        print("[Storage] Opened Supabase client")
+    return _supabase_client
 
 
-def upload_to_gcs(file_path: Path, destination_path: str) -> str:
+def get_gcs_client() -> gcs_storage.Client:
     """
-    Upload file to Google Cloud Storage and return a public URL.
-    Used for files > 50MB that exceed Supabase storage limits.
+    Return the app-wide GCS client, creating it on first use.
 
-    Bucket has uniform bucket-level access with allUsers:objectViewer,
-    so all objects are publicly readable by default.
-    Objects are auto-deleted after 30 days via bucket lifecycle policy.
+    The client runs on our own authorized session, whose connection pool has
+    room for every SDK call and parallel upload part to keep its connection alive.
     """
-    print(f"[GCS] Uploading {file_path} to gs://{GCS_BUCKET_NAME}/{destination_path}")
+    global _gcs_client
+    if _gcs_client is None:
+        if os.environ.get("STORAGE_EMULATOR_HOST"):
+            # The emulator takes no credentials (what the SDK itself does in this case)
+            credentials, project = AnonymousCredentials(), None
+        else:
+            credentials, project = google.auth.default(scopes=gcs_storage.Client.SCOPE)
+        pool_size = STORAGE_CALL_CONCURRENCY * max(GCS_UPLOAD_PARTS, 1)
+        session = AuthorizedSession(credentials)
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        client_args: Dict[str, Any] = {"credentials": credentials, "_http": session}
+        if project:
+            # Otherwise the SDK looks it up from the environment, as before
+            client_args["project"] = project
+        _gcs_client = gcs_storage.Client(**client_args)
+        print(f"[Storage] Opened GCS client (pool={pool_size})")
+    return _gcs_client
+
+
+def open_storage_clients() -> None:
+    """Create the storage executor and the clients whose credentials are configured."""
+    global _storage_executor
+    if _storage_executor is None:
+        _storage_executor = ThreadPoolExecutor(max_workers=STORAGE_CALL_CONCURRENCY, thread_name_prefix="storage")
+    if SUPABASE_URL and SUPABASE_SERVICE_KEY:
+        get_supabase_client()
+    try:
+        get_gcs_client()
+    except Exception as e:
+        # No GCS credentials on this instance; GCS uploads will fail when attempted
+        print(f"[Storage] GCS client unavailable: {e}")
+
+
+def close_storage_clients() -> None:
+    """Close the clients' connection pools and stop the storage executor."""
+    global _supabase_client, _gcs_client, _storage_executor
+    if _storage_executor is not None:
+        _storage_executor.shutdown(wait=True)
+        _storage_executor = None
+    if _supabase_client is not None:
+        # Sub-clients' close methods vary across supabase-py versions; a failed close must not fail shutdown
+        for name in ("postgrest", "storage"):
+            try:
+                getattr(_supabase_client, name).aclose()
+            except Exception as e:
+                print(f"[Storage] Could not close Supabase {name} client: {e}")
+        _supabase_client = None
+    if _gcs_client is not None:
+        _gcs_client.close()
+        _gcs_client = None
+    print("[Storage] Closed clients")
 
-    client = gcs_storage.Client()
-    bucket = client.bucket(GCS_BUCKET_NAME)
-    blob = bucket.blob(destination_path)
 
-    # Upload the file
-    blob.upload_from_filename(str(file_path), content_type="video/mp4")
+async def run_storage_call(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run a blocking storage/database SDK call on the storage executor.
 
-    # Return the public URL (bucket already has public read access)
-    public_url = f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{destination_path}"
-    print(f"[GCS] Upload complete. Public URL: {public_url}")
-    return public_url
+    At most STORAGE_CALL_CONCURRENCY calls run at once; the rest queue
+    without holding up the event loop.
+    """
+    global _storage_executor
+    if _storage_executor is None:
+        _storage_executor = ThreadPoolExecutor(max_workers=STORAGE_CALL_CONCURRENCY, thread_name_prefix="storage")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_storage_executor, functools.partial(func, *args, **kwargs))
 
 
-async def download_file(url: str, dest_path: Path) -> None:
-    """Download a file from URL to local path."""
-    print(f"[Download] {url} -> {dest_path}")
+class FileRange(io.RawIOBase):
+    """A byte range of a file as a stream of its own, starting at position 0."""
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, allow_redirects=True) as response:
-            if response.status != 200:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Failed to download video: HTTP {response.status}"
-                )
+    def __init__(self, path: Path, offset: int, length: int):
+        super().__init__()
+        self._file = open(path, "rb")
+        self._offset = offset
+        self._length = length
+        self._position = 0
 
-            async with aiofiles.open(dest_path, 'wb') as f:
-                async for chunk in response.content.iter_chunked(8192):
-                    await f.write(chunk)
+    def readable(self) -> bool:
+        return True
 
-    print(f"[Download] Complete: {dest_path.stat().st_size} bytes")
+    def seekable(self) -> bool:
+        return True
 
+    def tell(self) -> int:
+        return self._position
 
-def run_ffmpeg(args: List[str]) -> None:
-    """Run FFmpeg command and handle errors."""
-    cmd = ["ffmpeg", "-y"] + args
-    print(f"[FFmpeg] Running: {' '.join(cmd)}")
+    def seek(self, position: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self._length}[whence]
+        self._position = min(max(base + position, 0), self._length)
+        return self._position
 
-    result = subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True
-    )
+    def read(self, size: int = -1) -> bytes:
+        remaining = self._length - self._position
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        self._file.seek(self._offset + self._position)
+        data = self._file.read(size)
+        self._position += len(data)
+        return data
 
-    if result.returncode != 0:
-        print(f"[FFmpeg] Error: {result.stderr}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"FFmpeg error: {result.stderr[:500]}"
-        )
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
 
-    print("[FFmpeg] Command completed successfully")
+    def close(self) -> None:
+        self._file.close()
+        super().close()
 
 
-def trim_video(input_path: Path, output_path: Path, start_time: float, duration: float,
-               audio_volume: Optional[float] = None, audio_muted: bool = False) -> None:
-    """
-    Trim video using FFmpeg with re-encoding for frame-accurate cuts.
+def plan_upload_parts(size: int) -> List[Tuple[int, int]]:
+    """(offset, length) of each part of a GCS upload: one part below GCS_PARALLEL_UPLOAD_MIN_BYTES."""
+    parts = min(max(GCS_UPLOAD_PARTS, 1), 32)  # compose takes at most 32 sources
+    if size < GCS_PARALLEL_UPLOAD_MIN_BYTES or parts == 1:
+        return [(0, size)]
+    part_size = -(-size // parts)
+    return [(offset, min(part_size, size - offset)) for offset in range(0, size, part_size)]
 
-    Uses -i before -ss for accurate seeking (input-based seeking with re-encode).
-    Re-encodes with high quality settings (CRF 18) for near-lossless output.
-    This approach ensures exact frame trimming regardless of keyframe positions.
 
-    Args:
-        audio_volume: Volume level 0.0-2.0. None means no adjustment (default volume).
-                      Values >1.0 boost the audio (up to 200%). 0.0 strips audio.
-        audio_muted: If True, strips audio entirely from the output.
+def gcs_public_url(destination_path: str) -> str:
+    """Public URL of an object in the export bucket (or on the emulator, when one is set)."""
+    emulator = os.environ.get("STORAGE_EMULATOR_HOST")
+    if emulator:
+        return f"{emulator.rstrip('/')}/download/storage/v1/b/{GCS_BUCKET_NAME}/o/{urllib.parse.quote(destination_path, safe='')}?alt=media"
+    return f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{destination_path}"
+
+
+def upload_to_gcs(file_path: Path, destination_path: str) -> Tuple[str, UploadStats]:
     """
-    end_time = start_time + duration
+    Upload file to Google Cloud Storage and return a public URL and the upload's throughput.
+    Used for files > 50MB that exceed Supabase storage limits, and for previews.
 
-    cmd = [
-        "-i", str(input_path),
-        "-ss", str(start_time),
-        "-to", str(end_time),
-        "-c:v", "libx264",
-        "-preset", "veryfast",
-        "-crf", "18",
-    ]
+    Blocking; call it through run_storage_call. Every part is a resumable
+    upload sent in GCS_UPLOAD_CHUNK_BYTES chunks and retried from its last
+    committed chunk. Files from GCS_PARALLEL_UPLOAD_MIN_BYTES up are split into
+    GCS_UPLOAD_PARTS parts uploaded side by side as temporary objects, which
+    are composed into the final object and deleted.
 
-    if audio_muted:
-        # Strip audio entirely
-        cmd.extend(["-an"])
-    elif audio_volume is not None and audio_volume != 1.0:
-        # Apply volume filter
-        cmd.extend([
-            "-af", f"volume={audio_volume}",
-            "-c:a", "aac",
-            "-b:a", "192k",
-        ])
+    Bucket has uniform bucket-level access with allUsers:objectViewer,
+    so all objects are publicly readable by default.
+    Objects are auto-deleted after 30 days via bucket lifecycle policy.
+    """
+    size = file_path.stat().st_size
+    parts = plan_upload_parts(size)
+    # Resumable chunks must be multiples of 256KB
+    chunk_size = max(GCS_UPLOAD_CHUNK_BYTES // (256 * 1024), 1) * 256 * 1024
+    print(f"[GCS] Uploading {file_path} ({size} bytes, {len(parts)} part(s)) to gs://{GCS_BUCKET_NAME}/{destination_path}")
+
+    started = time.monotonic()
+    bucket = get_gcs_client().bucket(GCS_BUCKET_NAME)
+    blob = bucket.blob(destination_path, chunk_size=chunk_size)
+
+    if len(parts) == 1:
+        blob.upload_from_filename(str(file_path), content_type="video/mp4", retry=GCS_RETRY)
     else:
-        # Default: re-encode audio without volume change
-        cmd.extend([
-            "-c:a", "aac",
-            "-b:a", "192k",
-        ])
+        part_blobs = [
+            bucket.blob(f"{GCS_UPLOAD_PARTS_PREFIX}/{destination_path}/{i}", chunk_size=chunk_size)
+            for i in range(len(parts))
+        ]
 
-    cmd.extend([
-        "-avoid_negative_ts", "make_zero",
-        str(output_path)
-    ])
+        def upload_part(part_blob, offset: int, length: int) -> None:
+            with FileRange(file_path, offset, length) as stream:
+                part_blob.upload_from_file(stream, size=length, content_type="video/mp4", retry=GCS_RETRY)
 
-    run_ffmpeg(cmd)
+        with ThreadPoolExecutor(max_workers=len(parts), thread_name_prefix="gcs-part") as pool:
+            list(pool.map(upload_part, part_blobs, *zip(*parts)))
 
+        blob.content_type = "video/mp4"
+        blob.compose(part_blobs, retry=GCS_RETRY)
+        for part_blob in part_blobs:
+            part_blob.delete(retry=GCS_RETRY)
 
-def concatenate_videos(input_paths: List[Path], output_path: Path, work_dir: Path) -> None:
-    """
-    Concatenate videos using FFmpeg concat demuxer (lossless for same-codec files).
+    seconds = time.monotonic() - started
+    stats = UploadStats(storage="gcs", bytes=size, seconds=round(seconds, 3),
+                        bytesPerSecond=round(size / seconds, 1) if seconds > 0 else 0.0, parts=len(parts))
+    upload_stats.record(stats)
+
+    # Return the public URL (bucket already has public read access)
+    public_url = gcs_public_url(destination_path)
+    print(f"[GCS] Upload complete in {seconds:.2f}s ({stats.bytesPerSecond / (1024 * 1024):.1f} MB/s). Public URL: {public_url}")
+    return public_url, stats
+
+
+class PipeUploadStream(io.RawIOBase):
     """
-    if len(input_paths) == 1:
-        # Single file - just copy
-        shutil.copy(input_paths[0], output_path)
-        return
+    The read end of a FIFO an encoder writes its output into, as a resumable upload's source.
 
-    # Create concat list file
-    concat_list_path = work_dir / "concat_list.txt"
-    with open(concat_list_path, "w") as f:
-        for path in input_paths:
-            f.write(f"file '{path}'\n")
+    Holds only the bytes of the latest read, which is all a resumable upload
+    seeks back over to resend a failed chunk. End of stream is reported once
+    `finish(True)` says the encoder succeeded; after `finish(False)` reading
+    fails instead, so a crashed encode never completes an upload.
+    """
 
-    run_ffmpeg([
-        "-f", "concat",
-        "-safe", "0",
-        "-i", str(concat_list_path),
-        "-c", "copy",
-        str(output_path)
-    ])
+    def __init__(self, path: Path):
+        super().__init__()
+        self._path = path
+        self._pipe = None
+        self._buffer = bytearray()
+        self._buffer_start = 0  # Stream offset of _buffer[0]
+        self._position = 0
+        self._eof = False
+        self._finished = threading.Event()
+        self._ok = False
+
+    def finish(self, ok: bool) -> None:
+        """Called by the encoding side once the encoder has exited."""
+        self._ok = ok
+        self._finished.set()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, position: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            position += self._position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Pipe streams have no known end")
+        if not self._buffer_start <= position <= self._buffer_start + len(self._buffer):
+            raise io.UnsupportedOperation(f"Position {position} is no longer buffered")
+        self._position = position
+        return position
+
+    def _open(self) -> None:
+        # Non-blocking open never waits for the writer; reads block once it is there
+        fd = os.open(self._path, os.O_RDONLY | os.O_NONBLOCK)
+        os.set_blocking(fd, True)
+        self._pipe = os.fdopen(fd, "rb", buffering=0)
+
+    def read(self, size: int = -1) -> bytes:
+        if self._pipe is None:
+            self._open()
+        # Everything before the read position has been committed by the upload
+        del self._buffer[:self._position - self._buffer_start]
+        self._buffer_start = self._position
+        want = size if size is not None and size >= 0 else sys.maxsize
+        while len(self._buffer) < want and not self._eof:
+            data = self._pipe.read(min(want - len(self._buffer), 1024 * 1024))
+            if data:
+                self._buffer += data
+            elif self._finished.wait(0.05):
+                # No writer and the encoder has exited: what is left was the last of it
+                data = self._pipe.read(min(want - len(self._buffer), 1024 * 1024))
+                if data:
+                    self._buffer += data
+                    continue
+                if not self._ok:
+                    raise IOError("Encoder failed, abandoning the upload")
+                self._eof = True
+            # else: the encoder has not opened the pipe yet
+        data = bytes(self._buffer[:want])
+        self._position += len(data)
+        return data
+
+    def close(self) -> None:
+        if self._pipe is not None:
+            self._pipe.close()
+        super().close()
+
+
+def stream_to_gcs(stream: PipeUploadStream, destination_path: str) -> Tuple[str, UploadStats]:
+    """
+    Upload an encoder's output to GCS as it is written, in one resumable session.
 
+    Blocking; call it through run_storage_call. The object's size is unknown
+    until the stream ends, so each GCS_UPLOAD_CHUNK_BYTES chunk is sent as
+    soon as the encoder has produced it.
+    """
+    print(f"[GCS] Streaming upload to gs://{GCS_BUCKET_NAME}/{destination_path}")
+    chunk_size = max(GCS_UPLOAD_CHUNK_BYTES // (256 * 1024), 1) * 256 * 1024
+    started = time.monotonic()
+    blob = get_gcs_client().bucket(GCS_BUCKET_NAME).blob(destination_path, chunk_size=chunk_size)
+    with stream:
+        blob.upload_from_file(stream, content_type="video/mp4", retry=GCS_RETRY)
+        size = stream.tell()
+
+    seconds = time.monotonic() - started
+    stats = UploadStats(storage="gcs", bytes=size, seconds=round(seconds, 3),
+                        bytesPerSecond=round(size / seconds, 1) if seconds > 0 else 0.0, streamed=True)
+    upload_stats.record(stats)
+    public_url = gcs_public_url(destination_path)
+    print(f"[GCS] Streaming upload complete: {size} bytes in {seconds:.2f}s. Public URL: {public_url}")
+    return public_url, stats
+
+
+async def encode_and_stream_to_gcs(
+    encode: Callable[[Path, List[str]], Awaitable[Any]],
+    work_dir: Path,
+    destination_path: str,
+) -> Tuple[str, UploadStats]:
+    """
+    Run `encode(output_path, mux_args)` into a FIFO while stream_to_gcs uploads from it.
 
-def get_video_duration_ffprobe(video_path: Path) -> float:
-    """Get video duration using ffprobe."""
+    The encoder writes fragmented MP4 (STREAM_MUX_ARGS), which needs no
+    seeking back, so the output never lands on disk. If either side fails
+    the other is stopped: a failed upload cancels the encode, and a failed
+    encode abandons the upload before it is finalized.
+    """
+    pipe_path = work_dir / "output.pipe"
+    pipe_path.unlink(missing_ok=True)
+    os.mkfifo(pipe_path)
+    stream = PipeUploadStream(pipe_path)
+    upload = asyncio.ensure_future(run_storage_call(stream_to_gcs, stream, destination_path))
+    encoding = asyncio.ensure_future(encode(pipe_path, STREAM_MUX_ARGS))
     try:
-        cmd = [
-            "ffprobe",
-            "-v", "error",
-            "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            str(video_path)
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode == 0:
-            duration = float(result.stdout.strip())
-            print(f"[FFprobe] Video duration: {duration}s")
-            return duration
-    except Exception as e:
-        print(f"[FFprobe] Error getting duration: {e}")
-    return 0.0
+        await asyncio.wait({encoding, upload}, return_when=asyncio.FIRST_COMPLETED)
+        if upload.done():
+            upload.result()  # Only an error ends the upload before the encode; the encode is cancelled below
+        await encoding
+        stream.finish(True)
+        return await upload
+    finally:
+        if not encoding.done():
+            encoding.cancel()
+            await asyncio.gather(encoding, return_exceptions=True)
+        if not upload.done():
+            stream.finish(False)
+            await asyncio.gather(upload, return_exceptions=True)
+        pipe_path.unlink(missing_ok=True)
 
 
-def concatenate_videos_with_transitions(
-    input_paths: List[Path],
-    clip_durations: List[float],
-    transitions: List[dict],  # List of {fromIndex, toIndex, type, duration}
-    output_path: Path,
-    work_dir: Path
-) -> None:
+def put_gcs_object(destination_path: str, source: Any, content_type: str,
+                   cache_control: Optional[str] = None) -> int:
     """
-    Concatenate videos with transitions using FFmpeg xfade filter.
+    Upload a small file (Path) or text (str) to GCS in one request. Returns its size.
 
-    The xfade filter works by:
-    1. Taking two input streams
-    2. Applying a transition effect for a specified duration
-    3. The offset is where the transition starts (end of first clip minus transition duration)
+    Blocking; call it through run_storage_call.
+    """
+    blob = get_gcs_client().bucket(GCS_BUCKET_NAME).blob(destination_path)
+    blob.cache_control = cache_control
+    if isinstance(source, Path):
+        blob.upload_from_filename(str(source), content_type=content_type, retry=GCS_RETRY)
+        return source.stat().st_size
+    blob.upload_from_string(source, content_type=content_type, retry=GCS_RETRY)
+    return len(source.encode())
 
-    For multiple clips with transitions, we need to chain xfade filters:
-    [0][1]xfade=...[v01]; [v01][2]xfade=...[v012]; ...
+
+class HlsPublisher:
     """
-    if len(input_paths) == 1:
-        # Single file - just copy
-        shutil.copy(input_paths[0], output_path)
-        return
+    Publishes an HLS output directory to GCS while FFmpeg is still writing it.
 
-    if not transitions:
-        # No transitions - use regular concat
-        concatenate_videos(input_paths, output_path, work_dir)
-        return
+    A segment is uploaded once a variant playlist lists it (FFmpeg adds a
+    segment only after finishing it); the playlist goes up after its
+    segments, uncached, so a player following the event playlist only ever
+    sees segments that are already in storage. The master playlist goes up
+    once the first variant has. Published segments are deleted locally.
+    """
 
-    # Build transition map: fromIndex -> transition
-    transition_map = {t['fromClipIndex']: t for t in transitions}
+    CONTENT_TYPES = {".m3u8": "application/vnd.apple.mpegurl", ".m4s": "video/iso.segment", ".mp4": "video/mp4"}
+
+    def __init__(self, local_dir: Path, prefix: str):
+        self.local_dir = local_dir
+        self.prefix = prefix
+        self.uploaded: Dict[str, int] = {}  # Segment/init file -> bytes
+        self.playlists: Dict[str, str] = {}  # Playlist -> last published text
+        self.started = time.monotonic()
+
+    @property
+    def master_url(self) -> str:
+        return gcs_public_url(f"{self.prefix}/master.m3u8")
+
+    @property
+    def live(self) -> bool:
+        return "master.m3u8" in self.playlists
+
+    async def _put(self, name: str, source: Any, cache_control: Optional[str] = None) -> int:
+        return await run_storage_call(put_gcs_object, f"{self.prefix}/{name}", source,
+                                      self.CONTENT_TYPES[Path(name).suffix], cache_control)
+
+    async def publish(self) -> None:
+        """Upload whatever FFmpeg has finished since the last call."""
+        for playlist in sorted(self.local_dir.glob("stream_*.m3u8")):
+            async with aiofiles.open(playlist) as f:
+                text = await f.read()
+            if text == self.playlists.get(playlist.name):
+                continue
+            names = [
+                line.split('"')[1] if line.startswith("#EXT-X-MAP:") else line
+                for line in text.splitlines()
+                if line and (not line.startswith("#") or line.startswith("#EXT-X-MAP:"))
+            ]
+            pending = [name for name in names if name not in self.uploaded]
+            sizes = await asyncio.gather(*(self._put(name, self.local_dir / name) for name in pending))
+            self.uploaded.update(zip(pending, sizes))
+            for name in pending:
+                if name.endswith(".m4s"):  # FFmpeg never reads a finished segment again
+                    (self.local_dir / name).unlink(missing_ok=True)
+            await self._put(playlist.name, text, cache_control="no-cache")
+            self.playlists[playlist.name] = text
+
+        master = self.local_dir / "master.m3u8"
+        if self.playlists and master.exists():
+            async with aiofiles.open(master) as f:
+                text = await f.read()
+            if text != self.playlists.get(master.name):
+                await self._put(master.name, text, cache_control="no-cache")
+                self.playlists[master.name] = text
+
+    def stats(self) -> UploadStats:
+        size = sum(self.uploaded.values()) + sum(len(text.encode()) for text in self.playlists.values())
+        seconds = time.monotonic() - self.started
+        return UploadStats(storage="gcs", bytes=size, seconds=round(seconds, 3),
+                           bytesPerSecond=round(size / seconds, 1) if seconds > 0 else 0.0, streamed=True)
+
+
+async def encode_and_publish_hls(
+    encode: Callable[[], Awaitable[Any]],
+    publisher: HlsPublisher,
+    on_live: Callable[[str], None],
+) -> UploadStats:
+    """
+    Run an HLS encode while `publisher` uploads its segments every HLS_PUBLISH_INTERVAL_SECONDS.
 
-    # Check if all clips have transitions between them
-    # If not all clips have transitions, we need a more complex approach
-    has_all_transitions = all(i in transition_map for i in range(len(input_paths) - 1))
+    `on_live` gets the master playlist URL as soon as it is playable. A
+    failed publish cancels the encode.
+    """
+    encoding = asyncio.ensure_future(encode())
+    try:
+        while not encoding.done():
+            await asyncio.wait({encoding}, timeout=HLS_PUBLISH_INTERVAL_SECONDS)
+            was_live = publisher.live
+            await publisher.publish()
+            if publisher.live and not was_live:
+                print(f"[HLS] Playable at {publisher.master_url}")
+                on_live(publisher.master_url)
+        await encoding
+        await publisher.publish()  # The last segments and the end-of-list playlists
+    finally:
+        if not encoding.done():
+            encoding.cancel()
+            await asyncio.gather(encoding, return_exceptions=True)
 
-    if not has_all_transitions:
-        # Mixed case: some transitions, some hard cuts
-        # For simplicity, we'll process this in segments and then concat
-        print(f"[Transitions] Mixed transitions detected, using segment-based approach")
-        _concatenate_with_mixed_transitions(
-            input_paths, clip_durations, transition_map, output_path, work_dir
-        )
-        return
+    stats = publisher.stats()
+    upload_stats.record(stats)
+    print(f"[HLS] Published {len(publisher.uploaded)} segment file(s), {stats.bytes} bytes to gs://{GCS_BUCKET_NAME}/{publisher.prefix}")
+    return stats
 
-    # All consecutive clips have transitions - use chained xfade
-    print(f"[Transitions] All clips have transitions, using chained xfade")
-    _concatenate_with_chained_xfade(
-        input_paths, clip_durations, transition_map, output_path, work_dir
-    )
 
+class UploadSpeedStats:
+    """Upload throughput per storage backend, for /health."""
 
-def _concatenate_with_chained_xfade(
-    input_paths: List[Path],
-    clip_durations: List[float],
-    transition_map: dict,
-    output_path: Path,
-    work_dir: Path
-) -> None:
-    """
-    Concatenate all clips with xfade transitions between each pair.
+    def __init__(self):
+        self.backends: Dict[str, Dict[str, float]] = {}
 
-    For N clips with transitions between all of them:
-    - Input 0 and 1 get xfade -> v01
-    - v01 and Input 2 get xfade -> v012
-    - etc.
+    def record(self, stats: UploadStats) -> None:
+        entry = self.backends.setdefault(stats.storage, {"uploads": 0, "bytes": 0, "seconds": 0.0})
+        entry["uploads"] += 1
+        entry["bytes"] += stats.bytes
+        entry["seconds"] += stats.seconds
 
-    The offset for each transition is calculated as:
-    - For first transition: duration of clip 0 - transition_duration
-    - For subsequent: accumulated_duration - transition_duration
-    """
-    n = len(input_paths)
+    def snapshot(self) -> dict:
+        return {
+            storage: {
+                **entry,
+                "seconds": round(entry["seconds"], 2),
+                "bytesPerSecond": round(entry["bytes"] / entry["seconds"], 1) if entry["seconds"] > 0 else 0.0,
+            }
+            for storage, entry in self.backends.items()
+        }
 
-    # Build FFmpeg inputs
-    inputs = []
-    for i, path in enumerate(input_paths):
-        inputs.extend(["-i", str(path)])
 
-    # Build filter_complex
-    # For 2 clips: [0:v][1:v]xfade=transition=fade:duration=0.5:offset=4.5[outv]; [0:a][1:a]acrossfade=d=0.5[outa]
-    # For 3 clips: [0:v][1:v]xfade=...:[v01]; [v01][2:v]xfade=...:[v012]
+upload_stats = UploadSpeedStats()
 
-    filter_parts = []
-    audio_filter_parts = []
 
-    # Calculate running offset (accumulated duration minus transitions)
-    running_duration = clip_durations[0]
+async def upload_to_supabase(file_path: Path, storage_path: str, content_type: str,
+                             upsert: bool = False) -> Tuple[str, UploadStats]:
+    """
+    Stream a file into Supabase storage and return its public URL and the upload's throughput.
 
-    for i in range(n - 1):
-        trans = transition_map.get(i)
-        if not trans:
-            trans = {'type': 'fade', 'duration': 0.5}
+    Uses the storage API's resumable (TUS) endpoint over the shared HTTP
+    session: the file is read and sent one SUPABASE_UPLOAD_CHUNK_BYTES chunk at
+    a time, so memory stays bounded whatever the file size. A failed chunk asks
+    the server how far it got and resends from there; each chunk gets up to
+    SUPABASE_UPLOAD_RETRIES retries, failed offset checks included.
+    """
+    size = file_path.stat().st_size
+    print(f"[Supabase] Uploading {file_path} ({size} bytes) to {SUPABASE_BUCKET}/{storage_path}")
 
-        trans_type = trans['type']
-        trans_duration = trans['duration']
+    def metadata(**fields: str) -> str:
+        return ",".join(f"{key} {base64.b64encode(value.encode()).decode()}" for key, value in fields.items())
 
-        # Calculate offset: where transition starts
-        # For first transition: end of clip 0 minus transition duration
-        # For subsequent: running duration minus transition duration
-        if i == 0:
-            offset = clip_durations[0] - trans_duration
-        else:
-            # Accumulated duration (minus previous transitions) minus this transition
-            offset = running_duration - trans_duration
+    headers = {
+        "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
+        "apikey": SUPABASE_SERVICE_KEY or "",
+        "Tus-Resumable": "1.0.0",
+    }
+    session = await open_http_session()
+    started = time.monotonic()
+    async with session.post(
+        f"{SUPABASE_URL}/storage/v1/upload/resumable",
+        headers={
+            **headers,
+            "Upload-Length": str(size),
+            "Upload-Metadata": metadata(bucketName=SUPABASE_BUCKET, objectName=storage_path,
+                                        contentType=content_type, cacheControl="3600"),
+            "x-upsert": "true" if upsert else "false",
+        },
+    ) as response:
+        if response.status != 201:
+            raise Exception(f"Supabase upload of {storage_path} failed to start: HTTP {response.status} {await response.text()}")
+        upload_url = urllib.parse.urljoin(str(response.url), response.headers["Location"])
+
+    offset = 0
+    failures = 0  # In a row, on the current chunk
+    resync = False  # Ask the server how far it got before sending more
+    async with aiofiles.open(file_path, "rb") as f:
+        while offset < size:
+            try:
+                if resync:
+                    # Resume from whatever the server committed
+                    async with session.head(upload_url, headers=headers) as response:
+                        if response.status != 200:
+                            raise Exception(f"HTTP {response.status} {await response.text()} asking for the offset")
+                        offset = int(response.headers["Upload-Offset"])
+                    resync = False
+                    print(f"[Supabase] Resuming at byte {offset}")
+                    continue
+                await f.seek(offset)
+                chunk = await f.read(SUPABASE_UPLOAD_CHUNK_BYTES)
+                async with session.patch(
+                    upload_url,
+                    data=chunk,
+                    headers={**headers, "Upload-Offset": str(offset),
+                             "Content-Type": "application/offset+octet-stream"},
+                ) as response:
+                    if response.status != 204:
+                        raise Exception(f"HTTP {response.status} {await response.text()}")
+                    offset = int(response.headers["Upload-Offset"])
+                del chunk
+                failures = 0
+            except Exception as e:
+                failures += 1
+                if failures > SUPABASE_UPLOAD_RETRIES:
+                    raise Exception(f"Supabase upload of {storage_path} failed at byte {offset}: {e}")
+                print(f"[Supabase] Chunk failed ({e}), retry {failures}/{SUPABASE_UPLOAD_RETRIES}")
+                await asyncio.sleep(failures)
+                resync = True
 
-        # Video xfade
-        if i == 0:
-            # First transition: inputs are [0:v] and [1:v]
-            in1 = "[0:v]"
-            in2 = "[1:v]"
-        else:
-            # Subsequent: previous output and next input
-            in1 = f"[v{i-1}]"
-            in2 = f"[{i+1}:v]"
+    seconds = time.monotonic() - started
+    stats = UploadStats(storage="supabase", bytes=size, seconds=round(seconds, 3),
+                        bytesPerSecond=round(size / seconds, 1) if seconds > 0 else 0.0)
+    upload_stats.record(stats)
 
-        # Output label
-        if i == n - 2:
-            # Last transition - final output
-            out_label = "[outv]"
-        else:
-            out_label = f"[v{i}]"
+    bucket = get_supabase_client().storage.from_(SUPABASE_BUCKET)
+    public_url = await run_storage_call(bucket.get_public_url, storage_path)
+    print(f"[Supabase] Upload complete in {seconds:.2f}s ({stats.bytesPerSecond / (1024 * 1024):.1f} MB/s). Public URL: {public_url}")
+    return public_url, stats
 
-        filter_parts.append(
-            f"{in1}{in2}xfade=transition={trans_type}:duration={trans_duration}:offset={offset}{out_label}"
-        )
 
-        # Audio crossfade
-        if i == 0:
-            ain1 = "[0:a]"
-            ain2 = "[1:a]"
-        else:
-            ain1 = f"[a{i-1}]"
-            ain2 = f"[{i+1}:a]"
+# Shared HTTP session (created in the lifespan hook, lazily as a fallback)
+_http_session: Optional[aiohttp.ClientSession] = None
 
-        if i == n - 2:
-            aout_label = "[outa]"
-        else:
-            aout_label = f"[a{i}]"
 
-        audio_filter_parts.append(
-            f"{ain1}{ain2}acrossfade=d={trans_duration}{aout_label}"
+async def open_http_session() -> aiohttp.ClientSession:
+    """
+    Return the app-wide aiohttp session, creating it on first use.
+
+    A single session keeps a pool of keep-alive connections and a DNS cache,
+    so repeated downloads from the same host (Supabase storage) skip the
+    DNS/TCP/TLS setup that a per-download session would pay every time.
+    """
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            ttl_dns_cache=300,
+            keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+        )
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120),
+        )
+        print(f"[HTTP] Opened pooled session (limit={HTTP_POOL_LIMIT}, keepalive={HTTP_KEEPALIVE_SECONDS}s)")
+    return _http_session
+
+
+async def close_http_session() -> None:
+    """Close the app-wide aiohttp session."""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+        print("[HTTP] Closed pooled session")
+    _http_session = None
+
+
+@dataclass
+class DownloadResult:
+    """Outcome of a single download: where it landed and how fast it came in."""
+    url: str
+    path: Path
+    bytes: int
+    seconds: float
+    cache_hit: bool = False
+    content_id: Optional[str] = None  # sha256 of the content, when known
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    def to_stats(self) -> DownloadStats:
+        return DownloadStats(
+            url=self.url,
+            bytes=self.bytes,
+            seconds=round(self.seconds, 3),
+            bytesPerSecond=round(self.bytes_per_second, 1),
+            cacheHit=self.cache_hit,
         )
 
-        # Update running duration: add next clip duration, subtract transition overlap
-        running_duration = running_duration + clip_durations[i + 1] - trans_duration
 
-    # Combine video and audio filters
-    filter_complex = "; ".join(filter_parts + audio_filter_parts)
+async def download_file(url: str, dest_path: Path) -> DownloadResult:
+    """Download a file from URL to local path over the shared session."""
+    print(f"[Download] {url} -> {dest_path}")
 
-    print(f"[Transitions] Filter complex: {filter_complex[:500]}...")
+    started = time.monotonic()
+    _, total_bytes, _, content_id = await _http_get_to_file(url, dest_path)
 
-    cmd = inputs + [
-        "-filter_complex", filter_complex,
-        "-map", "[outv]",
-        "-map", "[outa]",
-        "-c:v", "libx264",
-        "-preset", "fast",
-        "-crf", "18",
-        "-c:a", "aac",
-        "-b:a", "192k",
-        str(output_path)
-    ]
+    result = DownloadResult(url=url, path=dest_path, bytes=total_bytes, seconds=time.monotonic() - started,
+                            content_id=content_id)
+    print(f"[Download] Complete: {result.bytes} bytes in {result.seconds:.2f}s ({result.bytes_per_second / (1024*1024):.2f} MB/s)")
+    return result
 
-    run_ffmpeg(cmd)
 
+# ============================================
+# Source Cache
+# ============================================
 
-def _concatenate_with_mixed_transitions(
-    input_paths: List[Path],
-    clip_durations: List[float],
-    transition_map: dict,
-    output_path: Path,
-    work_dir: Path
-) -> None:
+class IndexWriter:
     """
-    Handle case where only some clips have transitions.
+    Writes a cache's JSON index to disk off the event loop.
 
-    Strategy:
-    1. Group consecutive clips that have transitions between them
-    2. Process each group with xfade
-    3. Concat all processed groups with regular concat (hard cuts)
+    save() only marks the index dirty and starts a writer task if none is
+    running; changes made while it is writing are batched into its next
+    write. `snapshot` is called on the loop, so each write sees one
+    consistent state.
     """
-    n = len(input_paths)
-    segments = []  # List of (start_index, end_index, has_transitions)
 
-    i = 0
-    while i < n:
-        start = i
-        # Find consecutive clips with transitions
-        while i < n - 1 and i in transition_map:
-            i += 1
-        end = i
+    def __init__(self, path: Path, snapshot: Callable[[], Any], tag: str):
+        self.path = path
+        self.snapshot = snapshot
+        self.tag = tag
+        self._dirty = False
+        self._writer: Optional[asyncio.Task] = None
+
+    def save(self) -> None:
+        self._dirty = True
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write())
+
+    async def _write(self) -> None:
+        while self._dirty:
+            self._dirty = False
+            data = self.snapshot()
+
+            def write() -> None:
+                tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+                tmp_path.write_text(json.dumps(data))
+                os.replace(tmp_path, self.path)
+            try:
+                await asyncio.to_thread(write)
+            except OSError as e:
+                print(f"[{self.tag}] Could not write index: {e}")
 
-        if start < end:
-            # This segment has transitions
-            segments.append((start, end + 1, True))  # end + 1 to include last clip
-            i = end + 1
-        else:
-            # Single clip or clip without transition to next
-            segments.append((start, start + 1, False))
-            i += 1
+    async def flush(self) -> None:
+        """Wait for a pending write (on shutdown)."""
+        if self._writer is not None:
+            await self._writer
 
-    print(f"[Transitions] Segments: {segments}")
 
-    # Process each segment
-    processed_paths = []
-    for seg_idx, (start, end, has_trans) in enumerate(segments):
-        seg_paths = input_paths[start:end]
-        seg_durations = clip_durations[start:end]
+@dataclass
+class CachedBlob:
+    """A cached source file, stored under its content hash."""
+    content_id: str
+    size: int
+    last_used: float
 
-        if has_trans and len(seg_paths) > 1:
-            # Extract relevant transitions
-            seg_transitions = {
-                idx - start: transition_map[idx]
-                for idx in range(start, end - 1)
-                if idx in transition_map
-            }
 
-            seg_output = work_dir / f"segment_{seg_idx}.mp4"
-            _concatenate_with_chained_xfade(
-                seg_paths, seg_durations, seg_transitions, seg_output, work_dir
-            )
-            processed_paths.append(seg_output)
-        else:
-            # Single clip or no transitions
-            if len(seg_paths) == 1:
-                processed_paths.append(seg_paths[0])
+@dataclass
+class CachedUrl:
+    """What we last learned about a URL: its content and HTTP validators."""
+    content_id: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    validated_at: float = 0.0
+
+
+@dataclass
+class SourceCacheStats:
+    hits: int = 0
+    misses: int = 0
+    revalidations: int = 0  # Conditional requests answered with 304
+    evictions: int = 0
+    evicted_bytes: int = 0
+    deduplicated: int = 0  # Downloads whose content was already cached under another URL
+
+
+class SourceCache:
+    """
+    Content-addressed, LRU-evicted cache of downloaded source media.
+
+    Layout under SOURCE_CACHE_DIR:
+        blobs/<sha256>          - source file contents
+        sidecars/<sha256>.<kind> - data derived from a blob (e.g. keyframe index), evicted with it
+        index.json              - URL -> (content hash, ETag, Last-Modified) and LRU order
+
+    A URL whose record was validated less than SOURCE_CACHE_REVALIDATE_SECONDS ago
+    is served without touching the network. Older records are revalidated with a
+    conditional GET (If-None-Match / If-Modified-Since); a 304 is a hit.
+
+    Cached files are hard-linked into the job's work directory, so a blob can be
+    evicted while a job is still reading its link. Fetches of the same URL are
+    serialized so concurrent jobs download it only once.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.blob_dir = root / "blobs"
+        self.sidecar_dir = root / "sidecars"
+        self.max_bytes = max_bytes
+        self.blobs: "OrderedDict[str, CachedBlob]" = OrderedDict()  # Oldest first
+        self.urls: Dict[str, CachedUrl] = {}
+        self.total_bytes = 0
+        self.stats = SourceCacheStats()
+        self._lock = asyncio.Lock()
+        self._url_locks: Dict[str, asyncio.Lock] = {}
+        self._url_lock_users: Dict[str, int] = {}
+        self._index = IndexWriter(root / "index.json", self._index_data, "SourceCache")
+
+    # ---------- persistence ----------
+
+    def load(self) -> None:
+        """Load the index from disk, dropping entries whose blob is gone."""
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        index_path = self.root / "index.json"
+        if not index_path.exists():
+            return
+        try:
+            data = json.loads(index_path.read_text())
+        except (OSError, ValueError) as e:
+            print(f"[SourceCache] Ignoring unreadable index: {e}")
+            return
+
+        blobs = sorted(data.get("blobs", []), key=lambda b: b["last_used"])
+        for b in blobs:
+            path = self.blob_dir / b["content_id"]
+            if not path.exists():
+                continue
+            size = path.stat().st_size
+            self.blobs[b["content_id"]] = CachedBlob(b["content_id"], size, b["last_used"])
+            self.total_bytes += size
+
+        for url, u in data.get("urls", {}).items():
+            if u["content_id"] in self.blobs:
+                self.urls[url] = CachedUrl(**u)
+
+        print(f"[SourceCache] Loaded {len(self.blobs)} blobs ({self.total_bytes} bytes), {len(self.urls)} urls")
+
+    def _index_data(self) -> dict:
+        return {
+            "blobs": [dict(vars(b)) for b in self.blobs.values()],
+            "urls": {url: dict(vars(u)) for url, u in self.urls.items()},
+        }
+
+    async def flush(self) -> None:
+        """Wait for pending index writes (on shutdown)."""
+        await self._index.flush()
+
+    # ---------- lookup / insert ----------
+
+    def blob_path(self, content_id: str) -> Path:
+        return self.blob_dir / content_id
+
+    def sidecar_path(self, content_id: str, kind: str) -> Optional[Path]:
+        """Where to keep `kind` data derived from a cached blob, or None if it isn't cached."""
+        if content_id not in self.blobs:
+            return None
+        return self.sidecar_dir / f"{content_id}.{kind}"
+
+    def _touch(self, content_id: str) -> None:
+        blob = self.blobs[content_id]
+        blob.last_used = time.time()
+        self.blobs.move_to_end(content_id)
+
+    def _evict_to_budget(self) -> None:
+        while self.total_bytes > self.max_bytes and len(self.blobs) > 1:
+            content_id, blob = self.blobs.popitem(last=False)
+            self.blob_path(content_id).unlink(missing_ok=True)
+            for sidecar in self.sidecar_dir.glob(f"{content_id}.*"):
+                sidecar.unlink(missing_ok=True)
+            self.total_bytes -= blob.size
+            self.stats.evictions += 1
+            self.stats.evicted_bytes += blob.size
+            for url in [u for u, rec in self.urls.items() if rec.content_id == content_id]:
+                del self.urls[url]
+            print(f"[SourceCache] Evicted {content_id[:12]} ({blob.size} bytes)")
+
+    async def _insert(self, url: str, tmp_path: Path, content_id: str, size: int,
+                      etag: Optional[str], last_modified: Optional[str], dest_path: Path) -> None:
+        """Add a downloaded file to the cache and link it to `dest_path`."""
+        async with self._lock:
+            if content_id in self.blobs:
+                # Same content already cached under another URL (or an older validator)
+                tmp_path.unlink(missing_ok=True)
+                self.stats.deduplicated += 1
+            else:
+                os.replace(tmp_path, self.blob_path(content_id))
+                self.blobs[content_id] = CachedBlob(content_id, size, time.time())
+                self.total_bytes += size
+            self._touch(content_id)
+            self.urls[url] = CachedUrl(content_id, etag, last_modified, time.time())
+            self._link(self.blob_path(content_id), dest_path)
+            self._evict_to_budget()
+            self._index.save()
+
+    @staticmethod
+    def _link(src: Path, dest_path: Path) -> None:
+        """Hard-link a cached blob into a work dir (copy across filesystems)."""
+        dest_path.unlink(missing_ok=True)
+        try:
+            os.link(src, dest_path)
+        except OSError:
+            shutil.copyfile(src, dest_path)
+
+    async def _serve_hit(self, url: str, record: CachedUrl, dest_path: Path, started: float) -> Optional[DownloadResult]:
+        async with self._lock:
+            if record.content_id not in self.blobs:
+                return None
+            blob_path = self.blob_path(record.content_id)
+            try:
+                self._link(blob_path, dest_path)
+            except FileNotFoundError:
+                return None
+            self._touch(record.content_id)
+            self.stats.hits += 1
+            size = self.blobs[record.content_id].size
+
+        print(f"[SourceCache] Hit {url} ({size} bytes)")
+        return DownloadResult(url=url, path=dest_path, bytes=size, seconds=time.monotonic() - started,
+                              cache_hit=True, content_id=record.content_id)
+
+    async def fetch(self, url: str, dest_path: Path) -> DownloadResult:
+        """Materialize `url` at `dest_path`, from the cache when possible."""
+        lock = self._url_locks.setdefault(url, asyncio.Lock())
+        self._url_lock_users[url] = self._url_lock_users.get(url, 0) + 1
+        try:
+            async with lock:
+                return await self._fetch_locked(url, dest_path)
+        finally:
+            self._url_lock_users[url] -= 1
+            if self._url_lock_users[url] == 0:
+                del self._url_lock_users[url]
+                del self._url_locks[url]
+
+    async def _fetch_locked(self, url: str, dest_path: Path) -> DownloadResult:
+        started = time.monotonic()
+        record = self.urls.get(url)
+        headers = {}
+
+        if record is not None:
+            if time.time() - record.validated_at < SOURCE_CACHE_REVALIDATE_SECONDS:
+                result = await self._serve_hit(url, record, dest_path, started)
+                if result:
+                    return result
             else:
-                # Multiple clips without transitions - regular concat
-                seg_output = work_dir / f"segment_{seg_idx}.mp4"
-                concatenate_videos(seg_paths, seg_output, work_dir)
-                processed_paths.append(seg_output)
+                if record.etag:
+                    headers["If-None-Match"] = record.etag
+                if record.last_modified:
+                    headers["If-Modified-Since"] = record.last_modified
 
-    # Final concat of all segments
-    if len(processed_paths) == 1:
-        shutil.copy(processed_paths[0], output_path)
-    else:
-        concatenate_videos(processed_paths, output_path, work_dir)
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.blob_dir / f".partial-{uuid.uuid4().hex}"
+        try:
+            status, size, response_headers, content_id = await _http_get_to_file(
+                url, tmp_path, headers=headers
+            )
+            if status == 304 and record is not None:
+                record.validated_at = time.time()
+                self.stats.revalidations += 1
+                result = await self._serve_hit(url, record, dest_path, started)
+                if result:
+                    return result
+                # Blob was evicted after the conditional request went out - fetch it for real
+                status, size, response_headers, content_id = await _http_get_to_file(url, tmp_path)
+
+            self.stats.misses += 1
+            if size > self.max_bytes:
+                print(f"[SourceCache] {url} ({size} bytes) exceeds cache budget, not caching")
+                shutil.move(tmp_path, dest_path)
+            else:
+                await self._insert(
+                    url, tmp_path, content_id, size,
+                    response_headers.get("ETag"), response_headers.get("Last-Modified"),
+                    dest_path,
+                )
+        finally:
+            tmp_path.unlink(missing_ok=True)
 
+        elapsed = time.monotonic() - started
+        result = DownloadResult(url=url, path=dest_path, bytes=size, seconds=elapsed, content_id=content_id)
+        print(f"[SourceCache] Miss {url}: {size} bytes in {elapsed:.2f}s ({result.bytes_per_second / (1024*1024):.2f} MB/s)")
+        return result
 
-# Font mapping for FFmpeg
-FONT_MAP = {
-    "Inter": "/usr/share/fonts/custom/Inter-Regular.ttf",
-    "Montserrat": "/usr/share/fonts/custom/Montserrat-Regular.ttf",
-    "Roboto": "/usr/share/fonts/custom/Roboto-Regular.ttf",
-    "Playfair Display": "/usr/share/fonts/custom/PlayfairDisplay-Regular.ttf",
-    "Oswald": "/usr/share/fonts/custom/Oswald-Regular.ttf",
-    "Open Sans": "/usr/share/fonts/custom/OpenSans-Regular.ttf",
-    "Lato": "/usr/share/fonts/custom/Lato-Regular.ttf",
-    "Poppins": "/usr/share/fonts/custom/Poppins-Regular.ttf",
-}
+    def snapshot(self) -> dict:
+        return {
+            "enabled": SOURCE_CACHE_ENABLED,
+            "entries": len(self.blobs),
+            "urls": len(self.urls),
+            "bytes": self.total_bytes,
+            "maxBytes": self.max_bytes,
+            "hits": self.stats.hits,
+            "misses": self.stats.misses,
+            "revalidations": self.stats.revalidations,
+            "evictions": self.stats.evictions,
+            "evictedBytes": self.stats.evicted_bytes,
+            "deduplicated": self.stats.deduplicated,
+        }
 
-FONT_BOLD_MAP = {
-    "Inter": "/usr/share/fonts/custom/Inter-Bold.ttf",
-    "Montserrat": "/usr/share/fonts/custom/Montserrat-Bold.ttf",
-    "Roboto": "/usr/share/fonts/custom/Roboto-Bold.ttf",
-    "Playfair Display": "/usr/share/fonts/custom/PlayfairDisplay-Bold.ttf",
-    "Oswald": "/usr/share/fonts/custom/Oswald-Bold.ttf",
-    "Open Sans": "/usr/share/fonts/custom/OpenSans-Bold.ttf",
-    "Lato": "/usr/share/fonts/custom/Lato-Bold.ttf",
-    "Poppins": "/usr/share/fonts/custom/Poppins-Bold.ttf",
-}
 
-FONT_LIGHT_MAP = {
-    "Inter": "/usr/share/fonts/custom/Inter-Light.ttf",
-    "Montserrat": "/usr/share/fonts/custom/Montserrat-Light.ttf",
-    "Roboto": "/usr/share/fonts/custom/Roboto-Light.ttf",
-    "Playfair Display": "/usr/share/fonts/custom/PlayfairDisplay-Regular.ttf",  # No light variant
-    "Oswald": "/usr/share/fonts/custom/Oswald-Light.ttf",
-    "Open Sans": "/usr/share/fonts/custom/OpenSans-Light.ttf",
-    "Lato": "/usr/share/fonts/custom/Lato-Light.ttf",
-    "Poppins": "/usr/share/fonts/custom/Poppins-Light.ttf",
-}
+source_cache = SourceCache(SOURCE_CACHE_DIR, SOURCE_CACHE_MAX_BYTES)
 
 
-def get_font_path(font_family: str, weight: str) -> str:
+async def _http_get_to_file(url: str, dest_path: Path, headers: Optional[dict] = None) -> tuple[int, int, dict, Optional[str]]:
     """
-    Get the font file path based on family and weight.
-    Returns a tuple of (path, is_fallback) to track if we're using a fallback font.
+    GET `url` into `dest_path` over the shared session, hashing it on the way.
+
+    Returns (status, bytes, response headers, sha256 hex). A 304 response
+    writes nothing and returns (304, 0, headers, None).
     """
-    # Select the appropriate font map based on weight
-    if weight == "bold":
-        font_map = FONT_BOLD_MAP
-        dejavu_fallback = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
-    elif weight == "light":
-        font_map = FONT_LIGHT_MAP
-        dejavu_fallback = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"  # No light variant
+    session = await open_http_session()
+    async with session.get(url, allow_redirects=True, headers=headers or {}) as response:
+        if response.status == 304:
+            return 304, 0, dict(response.headers), None
+        if response.status != 200:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Failed to download video: HTTP {response.status}"
+            )
+
+        hasher = hashlib.sha256()
+        total_bytes = 0
+        async with aiofiles.open(dest_path, 'wb') as f:
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                await f.write(chunk)
+                hasher.update(chunk)
+                total_bytes += len(chunk)
+
+        return response.status, total_bytes, dict(response.headers), hasher.hexdigest()
+
+
+# URL -> content hash of its latest download, so a later export can size it from the
+# memoized probe of that content (even once the blob is evicted) without the network
+source_content_ids: "OrderedDict[str, str]" = OrderedDict()
+
+
+async def fetch_source(url: str, dest_path: Path) -> DownloadResult:
+    """Fetch a source URL into a work dir, through the source cache when enabled."""
+    if SOURCE_CACHE_ENABLED:
+        result = await source_cache.fetch(url, dest_path)
     else:
-        font_map = FONT_MAP
-        dejavu_fallback = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+        result = await download_file(url, dest_path)
+    if result.content_id:
+        source_content_ids[url] = result.content_id
+        source_content_ids.move_to_end(url)
+        while len(source_content_ids) > MEDIA_MEMO_MEMORY_ENTRIES:
+            source_content_ids.popitem(last=False)
+    return result
 
-    # Try to get the requested font
-    font_path = font_map.get(font_family)
 
-    if font_path:
-        # Verify font file exists and is valid (> 1KB to filter out error pages)
-        try:
-            if Path(font_path).exists() and Path(font_path).stat().st_size > 1000:
-                print(f"[Font] Using {font_family} {weight}: {font_path}")
-                return font_path
-            else:
-                print(f"[Font] Font file missing or invalid: {font_path}")
-        except Exception as e:
-            print(f"[Font] Error checking font file {font_path}: {e}")
+# ============================================
+# Render Cache
+# ============================================
+
+@dataclass
+class RenderCacheStats:
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    evictions: int = 0
+    evicted_bytes: int = 0
+
+
+class RenderCache:
+    """
+    On-disk LRU cache of intermediate render outputs.
+
+    Holds trimmed clip segments and joined timelines of multi-pass exports, so
+    a re-export only redoes the stages whose inputs changed. Each entry is
+    keyed by a hash of everything that determines its bytes (see `key`).
+    Files are hard-linked between the cache and job work dirs, never copied
+    on the same filesystem.
+
+    Layout under the cache root:
+        <key><suffix> - cached output
+        index.json    - key -> size, in LRU order
+    """
 
-    # Fall back to regular weight of same family if bold/light not found
-    if weight in ("bold", "light"):
-        regular_path = FONT_MAP.get(font_family)
-        if regular_path:
+    def __init__(self, root: Path, max_bytes: int, suffix: str = ".mp4"):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size, oldest first
+        self.total_bytes = 0
+        self.stats = RenderCacheStats()
+        self._lock = asyncio.Lock()
+        self._index = IndexWriter(root / "index.json", lambda: list(self.entries), "RenderCache")
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(**parts) -> str:
+        """Stable hash of the given inputs (any JSON-serializable values)."""
+        canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}{self.suffix}"
+
+    def load(self) -> None:
+        """Load the index from disk, dropping entries whose file is gone."""
+        if not self.enabled:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        index_path = self.root / "index.json"
+        if not index_path.exists():
+            return
+        try:
+            keys = json.loads(index_path.read_text())
+        except (OSError, ValueError) as e:
+            print(f"[RenderCache] Ignoring unreadable index {index_path}: {e}")
+            return
+        for key in keys:
+            path = self._path(key)
+            if path.exists():
+                size = path.stat().st_size
+                self.entries[key] = size
+                self.total_bytes += size
+        print(f"[RenderCache] Loaded {len(self.entries)} entries ({self.total_bytes} bytes) from {self.root}")
+
+    async def flush(self) -> None:
+        """Wait for pending index writes (on shutdown)."""
+        await self._index.flush()
+
+    async def get(self, key: str, dest_path: Path) -> bool:
+        """Link the cached output for `key` to `dest_path`. False on a miss."""
+        if not self.enabled:
+            return False
+        async with self._lock:
+            if key not in self.entries:
+                self.stats.misses += 1
+                return False
             try:
-                if Path(regular_path).exists() and Path(regular_path).stat().st_size > 1000:
-                    print(f"[Font] Falling back to {font_family} regular: {regular_path}")
-                    return regular_path
-            except Exception as e:
-                print(f"[Font] Error checking regular font {regular_path}: {e}")
+                SourceCache._link(self._path(key), dest_path)
+            except FileNotFoundError:
+                self.total_bytes -= self.entries.pop(key)
+                self.stats.misses += 1
+                return False
+            self.entries.move_to_end(key)
+            self.stats.hits += 1
+        print(f"[RenderCache] Hit {key[:12]}{self.suffix} -> {dest_path.name}")
+        return True
+
+    async def put(self, key: str, path: Path) -> None:
+        """Keep a finished output under `key`. `path` stays usable by the caller."""
+        if not self.enabled:
+            return
+        size = path.stat().st_size
+        if size > self.max_bytes:
+            return
+        async with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)
+            SourceCache._link(path, self._path(key))
+            self.entries[key] = size
+            self.total_bytes += size
+            self.stats.stores += 1
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                old_key, old_size = self.entries.popitem(last=False)
+                self._path(old_key).unlink(missing_ok=True)
+                self.total_bytes -= old_size
+                self.stats.evictions += 1
+                self.stats.evicted_bytes += old_size
+            self._index.save()
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "maxBytes": self.max_bytes,
+            "hits": self.stats.hits,
+            "misses": self.stats.misses,
+            "stores": self.stats.stores,
+            "evictions": self.stats.evictions,
+            "evictedBytes": self.stats.evicted_bytes,
+        }
 
-    # Final fallback to DejaVu
-    print(f"[Font] Using DejaVu fallback for {font_family} {weight}: {dejavu_fallback}")
-    return dejavu_fallback
 
+render_cache = RenderCache(RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES)
+text_layer_cache = RenderCache(TEXT_LAYER_CACHE_DIR, TEXT_LAYER_CACHE_MAX_BYTES, suffix=".png")
 
-def hex_to_ffmpeg_color(color: str) -> tuple[str, float]:
+
+# ============================================
+# FFmpeg Helpers
+# ============================================
+
+# Scheduling priority of processes started in the current context (higher runs first);
+# set by StageGraph to the amount of work still queued behind a stage
+process_priority: contextvars.ContextVar[float] = contextvars.ContextVar("process_priority", default=0.0)
+
+
+class ProcessPool:
     """
-    Convert color to FFmpeg format.
-    Supports: #FFFFFF, rgba(0,0,0,0.7)
-    Returns: (color_hex, opacity)
+    Bounds how many subprocesses of one kind run at once.
+
+    Callers beyond the limit wait for a slot instead of oversubscribing the
+    CPU; freed slots go to the highest `process_priority` first, FIFO among
+    equals. Processes are spawned with asyncio, so waiting on them never
+    blocks the event loop.
     """
-    color = color.strip()
 
-    # Handle rgba() format
-    if color.startswith('rgba('):
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.running = 0
+        self.queued = 0
+        self.completed = 0
+        self._waiters: List[Tuple[float, int, asyncio.Future]] = []  # Heap of (-priority, arrival, future)
+        self._arrivals = itertools.count()
+
+    def _release(self) -> None:
+        """Hand a finished slot to the best waiter, or free it."""
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():  # Cancelled waiters are skipped
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.running < self.limit and not self._waiters:
+            self.running += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (-process_priority.get(), next(self._arrivals), waiter))
+            self.queued += 1
+            try:
+                await waiter  # Resolved with the slot already counted as running
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release()  # Got the slot just as we were cancelled: pass it on
+                raise
+            finally:
+                self.queued -= 1
         try:
-            # Extract rgba values: rgba(0,0,0,0.7)
-            inner = color[5:-1]  # Remove 'rgba(' and ')'
-            parts = [p.strip() for p in inner.split(',')]
-            r, g, b = int(parts[0]), int(parts[1]), int(parts[2])
-            a = float(parts[3])
-            hex_color = f"0x{r:02X}{g:02X}{b:02X}"
-            return hex_color, a
-        except (ValueError, IndexError):
-            return "0x000000", 1.0
+            yield
+        finally:
+            self.completed += 1
+            self._release()
+
+    async def run(self, cmd: List[str],
+                  on_stdout_line: Optional[Callable[[str], None]] = None,
+                  on_start: Optional[Callable[[], None]] = None) -> tuple[int, str, str]:
+        """
+        Run `cmd` in a slot. Returns (returncode, stdout, stderr).
+
+        With `on_stdout_line`, stdout is handed over line by line while the
+        process runs (and not returned); stderr is drained concurrently.
+        `on_start` is called once a slot is free, right before spawning.
+        """
+        async with self.slot():
+            if on_start:
+                on_start()
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                if on_stdout_line is None:
+                    stdout, stderr = await proc.communicate()
+                else:
+                    stderr_task = asyncio.create_task(proc.stderr.read())
+                    try:
+                        async for line in proc.stdout:
+                            on_stdout_line(line.decode(errors="replace").strip())
+                        stderr = await stderr_task
+                    finally:
+                        stderr_task.cancel()
+                    await proc.wait()
+                    stdout = b""
+            except asyncio.CancelledError:
+                # Don't leave an orphaned encoder running for a cancelled job
+                proc.kill()
+                await proc.wait()
+                raise
+            return proc.returncode, stdout.decode(errors="replace"), stderr.decode(errors="replace")
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "queued": self.queued,
+            "completed": self.completed,
+        }
 
-    # Handle rgb() format
-    if color.startswith('rgb('):
+
+ffmpeg_pool = ProcessPool("ffmpeg", FFMPEG_MAX_PROCESSES)
+ffprobe_pool = ProcessPool("ffprobe", FFPROBE_MAX_PROCESSES)
+encode_chunk_pool = ProcessPool("ffmpeg-chunks", ENCODE_CHUNK_WORKERS)
+
+
+@dataclass
+class FFmpegProgress:
+    """Snapshot of a running FFmpeg encode, from its `-progress` output."""
+    frames: int = 0
+    fps: float = 0.0
+    out_time: float = 0.0  # Seconds of output written so far
+    speed: float = 0.0  # Encode speed as a multiple of realtime
+    total_duration: Optional[float] = None  # Expected output duration, if known
+    elapsed: float = 0.0  # Wall-clock seconds since the process started
+    done: bool = False
+
+    @property
+    def fraction(self) -> Optional[float]:
+        if self.done:
+            return 1.0
+        if not self.total_duration:
+            return None
+        return min(self.out_time / self.total_duration, 1.0)
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        if self.done:
+            return 0.0
+        if not self.total_duration or self.out_time <= 0 or self.elapsed <= 0:
+            return None
+        rate = self.out_time / self.elapsed  # Output seconds per wall-clock second
+        return max(self.total_duration - self.out_time, 0.0) / rate
+
+
+class FFmpegProgressParser:
+    """
+    Incremental parser for FFmpeg's `-progress` key=value stream.
+
+    FFmpeg writes a block of keys (frame=, fps=, out_time_us=, speed=, ...)
+    terminated by `progress=continue` or `progress=end` roughly twice a
+    second. Each completed block produces a new FFmpegProgress.
+    """
+
+    def __init__(self, total_duration: Optional[float] = None):
+        self.progress = FFmpegProgress(total_duration=total_duration)
+        self._started = time.monotonic()
+
+    def start(self) -> None:
+        """Restart the elapsed clock, e.g. once the process leaves the pool queue."""
+        self._started = time.monotonic()
+
+    def feed(self, line: str) -> Optional[FFmpegProgress]:
+        """Consume one line. Returns a snapshot when a block is complete."""
+        key, sep, value = line.partition("=")
+        if not sep:
+            return None
+        key, value = key.strip(), value.strip()
+        p = self.progress
         try:
-            inner = color[4:-1]
-            parts = [p.strip() for p in inner.split(',')]
-            r, g, b = int(parts[0]), int(parts[1]), int(parts[2])
-            hex_color = f"0x{r:02X}{g:02X}{b:02X}"
-            return hex_color, 1.0
-        except (ValueError, IndexError):
-            return "0x000000", 1.0
+            if key == "frame":
+                p.frames = int(value)
+            elif key == "fps":
+                p.fps = float(value)
+            elif key in ("out_time_us", "out_time_ms"):  # Both are microseconds
+                p.out_time = max(int(value), 0) / 1_000_000
+            elif key == "speed":
+                p.speed = float(value.rstrip("x")) if value not in ("N/A", "") else 0.0
+        except ValueError:
+            return None  # "N/A" and friends early in the encode
+
+        if key != "progress":
+            return None
+        p.elapsed = time.monotonic() - self._started
+        p.done = value == "end"
+        return FFmpegProgress(**vars(p))
+
+
+# Receives progress of every FFmpeg run in the current context (e.g. an export job)
+ffmpeg_progress_sink: contextvars.ContextVar[Optional[Callable[[FFmpegProgress], None]]] = \
+    contextvars.ContextVar("ffmpeg_progress_sink", default=None)
+
+
+@contextmanager
+def report_ffmpeg_progress(callback: Callable[[FFmpegProgress], None]):
+    """Send progress of FFmpeg runs inside this block to `callback`."""
+    token = ffmpeg_progress_sink.set(callback)
+    try:
+        yield
+    finally:
+        ffmpeg_progress_sink.reset(token)
 
-    # Handle hex format (#FFFFFF or FFFFFF)
-    hex_color = color.lstrip('#')
-    return f"0x{hex_color}", 1.0
 
+async def run_ffmpeg(args: List[str], expected_duration: Optional[float] = None,
+                     pool: Optional[ProcessPool] = None) -> FFmpegProgress:
+    """
+    Run FFmpeg command on the bounded process pool and handle errors.
 
-def escape_text_for_drawtext(text: str) -> str:
+    Progress is parsed live from `-progress pipe:1` and forwarded to the
+    current `ffmpeg_progress_sink`. `expected_duration` (seconds of output)
+    enables percent and ETA. Returns the final progress snapshot. `pool`
+    defaults to ffmpeg_pool; chunks of a chunked encode use encode_chunk_pool.
     """
-    Escape special characters for FFmpeg drawtext filter.
+    cmd = ["ffmpeg", "-y", "-nostats", "-progress", "pipe:1"] + args
+    print(f"[FFmpeg] Running: {' '.join(cmd)}")
 
-    For multiline text, we use a text file instead (see build_drawtext_filter).
-    This function handles single-line text escaping.
+    parser = FFmpegProgressParser(expected_duration)
+    sink = ffmpeg_progress_sink.get()
+
+    def on_line(line: str) -> None:
+        snapshot = parser.feed(line)
+        if snapshot and sink:
+            sink(snapshot)
+
+    returncode, _, stderr = await (pool or ffmpeg_pool).run(cmd, on_stdout_line=on_line, on_start=parser.start)
+
+    if returncode != 0:
+        print(f"[FFmpeg] Error: {stderr}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"FFmpeg error: {stderr[-500:]}"
+        )
+
+    final = parser.progress
+    print(f"[FFmpeg] Command completed successfully: {final.frames} frames, "
+          f"{final.out_time:.1f}s of output in {final.elapsed:.1f}s ({final.speed:.2f}x realtime)")
+    return final
+
+
+class EncodeSpeedStats:
     """
-    # FFmpeg drawtext needs special escaping
-    text = text.replace("\\", "\\\\\\\\")  # Backslash
-    text = text.replace("'", "\\\\'")  # Single quote
-    text = text.replace(":", "\\\\:")  # Colon
-    text = text.replace("[", "\\\\[")  # Brackets
-    text = text.replace("]", "\\\\]")
-    text = text.replace("%", "\\\\%")  # Percent
-    return text
+    Throughput of full-output encodes, single-process vs chunked.
 
+    `realtime` is seconds of output per wall-clock second of encoding; the
+    chunked entry's `speedup` is its realtime over the single-process one.
+    """
 
-def split_text_into_lines(text: str) -> list[str]:
-    """Split text into lines, normalizing line endings."""
-    text = text.replace("\r\n", "\n").replace("\r", "\n")
-    return text.split("\n")
+    def __init__(self):
+        self.modes: Dict[str, Dict[str, float]] = {}
 
+    def record(self, mode: str, output_seconds: float, wall_seconds: float) -> None:
+        entry = self.modes.setdefault(mode, {"encodes": 0, "outputSeconds": 0.0, "wallSeconds": 0.0})
+        entry["encodes"] += 1
+        entry["outputSeconds"] += output_seconds
+        entry["wallSeconds"] += wall_seconds
 
-def remap_overlay_times_to_concatenated_timeline(
-    overlays: List[TextOverlay],
-    sorted_clips: List[VideoClip],
-    transitions: Optional[List] = None
-) -> List[TextOverlay]:
+    def realtime(self, mode: str) -> Optional[float]:
+        entry = self.modes.get(mode)
+        if not entry or entry["wallSeconds"] <= 0:
+            return None
+        return entry["outputSeconds"] / entry["wallSeconds"]
+
+    def snapshot(self) -> dict:
+        result = {}
+        for mode, entry in self.modes.items():
+            info = {key: round(value, 2) for key, value in entry.items()}
+            info["realtime"] = round(self.realtime(mode) or 0.0, 2)
+            result[mode] = info
+        single, chunked = self.realtime("single"), self.realtime("chunked")
+        if single and chunked:
+            result["chunked"]["speedup"] = round(chunked / single, 2)
+        return result
+
+
+encode_stats = EncodeSpeedStats()
+
+
+def chunk_encode_args(video_args: List[str]) -> List[str]:
+    """Video encode args of one chunk: the same encoder settings, closed GOPs, a share of the cores."""
+    return [*video_args, "-flags", "+cgop", "-threads", str(ENCODE_CHUNK_THREADS)]
+
+
+def plan_chunk_ranges(
+    duration: float,
+    snap: Callable[[float], Optional[float]],
+    chunk_seconds: Optional[float] = None,
+) -> List[Tuple[float, float]]:
     """
-    Remap text overlay times from editor timeline to concatenated video timeline.
+    Split [0, duration] into ranges of about `chunk_seconds` for chunked encoding.
 
-    The editor timeline has clips positioned with gaps (based on clip.startTime),
-    but the concatenated video has clips joined sequentially with no gaps.
+    `snap` moves a proposed cut to the nearest safe boundary at or after it
+    (or returns None if there is none). Cuts leaving less than half a chunk
+    are dropped, so the last range absorbs the remainder. A single range
+    means the output is too short to be worth splitting.
+    """
+    chunk_seconds = ENCODE_CHUNK_SECONDS if chunk_seconds is None else chunk_seconds
+    if chunk_seconds <= 0 or duration < 2 * chunk_seconds:
+        return [(0.0, duration)]
+    cuts = [0.0]
+    target = chunk_seconds
+    while target < duration:
+        cut = snap(target)
+        if cut is None or duration - cut < chunk_seconds / 2:
+            break
+        if cut - cuts[-1] >= chunk_seconds / 2:
+            cuts.append(cut)
+        target = max(cut, target) + chunk_seconds
+    cuts.append(duration)
+    return list(zip(cuts, cuts[1:]))
+
+
+async def run_chunked_encode(label: str, commands: List[Tuple[List[str], float]], total_duration: float) -> None:
+    """
+    Run the chunk encodes of one output in parallel and report their speedup
+    over the single-process encodes seen so far.
 
-    This function calculates where each overlay should appear in the final video.
+    Holds a single ffmpeg_pool slot for the whole output (so it counts as one
+    encode against FFMPEG_MAX_PROCESSES) and runs the chunks on
+    encode_chunk_pool. Chunk progress is summed into one report for the
+    current progress sink.
+    """
+    sink = ffmpeg_progress_sink.get()
+    done_seconds = [0.0] * len(commands)
+    frames = [0] * len(commands)
+    started = time.monotonic()
+
+    def chunk_reporter(i: int) -> Callable[[FFmpegProgress], None]:
+        def report(p: FFmpegProgress) -> None:
+            done_seconds[i] = p.out_time if not p.done else (p.total_duration or p.out_time)
+            frames[i] = p.frames
+            if sink:
+                elapsed = time.monotonic() - started
+                out_time = sum(done_seconds)
+                sink(FFmpegProgress(
+                    frames=sum(frames),
+                    out_time=out_time,
+                    speed=out_time / elapsed if elapsed > 0 else 0.0,
+                    total_duration=total_duration,
+                    elapsed=elapsed,
+                ))
+        return report
+
+    async def run_chunk(i: int, args: List[str], duration: float) -> FFmpegProgress:
+        with report_ffmpeg_progress(chunk_reporter(i)):
+            return await run_ffmpeg(args, expected_duration=duration, pool=encode_chunk_pool)
+
+    async with ffmpeg_pool.slot():
+        started = time.monotonic()
+        await asyncio.gather(*(run_chunk(i, args, d) for i, (args, d) in enumerate(commands)))
+    wall = time.monotonic() - started
+    encode_stats.record("chunked", total_duration, wall)
+
+    realtime = total_duration / max(wall, 1e-6)
+    single = encode_stats.realtime("single")
+    vs_single = (f", {realtime / single:.2f}x the single-process average of {single:.2f}x realtime"
+                 if single else "")
+    print(f"[Chunked] {label}: {len(commands)} chunks on {min(len(commands), ENCODE_CHUNK_WORKERS)} workers, "
+          f"{total_duration:.1f}s of output in {wall:.1f}s ({realtime:.2f}x realtime{vs_single})")
+
+
+async def trim_video(input_path: Path, output_path: Path, start_time: float, duration: float,
+               audio_volume: Optional[float] = None, audio_muted: bool = False,
+               mode: Optional[str] = None, content_id: Optional[str] = None) -> None:
+    """
+    Trim video with frame-accurate cuts.
+
+    In 'smart' mode (TRIM_MODE default) only the partial GOPs at the cut points
+    are re-encoded and everything between is stream-copied; see smart_trim_video.
+    Falls back to the 'accurate' full re-encode when that isn't possible.
 
     Args:
-        overlays: List of text overlays with editor timeline positions
-        sorted_clips: Clips sorted by their editor timeline startTime
-        transitions: Optional list of transitions (affects timing due to overlap)
+        audio_volume: Volume level 0.0-2.0. None means no adjustment (default volume).
+                      Values >1.0 boost the audio (up to 200%). 0.0 strips audio.
+        audio_muted: If True, strips audio entirely from the output.
+        mode: 'smart' or 'accurate'. Defaults to TRIM_MODE.
+        content_id: Source content hash, if known; lets the keyframe index persist.
+    """
+    if (mode or TRIM_MODE) == "smart":
+        if await smart_trim_video(input_path, output_path, start_time, duration,
+                                  audio_volume=audio_volume, audio_muted=audio_muted,
+                                  content_id=content_id):
+            return
+    await _trim_video_accurate(input_path, output_path, start_time, duration,
+                               audio_volume=audio_volume, audio_muted=audio_muted,
+                               content_id=content_id)
+
+
+async def _trim_video_accurate(input_path: Path, output_path: Path, start_time: float, duration: float,
+                               audio_volume: Optional[float] = None, audio_muted: bool = False,
+                               content_id: Optional[str] = None) -> None:
+    """
+    Trim video using FFmpeg with re-encoding for frame-accurate cuts.
 
-    Returns:
-        New list of TextOverlay objects with adjusted startTime values
+    Uses -i before -ss for accurate seeking (input-based seeking with re-encode).
+    Re-encodes with high quality settings (CRF 18) for near-lossless output.
+    This approach ensures exact frame trimming regardless of keyframe positions.
+    Muted clips and clips without audio get a silent track.
     """
-    if not overlays or not sorted_clips:
-        return overlays or []
+    end_time = start_time + duration
+    media = await probe_media(input_path, content_id)
 
-    # Build a mapping from editor timeline to concatenated timeline
-    # For each clip, we need:
-    # - editor_start: when it starts in the editor timeline
-    # - editor_end: when it ends in the editor timeline
-    # - concat_start: when it starts in the concatenated video
-    # - concat_end: when it ends in the concatenated video
+    cmd = ["-i", str(input_path)]
+    if audio_muted or not media.has_audio:
+        # Silent track instead of none, so segments stay concat-compatible
+        cmd.extend(["-f", "lavfi", "-i", SEGMENT_SILENCE_SOURCE, "-map", "0:v:0", "-map", "1:a:0"])
+    elif audio_volume is not None and audio_volume != 1.0:
+        # Apply volume filter
+        cmd.extend(["-map", "0:v:0", "-map", "0:a:0", "-af", f"volume={audio_volume}"])
+    else:
+        # Default: re-encode audio without volume change
+        cmd.extend(["-map", "0:v:0", "-map", "0:a:0"])
+
+    cmd.extend([
+        "-ss", str(start_time),
+        "-to", str(end_time),
+        *SEGMENT_VIDEO_ENCODE_ARGS,
+        *SEGMENT_AUDIO_ENCODE_ARGS,
+        "-avoid_negative_ts", "make_zero",
+        str(output_path)
+    ])
+
+    await run_ffmpeg(cmd, expected_duration=duration)
+
+
+def is_segment_compatible(media: "MediaInfo") -> bool:
+    """Whether a source already matches the segment encoding and can be joined as-is."""
+    video, audio = media.video, media.audio
+    return (
+        video is not None and video.codecName == "h264" and video.pixFmt == "yuv420p"
+        and video.profile == SEGMENT_H264_PROFILE and video.level is not None
+        and audio is not None and audio.codecName == "aac"
+        and audio.sampleRate == 48000 and audio.channels == 2
+    )
+
+
+def segment_signature(media: "MediaInfo") -> Optional[tuple]:
+    """
+    What segments joined by stream copy must share (the stream parameters
+    the output's single codec configuration describes), or None when the
+    file isn't in the segment encoding at all.
+    """
+    if not is_segment_compatible(media):
+        return None
+    video = media.video
+    return video.profile, video.level, media.dimensions, media.frame_rate
+
+
+def segments_uniform(clip_media: List["MediaInfo"]) -> bool:
+    """Whether files can be joined by stream copy into one valid stream."""
+    signatures = {segment_signature(media) for media in clip_media}
+    return len(signatures) == 1 and None not in signatures
+
+
+def plan_smart_trim(index: "KeyframeIndex", start: float, end: float) -> Optional[List[tuple[float, float, bool]]]:
+    """
+    Split [start, end) into (piece_start, piece_end, stream_copy) pieces.
+
+    The span between the first and last keyframe inside the range is
+    stream-copied; the partial GOPs before and after it are re-encoded.
+    Returns None when too little can be copied for a smart trim to pay off.
+    """
+    eps = 0.001
+    first_key = index.at_or_after(start - eps)
+    last_key = index.at_or_before(end + eps)
+    if first_key is None or last_key is None or last_key - first_key < SMART_TRIM_MIN_COPY_SECONDS:
+        return None
+
+    pieces = []
+    if first_key - start > eps:
+        pieces.append((start, first_key, False))
+    pieces.append((first_key, last_key, True))
+    if end - last_key > eps:
+        pieces.append((last_key, end, False))
+    return pieces
+
+
+async def smart_trim_video(input_path: Path, output_path: Path, start_time: float, duration: float,
+                           audio_volume: Optional[float] = None, audio_muted: bool = False,
+                           content_id: Optional[str] = None) -> bool:
+    """
+    Frame-accurate trim that re-encodes only the partial GOPs at each cut.
+
+    Video is split at the first and last keyframe inside the range: the
+    middle is stream-copied, the head and tail are re-encoded with the segment
+    encoding. Pieces are written as MPEG-TS and joined losslessly with the
+    concat demuxer. Audio is cheap to encode, so the whole range is re-encoded
+    once (with the volume filter, or as silence when muted) and muxed back in.
+
+    The output is one MP4 video stream, so the copied GOPs and the
+    re-encoded ones must share their stream parameters: the source has to be
+    in the segment encoding already (H.264 High, yuv420p), and the re-encoded
+    pieces must come out at the source's profile and level.
+
+    Returns False without writing anything when the source isn't in the
+    segment encoding, the range doesn't span enough keyframes, or the
+    re-encoded pieces don't match the copied ones; the caller then re-encodes.
+    """
+    end_time = start_time + duration
+    media = await probe_media(input_path, content_id)
+    video = media.video
+    if video is None or video.codecName != "h264" or video.pixFmt != "yuv420p" or video.profile != SEGMENT_H264_PROFILE:
+        # Copied GOPs must already match the segment encoding
+        print(f"[SmartTrim] Source {video.codecName if video else None}/{video.pixFmt if video else None}/"
+              f"{video.profile if video else None} doesn't match segment encoding, re-encoding")
+        return False
+
+    pieces = plan_smart_trim(await keyframe_index.get(input_path, content_id), start_time, end_time)
+    if pieces is None:
+        print(f"[SmartTrim] Not enough keyframes in {start_time:.2f}-{end_time:.2f}s, re-encoding")
+        return False
+
+    parts_dir = output_path.parent / f"{output_path.stem}_parts"
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    encoded_seconds = sum(e - s for s, e, copy in pieces if not copy)
+    print(f"[SmartTrim] {input_path.name}: re-encoding {encoded_seconds:.2f}s of {duration:.2f}s, pieces={pieces}")
+
+    piece_paths, commands = video_piece_commands(input_path, [
+        (piece_start, piece_end, None if copy else SEGMENT_VIDEO_ENCODE_ARGS)
+        for piece_start, piece_end, copy in pieces
+    ], parts_dir)
+
+    audio_path = parts_dir / "audio.m4a"
+    if media.has_audio and not audio_muted:
+        audio_filter = ["-af", f"volume={audio_volume}"] if audio_volume is not None and audio_volume != 1.0 else []
+        audio_input = ["-ss", str(start_time), "-i", str(input_path), "-t", str(duration), "-vn", *audio_filter]
+    else:
+        audio_input = ["-f", "lavfi", "-t", str(duration), "-i", SEGMENT_SILENCE_SOURCE]
+    commands.append(([*audio_input, *SEGMENT_AUDIO_ENCODE_ARGS, str(audio_path)], duration))
+
+    # Pieces are independent - let the process pool run them side by side
+    await asyncio.gather(*(run_ffmpeg(args, expected_duration=d) for args, d in commands))
+    encoded = [path for path, (_, _, copy) in zip(piece_paths, pieces) if not copy]
+    if not await pieces_match_source(encoded, video, "SmartTrim"):
+        await asyncio.to_thread(shutil.rmtree, parts_dir, ignore_errors=True)
+        return False
+    await join_video_pieces(piece_paths, audio_path, output_path, parts_dir, duration)
+
+    await asyncio.to_thread(shutil.rmtree, parts_dir, ignore_errors=True)
+    return True
+
+
+async def pieces_match_source(paths: List[Path], video: MediaStream, tag: str) -> bool:
+    """
+    Whether re-encoded pieces came out at the source stream's profile and
+    level, so they can share one MP4 video stream with its copied GOPs.
+    """
+    for piece in await asyncio.gather(*(probe_media(path) for path in paths)):
+        if (piece.video.profile, piece.video.level) != (video.profile, video.level):
+            print(f"[{tag}] Re-encoded pieces come out at {piece.video.profile} {piece.video.level}, "
+                  f"source is {video.profile} {video.level}; re-encoding")
+            return False
+    return True
+
+
+def video_piece_commands(
+    input_path: Path,
+    pieces: List[tuple],
+    parts_dir: Path,
+    frame_rate: Optional[float] = None,
+) -> Tuple[List[Path], List[Tuple[List[str], Optional[float]]]]:
+    """
+    FFmpeg commands cutting the first video stream of `input_path` into MPEG-TS pieces.
+
+    Each piece is (start, end, encode_args) or (start, end, encode_args,
+    extra_inputs). encode_args=None stream-copies the range, so start (and end,
+    unless it's the end of the video) must be keyframes; otherwise the range is
+    re-encoded with those args, which may include a -vf, or a -filter_complex
+    over extra_inputs with its own -map. With `frame_rate` (closed-GOP input),
+    copied ranges are cut by frame count, which stops exactly at the next GOP
+    where a time limit lets B-frame reordering pull in a frame or two of it.
+    Returns (piece paths, [(ffmpeg args, expected duration)]).
+    """
+    piece_paths = []
+    commands = []
+    for i, (piece_start, piece_end, encode_args, *rest) in enumerate(pieces):
+        extra_inputs = rest[0] if rest else []
+        piece_path = parts_dir / f"piece_{i}.ts"
+        piece_paths.append(piece_path)
+        if encode_args is None:
+            # Nudge the seek past float rounding of the keyframe timestamp (it still
+            # snaps back to that keyframe) and stop just short of the next one
+            video_args = ["-c:v", "copy", "-bsf:v", "h264_mp4toannexb"]
+            seek, piece_duration = piece_start + 0.001, piece_end - piece_start - 0.002
+            if frame_rate:
+                video_args = ["-frames:v", str(round((piece_end - piece_start) * frame_rate)), *video_args]
+        else:
+            video_args = encode_args
+            seek, piece_duration = piece_start, piece_end - piece_start
+        commands.append(([
+            "-ss", f"{seek:.3f}",
+            "-i", str(input_path),
+            *extra_inputs,
+            *([] if encode_args is None and frame_rate else ["-t", f"{piece_duration:.3f}"]),
+            *([] if "-map" in video_args else ["-map", "0:v:0"]),
+            *video_args,
+            "-f", "mpegts",
+            str(piece_path),
+        ], None if encode_args is None else piece_end - piece_start))
+    return piece_paths, commands
+
+
+async def join_video_pieces(
+    piece_paths: List[Path],
+    audio_source: Optional[Path],
+    output_path: Path,
+    parts_dir: Path,
+    expected_duration: Optional[float] = None,
+) -> None:
+    """
+    Join MPEG-TS video pieces with the concat demuxer, muxing in the first
+    audio stream of `audio_source` (if it has one). Everything is stream-copied.
+    """
+    concat_list_path = parts_dir / "concat_list.txt"
+    with open(concat_list_path, "w") as f:
+        for path in piece_paths:
+            f.write(f"file '{path}'\n")
+
+    mux_args = ["-f", "concat", "-safe", "0", "-i", str(concat_list_path)]
+    if audio_source is not None:
+        mux_args += ["-i", str(audio_source), "-map", "0:v:0", "-map", "1:a:0?"]
+    mux_args += ["-c", "copy", "-avoid_negative_ts", "make_zero", str(output_path)]
+    await run_ffmpeg(mux_args, expected_duration=expected_duration)
+
+
+async def concatenate_videos(input_paths: List[Path], output_path: Path, work_dir: Path) -> None:
+    """
+    Concatenate videos using FFmpeg concat demuxer (lossless for same-codec files).
+
+    Stream copy needs every input to share one encoding; inputs that don't
+    (see segments_uniform) are joined by re-encoding instead.
+    """
+    if len(input_paths) == 1:
+        # Single file - just copy
+        await asyncio.to_thread(shutil.copy, input_paths[0], output_path)
+        return
+
+    clip_media = await asyncio.gather(*(probe_media(path) for path in input_paths))
+    if not segments_uniform(clip_media):
+        print(f"[Concat] Inputs differ in encoding ({', '.join(sorted({str(segment_signature(m)) for m in clip_media}))}), re-encoding the join")
+        await _concatenate_reencoded(input_paths, clip_media, output_path)
+        return
+
+    # Create concat list file (named after the output; several joins may run at once)
+    concat_list_path = work_dir / f"{output_path.stem}_concat_list.txt"
+    with open(concat_list_path, "w") as f:
+        for path in input_paths:
+            f.write(f"file '{path}'\n")
+
+    await run_ffmpeg([
+        "-f", "concat",
+        "-safe", "0",
+        "-i", str(concat_list_path),
+        "-c", "copy",
+        str(output_path)
+    ])
+
+
+async def _concatenate_reencoded(input_paths: List[Path], clip_media: List["MediaInfo"], output_path: Path) -> None:
+    """Join files of differing encodings with the concat filter, in the segment encoding of the first one's size."""
+    width, height = clip_media[0].dimensions
+    frame_rate = clip_media[0].frame_rate
+    inputs = []
+    filters = []
+    for i, (path, media) in enumerate(zip(input_paths, clip_media)):
+        inputs += ["-i", str(path)]
+        filters.append(
+            f"[{i}:v]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={frame_rate},format=yuv420p[v{i}]"
+        )
+        if media.has_audio:
+            filters.append(f"[{i}:a]aformat=sample_rates=48000:channel_layouts=stereo[a{i}]")
+        else:
+            filters.append(f"{SEGMENT_SILENCE_SOURCE},atrim=duration={media.duration}[a{i}]")
+    joined = "".join(f"[v{i}][a{i}]" for i in range(len(input_paths)))
+    filters.append(f"{joined}concat=n={len(input_paths)}:v=1:a=1[vout][aout]")
+    await run_ffmpeg([
+        *inputs,
+        "-filter_complex", ";\n".join(filters),
+        "-map", "[vout]", "-map", "[aout]",
+        *SEGMENT_VIDEO_ENCODE_ARGS,
+        *SEGMENT_AUDIO_ENCODE_ARGS,
+        str(output_path),
+    ], expected_duration=sum(media.duration for media in clip_media))
+
+
+async def concatenate_videos_with_transitions(
+    input_paths: List[Path],
+    clip_durations: List[float],
+    transitions: List[dict],  # List of {fromIndex, toIndex, type, duration}
+    output_path: Path,
+    work_dir: Path
+) -> None:
+    """
+    Concatenate videos with transitions using FFmpeg xfade filter.
+
+    The xfade filter works by:
+    1. Taking two input streams
+    2. Applying a transition effect for a specified duration
+    3. The offset is where the transition starts (end of first clip minus transition duration)
+
+    For multiple clips with transitions, we need to chain xfade filters:
+    [0][1]xfade=...[v01]; [v01][2]xfade=...[v012]; ...
+    """
+    if len(input_paths) == 1:
+        # Single file - just copy
+        await asyncio.to_thread(shutil.copy, input_paths[0], output_path)
+        return
+
+    if not transitions:
+        # No transitions - use regular concat
+        await concatenate_videos(input_paths, output_path, work_dir)
+        return
+
+    # Build transition map: fromIndex -> transition
+    transition_map = {t['fromClipIndex']: t for t in transitions}
+
+    if TRANSITION_RENDER_MODE == "overlap" and await concatenate_with_overlap_transitions(
+        input_paths, clip_durations, transition_map, output_path, work_dir
+    ):
+        return
+
+    # Check if all clips have transitions between them
+    # If not all clips have transitions, we need a more complex approach
+    has_all_transitions = all(i in transition_map for i in range(len(input_paths) - 1))
+
+    if not has_all_transitions:
+        # Mixed case: some transitions, some hard cuts
+        # For simplicity, we'll process this in segments and then concat
+        print(f"[Transitions] Mixed transitions detected, using segment-based approach")
+        await _concatenate_with_mixed_transitions(
+            input_paths, clip_durations, transition_map, output_path, work_dir
+        )
+        return
+
+    # All consecutive clips have transitions - use chained xfade
+    print(f"[Transitions] All clips have transitions, using chained xfade")
+    await _concatenate_with_chained_xfade(
+        input_paths, clip_durations, transition_map, output_path, work_dir
+    )
+
+
+def plan_overlap_pieces(
+    indexes: List["KeyframeIndex"],
+    clip_durations: List[float],
+    transition_map: dict,
+) -> Optional[List[tuple]]:
+    """
+    Split a join into clip bodies and transition overlaps.
+
+    Each transition's overlap is widened outward to keyframes: from the last
+    keyframe of clip i at or before the transition starts, to the first
+    keyframe of clip i+1 at or after it ends. Returns pieces in output order,
+    ('body', i, start, end) to stream-copy and ('overlap', i, tail_start,
+    head_end) to re-encode, or None when the clips' keyframes don't allow it.
+    """
+    n = len(clip_durations)
+    heads, tails = [], []
+    for i, (index, duration) in enumerate(zip(indexes, clip_durations)):
+        first = index.at_or_after(0.0)
+        if first is None or first > 0.05:
+            return None
+        incoming = transition_map.get(i - 1) if i > 0 else None
+        outgoing = transition_map.get(i) if i < n - 1 else None
+        head_end = tail_start = None
+        if incoming:
+            head_end = index.at_or_after(incoming['duration'])
+        if outgoing:
+            tail_start = index.at_or_before(duration - outgoing['duration'])
+        head_end = 0.0 if not incoming else head_end
+        tail_start = duration if not outgoing else tail_start
+        # A clip shorter than its transitions leaves nothing to copy between them
+        if head_end is None or tail_start is None or head_end > tail_start or head_end >= duration:
+            return None
+        heads.append(head_end)
+        tails.append(tail_start)
+
+    pieces = []
+    for i in range(n):
+        if tails[i] - heads[i] > 0.001:
+            pieces.append(('body', i, heads[i], tails[i]))
+        if i < n - 1 and i in transition_map:
+            pieces.append(('overlap', i, tails[i], heads[i + 1]))
+    return pieces
+
+
+async def concatenate_with_overlap_transitions(
+    input_paths: List[Path],
+    clip_durations: List[float],
+    transition_map: dict,
+    output_path: Path,
+    work_dir: Path
+) -> bool:
+    """
+    Join clips re-encoding only the overlap around each transition.
+
+    Clip bodies are stream-copied between keyframes; each transition is one
+    short encode of the tail of clip i xfaded into the head of clip i+1. The
+    audio (crossfades and hard cuts) is mixed in one audio-only pass, and
+    everything is joined with the concat demuxer, so the cost scales with the
+    total transition length instead of the timeline length. Returns False
+    without writing anything when the clips aren't uniform segments; the
+    caller then renders the whole join.
+    """
+    clip_media = await asyncio.gather(*(probe_media(path) for path in input_paths))
+    if not segments_uniform(clip_media):
+        return False
+
+    indexes = await asyncio.gather(*(keyframe_index.get(path) for path in input_paths))
+    pieces = plan_overlap_pieces(indexes, clip_durations, transition_map)
+    if pieces is None:
+        print("[Transitions] Clip keyframes don't bracket the transitions, rendering the whole join")
+        return False
+
+    parts_dir = work_dir / f"{output_path.stem}_overlaps"
+    parts_dir.mkdir(parents=True, exist_ok=True)
+
+    # xfade needs a constant frame rate, which setpts clears; all clips share one
+    frame_rate = clip_media[0].frame_rate
+    piece_paths = []
+    commands = []
+    reencoded = 0.0
+    for piece_idx, (kind, i, start, end) in enumerate(pieces):
+        piece_dir = parts_dir / f"piece_{piece_idx}"
+        piece_dir.mkdir(exist_ok=True)
+        if kind == 'body':
+            spec = (start, end, None)
+        else:
+            trans = transition_map[i]
+            tail = clip_durations[i] - start
+            length = tail + end - trans['duration']
+            reencoded += length
+            spec = (start, start + length, [
+                "-filter_complex",
+                f"[0:v]setpts=PTS-STARTPTS,fps={frame_rate}[tail]; "
+                f"[1:v]setpts=PTS-STARTPTS,fps={frame_rate}[head]; "
+                f"[tail][head]xfade=transition={trans['type']}:duration={trans['duration']}"
+                f":offset={tail - trans['duration']:.6f}[v]",
+                "-map", "[v]",
+                *SEGMENT_VIDEO_ENCODE_ARGS,
+            ], ["-t", f"{end:.6f}", "-i", str(input_paths[i + 1])])
+        paths, piece_commands = video_piece_commands(input_paths[i], [spec], piece_dir,
+                                                     float(Fraction(frame_rate)))
+        piece_paths.extend(paths)
+        commands.extend(piece_commands)
+
+    # Audio: every clip padded/trimmed to its video length, then crossfaded or cut
+    audio_inputs = []
+    audio_filters = []
+    current = None
+    total_duration = clip_durations[0]
+    for i, (path, duration) in enumerate(zip(input_paths, clip_durations)):
+        audio_inputs.extend(["-vn", "-i", str(path)])
+        audio_filters.append(f"[{i}:a]apad=whole_dur={duration},atrim=end={duration},asetpts=PTS-STARTPTS[a{i}]")
+        if current is None:
+            current = f"[a{i}]"
+            continue
+        trans = transition_map.get(i - 1)
+        if trans:
+            audio_filters.append(f"{current}[a{i}]acrossfade=d={trans['duration']}[x{i}]")
+            total_duration += duration - trans['duration']
+        else:
+            audio_filters.append(f"{current}[a{i}]concat=n=2:v=0:a=1[x{i}]")
+            total_duration += duration
+        current = f"[x{i}]"
+    audio_path = parts_dir / "audio.m4a"
+    commands.append(([
+        *audio_inputs,
+        "-filter_complex", "; ".join(audio_filters),
+        "-map", current,
+        *SEGMENT_AUDIO_ENCODE_ARGS,
+        str(audio_path),
+    ], total_duration))
+
+    print(f"[Transitions] Re-encoding {reencoded:.2f}s of {total_duration:.2f}s in "
+          f"{sum(1 for p in pieces if p[0] == 'overlap')} overlap(s), copying the clip bodies")
+    await asyncio.gather(*(run_ffmpeg(args, expected_duration=d) for args, d in commands))
+    await join_video_pieces(piece_paths, audio_path, output_path, parts_dir, total_duration)
+
+    await asyncio.to_thread(shutil.rmtree, parts_dir, ignore_errors=True)
+    return True
+
+
+async def _concatenate_with_chained_xfade(
+    input_paths: List[Path],
+    clip_durations: List[float],
+    transition_map: dict,
+    output_path: Path,
+    work_dir: Path
+) -> None:
+    """
+    Concatenate all clips with xfade transitions between each pair.
+
+    For N clips with transitions between all of them:
+    - Input 0 and 1 get xfade -> v01
+    - v01 and Input 2 get xfade -> v012
+    - etc.
+
+    The offset for each transition is calculated as:
+    - For first transition: duration of clip 0 - transition_duration
+    - For subsequent: accumulated_duration - transition_duration
+    """
+    n = len(input_paths)
+
+    # Build FFmpeg inputs
+    inputs = []
+    for i, path in enumerate(input_paths):
+        inputs.extend(["-i", str(path)])
+
+    # Build filter_complex
+    # For 2 clips: [0:v][1:v]xfade=transition=fade:duration=0.5:offset=4.5[outv]; [0:a][1:a]acrossfade=d=0.5[outa]
+    # For 3 clips: [0:v][1:v]xfade=...:[v01]; [v01][2:v]xfade=...:[v012]
+
+    filter_parts = []
+    audio_filter_parts = []
+
+    # Calculate running offset (accumulated duration minus transitions)
+    running_duration = clip_durations[0]
+
+    for i in range(n - 1):
+        trans = transition_map.get(i)
+        if not trans:
+            trans = {'type': 'fade', 'duration': 0.5}
+
+        trans_type = trans['type']
+        trans_duration = trans['duration']
+
+        # Calculate offset: where transition starts
+        # For first transition: end of clip 0 minus transition duration
+        # For subsequent: running duration minus transition duration
+        if i == 0:
+            offset = clip_durations[0] - trans_duration
+        else:
+            # Accumulated duration (minus previous transitions) minus this transition
+            offset = running_duration - trans_duration
+
+        # Video xfade
+        if i == 0:
+            # First transition: inputs are [0:v] and [1:v]
+            in1 = "[0:v]"
+            in2 = "[1:v]"
+        else:
+            # Subsequent: previous output and next input
+            in1 = f"[v{i-1}]"
+            in2 = f"[{i+1}:v]"
+
+        # Output label
+        if i == n - 2:
+            # Last transition - final output
+            out_label = "[outv]"
+        else:
+            out_label = f"[v{i}]"
+
+        filter_parts.append(
+            f"{in1}{in2}xfade=transition={trans_type}:duration={trans_duration}:offset={offset}{out_label}"
+        )
+
+        # Audio crossfade
+        if i == 0:
+            ain1 = "[0:a]"
+            ain2 = "[1:a]"
+        else:
+            ain1 = f"[a{i-1}]"
+            ain2 = f"[{i+1}:a]"
+
+        if i == n - 2:
+            aout_label = "[outa]"
+        else:
+            aout_label = f"[a{i}]"
+
+        audio_filter_parts.append(
+            f"{ain1}{ain2}acrossfade=d={trans_duration}{aout_label}"
+        )
+
+        # Update running duration: add next clip duration, subtract transition overlap
+        running_duration = running_duration + clip_durations[i + 1] - trans_duration
+
+    # Combine video and audio filters
+    filter_complex = "; ".join(filter_parts + audio_filter_parts)
+
+    print(f"[Transitions] Filter complex: {filter_complex[:500]}...")
+
+    cmd = inputs + [
+        "-filter_complex", filter_complex,
+        "-map", "[outv]",
+        "-map", "[outa]",
+        *EXPORT_VIDEO_ENCODE_ARGS,
+        *EXPORT_AUDIO_ENCODE_ARGS,
+        str(output_path)
+    ]
+
+    # Long joins: the same timeline as independent chunks encoded in parallel
+    if running_duration >= 2 * ENCODE_CHUNK_SECONDS > 0:
+        clip_media = await asyncio.gather(*(probe_media(path) for path in input_paths))
+        timeline = [
+            TimelineClip(path=path, media=media, start=0.0, duration=clip_durations[i])
+            for i, (path, media) in enumerate(zip(input_paths, clip_media))
+        ]
+        transitions = [
+            {**transition_map.get(i, {'type': 'fade', 'duration': 0.5}), 'fromClipIndex': i, 'toClipIndex': i + 1}
+            for i in range(n - 1)
+        ]
+        width, height = clip_media[0].dimensions
+        if await render_timeline_chunked(timeline, transitions, [], width, height,
+                                         clip_media[0].frame_rate, output_path, work_dir,
+                                         EXPORT_VIDEO_ENCODE_ARGS, EXPORT_AUDIO_ENCODE_ARGS):
+            return
+
+    # After the loop, running_duration is the length of the joined output
+    progress = await run_ffmpeg(cmd, expected_duration=running_duration)
+    encode_stats.record("single", running_duration, progress.elapsed)
+
+
+async def _concatenate_with_mixed_transitions(
+    input_paths: List[Path],
+    clip_durations: List[float],
+    transition_map: dict,
+    output_path: Path,
+    work_dir: Path
+) -> None:
+    """
+    Handle case where only some clips have transitions.
+
+    Strategy:
+    1. Group consecutive clips that have transitions between them
+    2. Process each group with xfade (groups render concurrently)
+    3. Concat all processed groups with regular concat (hard cuts)
+    """
+    n = len(input_paths)
+    segments = []  # List of (start_index, end_index, has_transitions)
+
+    i = 0
+    while i < n:
+        start = i
+        # Find consecutive clips with transitions
+        while i < n - 1 and i in transition_map:
+            i += 1
+        end = i
+
+        if start < end:
+            # This segment has transitions
+            segments.append((start, end + 1, True))  # end + 1 to include last clip
+            i = end + 1
+        else:
+            # Single clip or clip without transition to next
+            segments.append((start, start + 1, False))
+            i += 1
+
+    print(f"[Transitions] Segments: {segments}")
+
+    # Process each segment; they're independent, so they render concurrently on the FFmpeg pool
+    async def process_segment(seg_idx: int, start: int, end: int, has_trans: bool) -> Path:
+        seg_paths = input_paths[start:end]
+        seg_durations = clip_durations[start:end]
+
+        if has_trans and len(seg_paths) > 1:
+            # Extract relevant transitions
+            seg_transitions = {
+                idx - start: transition_map[idx]
+                for idx in range(start, end - 1)
+                if idx in transition_map
+            }
+
+            seg_output = work_dir / f"segment_{seg_idx}.mp4"
+            await _concatenate_with_chained_xfade(
+                seg_paths, seg_durations, seg_transitions, seg_output, work_dir
+            )
+            return seg_output
+        # Single clip or no transitions
+        if len(seg_paths) == 1:
+            return seg_paths[0]
+        # Multiple clips without transitions - regular concat
+        seg_output = work_dir / f"segment_{seg_idx}.mp4"
+        await concatenate_videos(seg_paths, seg_output, work_dir)
+        return seg_output
+
+    processed_paths = list(await asyncio.gather(*(
+        process_segment(seg_idx, start, end, has_trans)
+        for seg_idx, (start, end, has_trans) in enumerate(segments)
+    )))
+
+    # Final concat of all segments
+    if len(processed_paths) == 1:
+        await asyncio.to_thread(shutil.copy, processed_paths[0], output_path)
+    else:
+        await concatenate_videos(processed_paths, output_path, work_dir)
+
+
+# Font mapping for FFmpeg
+FONT_MAP = {
+    "Inter": "/usr/share/fonts/custom/Inter-Regular.ttf",
+    "Montserrat": "/usr/share/fonts/custom/Montserrat-Regular.ttf",
+    "Roboto": "/usr/share/fonts/custom/Roboto-Regular.ttf",
+    "Playfair Display": "/usr/share/fonts/custom/PlayfairDisplay-Regular.ttf",
+    "Oswald": "/usr/share/fonts/custom/Oswald-Regular.ttf",
+    "Open Sans": "/usr/share/fonts/custom/OpenSans-Regular.ttf",
+    "Lato": "/usr/share/fonts/custom/Lato-Regular.ttf",
+    "Poppins": "/usr/share/fonts/custom/Poppins-Regular.ttf",
+}
+
+FONT_BOLD_MAP = {
+    "Inter": "/usr/share/fonts/custom/Inter-Bold.ttf",
+    "Montserrat": "/usr/share/fonts/custom/Montserrat-Bold.ttf",
+    "Roboto": "/usr/share/fonts/custom/Roboto-Bold.ttf",
+    "Playfair Display": "/usr/share/fonts/custom/PlayfairDisplay-Bold.ttf",
+    "Oswald": "/usr/share/fonts/custom/Oswald-Bold.ttf",
+    "Open Sans": "/usr/share/fonts/custom/OpenSans-Bold.ttf",
+    "Lato": "/usr/share/fonts/custom/Lato-Bold.ttf",
+    "Poppins": "/usr/share/fonts/custom/Poppins-Bold.ttf",
+}
+
+FONT_LIGHT_MAP = {
+    "Inter": "/usr/share/fonts/custom/Inter-Light.ttf",
+    "Montserrat": "/usr/share/fonts/custom/Montserrat-Light.ttf",
+    "Roboto": "/usr/share/fonts/custom/Roboto-Light.ttf",
+    "Playfair Display": "/usr/share/fonts/custom/PlayfairDisplay-Regular.ttf",  # No light variant
+    "Oswald": "/usr/share/fonts/custom/Oswald-Light.ttf",
+    "Open Sans": "/usr/share/fonts/custom/OpenSans-Light.ttf",
+    "Lato": "/usr/share/fonts/custom/Lato-Light.ttf",
+    "Poppins": "/usr/share/fonts/custom/Poppins-Light.ttf",
+}
+
+
+FONT_FALLBACK_MAP = {
+    "normal": "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "bold": "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "light": "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",  # No light variant
+}
+FONT_WEIGHT_MAPS = {"normal": FONT_MAP, "bold": FONT_BOLD_MAP, "light": FONT_LIGHT_MAP}
+FONT_MIN_VALID_BYTES = 1000  # Smaller files are error pages from a failed font download
+
+
+@dataclass
+class FontFile:
+    """One font file as found at startup."""
+    path: str
+    exists: bool = False
+    size_bytes: int = 0
+    valid: bool = False
+    metrics: Optional[Dict[str, int]] = None  # unitsPerEm, ascender, descender, lineGap, numGlyphs
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        info: Dict[str, Any] = {
+            "path": self.path,
+            "exists": self.exists,
+            "size_bytes": self.size_bytes,
+            "valid": self.valid,
+        }
+        if self.metrics:
+            info["metrics"] = self.metrics
+        if self.error:
+            info["error"] = self.error
+        return info
+
+
+def read_font_metrics(data: bytes) -> Optional[Dict[str, int]]:
+    """Vertical metrics from the sfnt 'head', 'hhea' and 'maxp' tables of a TrueType/OpenType font."""
+    if len(data) < 12:
+        return None
+    num_tables = struct.unpack_from(">H", data, 4)[0]
+    tables = {}
+    for i in range(num_tables):
+        record = 12 + i * 16
+        if record + 16 > len(data):
+            return None
+        tag, _checksum, offset, length = struct.unpack_from(">4sIII", data, record)
+        tables[tag] = (offset, length)
+
+    def table(tag: bytes, size: int) -> Optional[int]:
+        entry = tables.get(tag)
+        if not entry or entry[1] < size or entry[0] + size > len(data):
+            return None
+        return entry[0]
+
+    head, hhea, maxp = table(b"head", 54), table(b"hhea", 36), table(b"maxp", 6)
+    if head is None or hhea is None:
+        return None
+    ascender, descender, line_gap = struct.unpack_from(">hhh", data, hhea + 4)
+    return {
+        "unitsPerEm": struct.unpack_from(">H", data, head + 18)[0],
+        "ascender": ascender,
+        "descender": descender,
+        "lineGap": line_gap,
+        "numGlyphs": struct.unpack_from(">H", data, maxp + 4)[0] if maxp is not None else 0,
+    }
+
+
+class FontRegistry:
+    """
+    Every configured font, checked once at startup.
+
+    `build()` stats and parses each font file and resolves the fallback chain
+    of every (family, weight): the requested weight, then the family's regular
+    weight, then DejaVu. After that `resolve()` is a dict lookup - no file
+    system access or logging on the overlay path.
+    """
+
+    def __init__(self):
+        self.files: Dict[str, FontFile] = {}
+        self.resolved: Dict[Tuple[str, str], Tuple[str, List[str]]] = {}
+        self.built_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.built_at is not None
+
+    def _check(self, path: str) -> FontFile:
+        font = self.files.get(path)
+        if font:
+            return font
+        font = FontFile(path=path)
+        try:
+            data = Path(path).read_bytes()
+            font.exists = True
+            font.size_bytes = len(data)
+            font.valid = font.size_bytes > FONT_MIN_VALID_BYTES
+            if font.valid:
+                font.metrics = read_font_metrics(data)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            font.error = str(e)
+        self.files[path] = font
+        return font
+
+    @staticmethod
+    def chain(family: Optional[str], weight: str) -> List[str]:
+        """Candidate paths for a family and weight, most preferred first."""
+        font_map = FONT_WEIGHT_MAPS.get(weight, FONT_MAP)
+        candidates = []
+        if family in font_map:
+            candidates.append(font_map[family])
+        if weight in ("bold", "light") and family in FONT_MAP:
+            candidates.append(FONT_MAP[family])
+        candidates.append(FONT_FALLBACK_MAP.get(weight, FONT_FALLBACK_MAP["normal"]))
+        return list(dict.fromkeys(candidates))
+
+    def _resolve_chain(self, family: Optional[str], weight: str) -> Tuple[str, List[str]]:
+        candidates = self.chain(family, weight)
+        for path in candidates:
+            if self._check(path).valid:
+                return path, candidates
+        return candidates[-1], candidates  # Last resort, as FFmpeg may still find it
+
+    def build(self) -> None:
+        self.files = {}
+        resolved = {}
+        families = set(FONT_MAP) | set(FONT_BOLD_MAP) | set(FONT_LIGHT_MAP)
+        for weight in FONT_WEIGHT_MAPS:
+            for family in sorted(families):
+                resolved[(family, weight)] = self._resolve_chain(family, weight)
+            resolved[("", weight)] = self._resolve_chain(None, weight)  # Unknown families
+        for path in FONT_FALLBACK_MAP.values():
+            self._check(path)
+        self.resolved = resolved
+        self.built_at = time.time()
+
+        valid = sum(1 for f in self.files.values() if f.valid)
+        fallbacks = sorted(
+            f"{family} {weight}" for (family, weight), (path, chain) in resolved.items()
+            if family and path != chain[0]
+        )
+        print(f"[Font] Registry: {valid}/{len(self.files)} font files valid")
+        if fallbacks:
+            print(f"[Font] Using fallbacks for: {', '.join(fallbacks)}")
+
+    def resolve(self, family: str, weight: str) -> str:
+        if not self.ready:
+            self.build()  # Fallback if used outside the app lifespan
+        if weight not in FONT_WEIGHT_MAPS:
+            weight = "normal"
+        entry = self.resolved.get((family, weight)) or self.resolved[("", weight)]
+        return entry[0]
+
+    def snapshot(self) -> Dict[str, Any]:
+        if not self.ready:
+            self.build()
+        fonts = {}
+        for weight, font_map in (("regular", FONT_MAP), ("bold", FONT_BOLD_MAP), ("light", FONT_LIGHT_MAP)):
+            for family, path in font_map.items():
+                fonts[f"{weight}/{family}"] = self.files[path].to_dict()
+        for path in dict.fromkeys(FONT_FALLBACK_MAP.values()):
+            fonts[f"fallback/{Path(path).stem}"] = self.files[path].to_dict()
+        resolved = {
+            f"{family or '*'}/{weight}": {"path": path, "chain": chain, "fallback": path != chain[0]}
+            for (family, weight), (path, chain) in self.resolved.items()
+        }
+        valid_count = sum(1 for f in fonts.values() if f.get("valid", False))
+        return {
+            "summary": f"{valid_count}/{len(fonts)} fonts available",
+            "builtAt": self.built_at,
+            "fonts": fonts,
+            "resolved": resolved,
+        }
+
+
+font_registry = FontRegistry()
+
+
+def get_font_path(font_family: str, weight: str) -> str:
+    """Font file for a family and weight, with fallbacks already resolved by the registry."""
+    return font_registry.resolve(font_family, weight)
+
+
+def hex_to_ffmpeg_color(color: str) -> tuple[str, float]:
+    """
+    Convert color to FFmpeg format.
+    Supports: #FFFFFF, rgba(0,0,0,0.7)
+    Returns: (color_hex, opacity)
+    """
+    color = color.strip()
+
+    # Handle rgba() format
+    if color.startswith('rgba('):
+        try:
+            # Extract rgba values: rgba(0,0,0,0.7)
+            inner = color[5:-1]  # Remove 'rgba(' and ')'
+            parts = [p.strip() for p in inner.split(',')]
+            r, g, b = int(parts[0]), int(parts[1]), int(parts[2])
+            a = float(parts[3])
+            hex_color = f"0x{r:02X}{g:02X}{b:02X}"
+            return hex_color, a
+        except (ValueError, IndexError):
+            return "0x000000", 1.0
+
+    # Handle rgb() format
+    if color.startswith('rgb('):
+        try:
+            inner = color[4:-1]
+            parts = [p.strip() for p in inner.split(',')]
+            r, g, b = int(parts[0]), int(parts[1]), int(parts[2])
+            hex_color = f"0x{r:02X}{g:02X}{b:02X}"
+            return hex_color, 1.0
+        except (ValueError, IndexError):
+            return "0x000000", 1.0
+
+    # Handle hex format (#FFFFFF or FFFFFF)
+    hex_color = color.lstrip('#')
+    return f"0x{hex_color}", 1.0
+
+
+def escape_text_for_drawtext(text: str) -> str:
+    """
+    Escape special characters for FFmpeg drawtext filter.
+
+    For multiline text, we use a text file instead (see build_drawtext_filter).
+    This function handles single-line text escaping.
+    """
+    # FFmpeg drawtext needs special escaping
+    text = text.replace("\\", "\\\\\\\\")  # Backslash
+    text = text.replace("'", "\\\\'")  # Single quote
+    text = text.replace(":", "\\\\:")  # Colon
+    text = text.replace("[", "\\\\[")  # Brackets
+    text = text.replace("]", "\\\\]")
+    text = text.replace("%", "\\\\%")  # Percent
+    return text
+
+
+def split_text_into_lines(text: str) -> list[str]:
+    """Split text into lines, normalizing line endings."""
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text.split("\n")
+
+
+def remap_overlay_times_to_concatenated_timeline(
+    overlays: List[TextOverlay],
+    sorted_clips: List[VideoClip],
+    transitions: Optional[List] = None
+) -> List[TextOverlay]:
+    """
+    Remap text overlay times from editor timeline to concatenated video timeline.
+
+    The editor timeline has clips positioned with gaps (based on clip.startTime),
+    but the concatenated video has clips joined sequentially with no gaps.
+
+    This function calculates where each overlay should appear in the final video.
+
+    Args:
+        overlays: List of text overlays with editor timeline positions
+        sorted_clips: Clips sorted by their editor timeline startTime
+        transitions: Optional list of transitions (affects timing due to overlap)
+
+    Returns:
+        New list of TextOverlay objects with adjusted startTime values
+    """
+    if not overlays or not sorted_clips:
+        return overlays or []
+
+    # Build a mapping from editor timeline to concatenated timeline
+    # For each clip, we need:
+    # - editor_start: when it starts in the editor timeline
+    # - editor_end: when it ends in the editor timeline
+    # - concat_start: when it starts in the concatenated video
+    # - concat_end: when it ends in the concatenated video
+
+    clip_mappings = []
+    concat_position = 0.0
+
+    for i, clip in enumerate(sorted_clips):
+        effective_duration = clip.sourceDuration - clip.trimStart - clip.trimEnd
+        editor_start = clip.startTime
+        editor_end = editor_start + effective_duration
+
+        # Check if there's a transition INTO this clip (reduces concat position)
+        transition_offset = 0.0
+        if transitions and i > 0:
+            for trans in transitions:
+                if trans.get('toClipIndex') == i or (hasattr(trans, 'toClipIndex') and trans.toClipIndex == i):
+                    duration = trans.get('duration', 0) if isinstance(trans, dict) else trans.duration
+                    transition_offset = duration
+                    break
+
+        # Adjust concat position for transition overlap
+        concat_start = max(0, concat_position - transition_offset)
+        concat_end = concat_start + effective_duration
+
+        clip_mappings.append({
+            'clip_index': i,
+            'editor_start': editor_start,
+            'editor_end': editor_end,
+            'concat_start': concat_start,
+            'concat_end': concat_end,
+            'effective_duration': effective_duration,
+        })
+
+        # Move concat position forward (accounting for transition overlap already applied)
+        concat_position = concat_end
+
+    print(f"[TimeRemap] Clip timeline mappings:")
+    for m in clip_mappings:
+        print(f"[TimeRemap]   Clip {m['clip_index']}: editor [{m['editor_start']:.2f}-{m['editor_end']:.2f}] -> concat [{m['concat_start']:.2f}-{m['concat_end']:.2f}]")
+
+    # Now remap each overlay
+    remapped_overlays = []
+
+    for overlay in overlays:
+        original_start = overlay.startTime
+        original_end = original_start + overlay.duration
+
+        # Find which clip(s) this overlay belongs to based on editor timeline
+        # An overlay might span multiple clips, so we use the start time to anchor it
+        matched_clip = None
+        for mapping in clip_mappings:
+            # Check if overlay starts within this clip's editor timeline span
+            if mapping['editor_start'] <= original_start < mapping['editor_end']:
+                matched_clip = mapping
+                break
+
+        if matched_clip is None:
+            # Overlay starts before first clip or after last clip
+            # Try to find the closest clip
+            if original_start < clip_mappings[0]['editor_start']:
+                matched_clip = clip_mappings[0]
+                print(f"[TimeRemap] Overlay '{overlay.text[:20]}...' starts before first clip, anchoring to clip 0")
+            else:
+                matched_clip = clip_mappings[-1]
+                print(f"[TimeRemap] Overlay '{overlay.text[:20]}...' starts after last clip, anchoring to last clip")
+
+        # Calculate the offset within the clip (in editor timeline)
+        offset_within_clip = original_start - matched_clip['editor_start']
+
+        # Apply same offset in concatenated timeline
+        new_start = matched_clip['concat_start'] + offset_within_clip
+
+        # Clamp to valid range (0 to total duration)
+        total_concat_duration = clip_mappings[-1]['concat_end']
+        new_start = max(0, min(new_start, total_concat_duration - 0.1))
+
+        # Ensure duration doesn't extend past video end
+        new_duration = min(overlay.duration, total_concat_duration - new_start)
+
+        print(f"[TimeRemap] Overlay '{overlay.text[:30]}': editor {original_start:.2f}s -> concat {new_start:.2f}s (clip {matched_clip['clip_index']}, offset {offset_within_clip:.2f}s)")
+
+        # Create new overlay with adjusted times
+        remapped_overlay = TextOverlay(
+            id=overlay.id,
+            startTime=new_start,
+            duration=new_duration,
+            text=overlay.text,
+            position=overlay.position,
+            style=overlay.style,
+        )
+        remapped_overlays.append(remapped_overlay)
+
+    return remapped_overlays
+
+
+def build_drawtext_filters(
+    overlay: TextOverlay,
+    video_width: int,
+    video_height: int,
+    preview_width: int = 400,  # Approximate preview width in the web editor
+    timed: bool = True,
+) -> list[str]:
+    """
+    Build FFmpeg drawtext filter strings for a text overlay.
+
+    Returns a LIST of filter strings - one per line for multiline text.
+    This approach handles newlines reliably by rendering each line separately.
+    With timed=False the filters draw unconditionally (no enable= window).
+
+    Position values (x, y) are percentages (0-100) where:
+    - x=0 is left edge, x=100 is right edge
+    - y=0 is top edge, y=100 is bottom edge
+    - x=50, y=50 is center of the video
+    """
+    style = overlay.style
+
+    # Get font path (validated and fallbacks resolved once at startup)
+    font_path = get_font_path(style.fontFamily, style.fontWeight)
+
+    # Calculate position in pixels from percentage
+    pos = overlay.position
+    x_pct = pos.get('x', 50) if isinstance(pos, dict) else getattr(pos, 'x', 50)
+    y_pct = pos.get('y', 50) if isinstance(pos, dict) else getattr(pos, 'y', 50)
+
+    try:
+        x_pct = float(x_pct)
+        y_pct = float(y_pct)
+    except (TypeError, ValueError):
+        print(f"[Warning] Invalid position values: x={x_pct}, y={y_pct}. Using center.")
+        x_pct = 50.0
+        y_pct = 50.0
+
+    x_pos = int((x_pct / 100) * video_width)
+    y_pos = int((y_pct / 100) * video_height)
+
+    # Scale font size and padding proportionally to video resolution
+    scale_factor = video_width / preview_width
+    scaled_font_size = int(style.fontSize * scale_factor)
+    scaled_padding = int((style.backgroundPadding or 0) * scale_factor)
+
+    # Line height with some spacing (typically 1.2x font size)
+    line_height = int(scaled_font_size * 1.2)
+
+    # Color conversion
+    font_color, font_color_opacity = hex_to_ffmpeg_color(style.color)
+    final_font_opacity = style.opacity * font_color_opacity
+
+    # Background color
+    bg_color, bg_opacity, final_bg_opacity = None, None, None
+    if style.backgroundColor:
+        bg_color, bg_opacity = hex_to_ffmpeg_color(style.backgroundColor)
+        final_bg_opacity = style.opacity * bg_opacity
+
+    # Timing
+    end_time = overlay.startTime + overlay.duration
+
+    # Split text into lines
+    lines = split_text_into_lines(overlay.text)
+    num_lines = len(lines)
+
+    # Calculate total text block height to center it on y_pos
+    total_height = num_lines * line_height
+    # Starting Y position (top of first line, adjusted to center the block)
+    start_y = y_pos - (total_height // 2) + (line_height // 2)
+
+    filters = []
+    for i, line_text in enumerate(lines):
+        if not line_text.strip():
+            # Skip empty lines but account for spacing
+            continue
+
+        escaped_text = escape_text_for_drawtext(line_text)
+
+        # Calculate Y position for this line
+        line_y = start_y + (i * line_height)
+
+        filter_parts = [
+            f"drawtext=text='{escaped_text}'",
+            f"fontfile='{font_path}'",
+            f"fontsize={scaled_font_size}",
+            f"fontcolor={font_color}@{final_font_opacity}",
+        ]
+
+        # X position - always center on anchor point
+        filter_parts.append(f"x={x_pos}-(tw/2)")
+
+        # Y position for this specific line
+        filter_parts.append(f"y={line_y}-(th/2)")
+
+        # Background box if specified
+        if bg_color:
+            filter_parts.append(f"box=1")
+            filter_parts.append(f"boxcolor={bg_color}@{final_bg_opacity}")
+            filter_parts.append(f"boxborderw={scaled_padding}")
+
+        # Timing
+        if timed:
+            filter_parts.append(f"enable='between(t,{overlay.startTime},{end_time})'")
+
+        filters.append(":".join(filter_parts))
+
+    return filters
+
+
+@dataclass
+class TextLayer:
+    """
+    Pre-rasterized text overlays as one image timeline.
+
+    `list_path` is an ffconcat playlist of full-frame transparent PNGs, one
+    per stretch of time with a distinct set of visible overlays. It is fed
+    to FFmpeg as an extra input and composited with a single overlay filter,
+    enabled only while some overlay is visible.
+    """
+    list_path: Path
+    enable: str  # Timeline expression, e.g. "between(t,3,6)+between(t,17,19)"
+    images: int
+
+    @property
+    def input_args(self) -> List[str]:
+        return ["-f", "concat", "-safe", "0", "-i", str(self.list_path)]
+
+    def overlay_filter(self, main_label: str, layer_label: str, out_label: str) -> str:
+        return (f"{layer_label}format=rgba[textlayer];"
+                f"{main_label}[textlayer]overlay=0:0:eof_action=pass:enable='{self.enable}'{out_label}")
+
+
+def text_layer_key(overlays: List[TextOverlay], width: int, height: int, preview_width: int) -> str:
+    """Cache key of one rasterized frame: the drawn overlays' text, style and placement, not their timing."""
+    return RenderCache.key(
+        kind="text-layer",
+        width=width,
+        height=height,
+        previewWidth=preview_width,
+        overlays=[o.model_dump(include={"text", "position", "style"}) for o in overlays],
+    )
+
+
+async def rasterize_text_overlays(
+    overlays: List[TextOverlay],
+    width: int,
+    height: int,
+    preview_width: int,
+    output_path: Path,
+) -> None:
+    """Draw `overlays` once onto a transparent width x height frame and save it as PNG."""
+    filters = ["format=rgba"]
+    for overlay in overlays:
+        filters.extend(build_drawtext_filters(overlay, width, height, preview_width, timed=False))
+    await run_ffmpeg([
+        "-f", "lavfi",
+        "-i", f"color=c=black@0.0:s={width}x{height}:d=1,format=rgba",
+        "-vf", ",".join(filters),
+        "-frames:v", "1",
+        "-update", "1",
+        str(output_path),
+    ])
+
+
+async def build_text_layer(
+    overlays: List[TextOverlay],
+    width: int,
+    height: int,
+    preview_width: int,
+    duration: float,
+    work_dir: Path,
+    name: str = "text_layer",
+) -> Optional[TextLayer]:
+    """
+    Rasterize `overlays` into a TextLayer covering [0, duration].
+
+    The timeline is cut wherever an overlay starts or ends; each stretch shows
+    one image with all overlays visible there, drawn in request order. Images
+    come from the text layer cache when the same captions were drawn before
+    at this size, so repeated brand captions are laid out once. Returns None
+    if no overlay is visible inside [0, duration].
+    """
+    bounds = {0.0, duration}
+    for o in overlays:
+        bounds.update(min(max(t, 0.0), duration) for t in (o.startTime, o.startTime + o.duration))
+    bounds = sorted(bounds)
+
+    # (start, end, visible overlays), merging neighbours that show the same set
+    stretches: List[Tuple[float, float, List[TextOverlay]]] = []
+    for start, end in zip(bounds, bounds[1:]):
+        visible = [o for o in overlays if o.startTime <= start < o.startTime + o.duration]
+        if stretches and [id(o) for o in stretches[-1][2]] == [id(o) for o in visible]:
+            stretches[-1] = (stretches[-1][0], end, visible)
+        else:
+            stretches.append((start, end, visible))
+    if not any(visible for _, _, visible in stretches):
+        return None
+
+    layer_dir = work_dir / name
+    layer_dir.mkdir(parents=True, exist_ok=True)
+    images: Dict[str, Path] = {}
+    to_draw: Dict[str, List[TextOverlay]] = {}
+    entries: List[Tuple[Path, float]] = []
+    for start, end, visible in stretches:
+        key = text_layer_key(visible, width, height, preview_width)
+        if key not in images:
+            images[key] = layer_dir / f"{key[:16]}.png"
+            if not await text_layer_cache.get(key, images[key]):
+                to_draw[key] = visible
+        entries.append((images[key], end - start))
+
+    if to_draw:
+        print(f"[TextLayer] Rasterizing {len(to_draw)} of {len(images)} image(s) at {width}x{height}")
+        await asyncio.gather(*(
+            rasterize_text_overlays(visible, width, height, preview_width, images[key])
+            for key, visible in to_draw.items()
+        ))
+        for key in to_draw:
+            await text_layer_cache.put(key, images[key])
+    else:
+        print(f"[TextLayer] All {len(images)} image(s) cached")
+
+    list_path = layer_dir / "layer.ffconcat"
+    lines = ["ffconcat version 1.0"]
+    for path, stretch_duration in entries:
+        lines += [f"file '{path}'", f"duration {stretch_duration:.6f}"]
+    lines.append(f"file '{entries[-1][0]}'")  # The last duration only applies if another entry follows
+    async with aiofiles.open(list_path, "w") as f:
+        await f.write("\n".join(lines) + "\n")
+
+    enable = "+".join(f"between(t,{start:.6f},{end:.6f})" for start, end, visible in stretches if visible)
+    return TextLayer(list_path=list_path, enable=enable, images=len(images))
+
+
+async def apply_text_overlays(
+    input_path: Path,
+    output_path: Path,
+    overlays: List[TextOverlay],
+    video_width: int = None,
+    video_height: int = None,
+    preview_width: int = None,
+    preview_height: int = None,
+    expected_duration: Optional[float] = None,
+    mode: Optional[str] = None,
+    video_args: Optional[List[str]] = None,
+) -> None:
+    """
+    Apply text overlays to a video using FFmpeg drawtext filters.
+
+    Handles multiline text by rendering each line as a separate filter,
+    stacked vertically and centered on the anchor point. In 'windowed' mode
+    (OVERLAY_RENDER_MODE default) only the stretches where overlays are
+    visible are re-encoded; see apply_text_overlays_windowed.
+
+    Args:
+        input_path: Input video file
+        output_path: Output video file
+        overlays: List of text overlays to apply
+        video_width: Actual video width (auto-detected if not provided)
+        video_height: Actual video height (auto-detected if not provided)
+        preview_width: Width of the preview container in the web editor
+        preview_height: Height of the preview container in the web editor
+        expected_duration: Output duration in seconds, for progress reporting
+        mode: 'windowed' or 'full'. Defaults to OVERLAY_RENDER_MODE.
+        video_args: Video encode args. Defaults to EXPORT_VIDEO_ENCODE_ARGS.
+    """
+    video_args = video_args or EXPORT_VIDEO_ENCODE_ARGS
+    if not overlays:
+        # No overlays, just copy the file
+        await asyncio.to_thread(shutil.copy, input_path, output_path)
+        return
+
+    # Auto-detect video dimensions if not provided
+    if video_width is None or video_height is None:
+        video_width, video_height = (await probe_media(input_path)).dimensions
+
+    if (mode or OVERLAY_RENDER_MODE) == "windowed":
+        if await apply_text_overlays_windowed(input_path, output_path, overlays, video_width, video_height,
+                                              preview_width or 400, video_args):
+            return
+
+    # Use default preview width if not provided
+    if preview_width is None:
+        preview_width = 400  # Default fallback
+
+    print(f"[TextOverlay] Applying {len(overlays)} overlays to video ({video_width}x{video_height})")
+    print(f"[TextOverlay] Preview dimensions: {preview_width}x{preview_height}")
+
+    if await apply_text_overlays_chunked(input_path, output_path, overlays, video_width, video_height,
+                                         preview_width, video_args):
+        return
+
+    if TEXT_OVERLAY_RENDERER == "raster":
+        duration = (await probe_media(input_path)).duration
+        layer = await build_text_layer(overlays, video_width, video_height, preview_width, duration,
+                                       output_path.parent, f"{output_path.stem}_text")
+        if layer is None:
+            await asyncio.to_thread(shutil.copy, input_path, output_path)
+            return
+        progress = await run_ffmpeg([
+            "-i", str(input_path),
+            *layer.input_args,
+            "-filter_complex", layer.overlay_filter("[0:v]", "[1:v]", "[v]"),
+            "-map", "[v]",
+            "-map", "0:a?",
+            *video_args,
+            "-c:a", "copy",
+            str(output_path)
+        ], expected_duration=expected_duration)
+        encode_stats.record("single", progress.out_time, progress.elapsed)
+        return
+
+    # Build filter complex with all text overlays chained together
+    # Note: build_drawtext_filters returns a LIST of filters (one per line for multiline text)
+    all_filters = []
+    for i, overlay in enumerate(overlays):
+        filters = build_drawtext_filters(overlay, video_width, video_height, preview_width)
+        print(f"[TextOverlay] Overlay {i+1}: {len(filters)} filter(s)")
+        all_filters.extend(filters)
+
+    # Chain all filters together
+    filter_complex = ",".join(all_filters)
+    print(f"[TextOverlay] Full filter complex length: {len(filter_complex)} chars")
+
+    progress = await run_ffmpeg([
+        "-i", str(input_path),
+        "-vf", filter_complex,
+        *video_args,
+        "-c:a", "copy",
+        str(output_path)
+    ], expected_duration=expected_duration)
+    encode_stats.record("single", progress.out_time, progress.elapsed)
+
+
+def plan_overlay_windows(
+    index: "KeyframeIndex",
+    overlays: List[TextOverlay],
+    duration: float,
+) -> Optional[List[Tuple[float, float, bool]]]:
+    """
+    Cover [0, duration] with (start, end, reencode) pieces.
+
+    Each span where an overlay is visible is widened outward to the
+    surrounding keyframes (the end of the video counts as one), and
+    overlapping windows are merged. Returns None when there is nothing to
+    gain: no usable windows, or windows covering most of the video.
+    """
+    windows: List[List[float]] = []
+    for start, end in sorted((o.startTime, o.startTime + o.duration) for o in overlays):
+        start, end = max(start, 0.0), min(end, duration)
+        if end <= start:
+            continue
+        window_start = index.at_or_before(start)
+        window_end = index.at_or_after(end)
+        if window_start is None:
+            return None
+        if window_end is None or window_end > duration:
+            window_end = duration
+        if windows and window_start <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], window_end)
+        else:
+            windows.append([window_start, window_end])
+
+    reencoded = sum(end - start for start, end in windows)
+    if not windows or reencoded > duration * OVERLAY_WINDOW_MAX_FRACTION:
+        return None
+
+    pieces = []
+    position = 0.0
+    for start, end in windows:
+        if start > position:
+            pieces.append((position, start, False))
+        pieces.append((start, end, True))
+        position = end
+    if duration - position > 0.001:
+        pieces.append((position, duration, False))
+    return pieces
+
+
+async def apply_text_overlays_windowed(
+    input_path: Path,
+    output_path: Path,
+    overlays: List[TextOverlay],
+    video_width: int,
+    video_height: int,
+    preview_width: int,
+    video_args: List[str] = EXPORT_VIDEO_ENCODE_ARGS,
+) -> bool:
+    """
+    Burn in text overlays by re-encoding only the windows where they're visible.
+
+    Windows are snapped outward to keyframes, so everything outside them is
+    stream-copied whole-GOP; each window is re-encoded with the overlays it
+    contains (times shifted to the window), as a text layer or drawtext. The
+    audio track is copied untouched.
+
+    Windows are encoded with `video_args`, so, as with smart trim, the
+    source has to be H.264 yuv420p and the windows must come out at its
+    profile and level. Returns False without writing anything when that
+    doesn't hold or the windows cover most of the video; the caller then
+    re-encodes the whole video.
+    """
+    media = await probe_media(input_path)
+    video = media.video
+    if video is None or video.codecName != "h264" or video.pixFmt != "yuv420p":
+        return False
+
+    pieces = plan_overlay_windows(await keyframe_index.get(input_path), overlays, media.duration)
+    if pieces is None:
+        print("[TextOverlay] Overlay windows don't pay off, re-encoding the whole video")
+        return False
+
+    parts_dir = output_path.parent / f"{output_path.stem}_parts"
+    parts_dir.mkdir(parents=True, exist_ok=True)
+
+    piece_specs = await overlay_piece_specs(pieces, overlays, video_width, video_height, preview_width,
+                                            video_args, parts_dir)
+
+    reencoded = sum(end - start for start, end, reencode in pieces if reencode)
+    print(f"[TextOverlay] Re-encoding {reencoded:.2f}s of {media.duration:.2f}s in "
+          f"{sum(1 for p in pieces if p[2])} window(s)")
+
+    piece_paths, commands = video_piece_commands(input_path, piece_specs, parts_dir)
+    await asyncio.gather(*(run_ffmpeg(args, expected_duration=d) for args, d in commands))
+    encoded = [path for path, (_, _, reencode) in zip(piece_paths, pieces) if reencode]
+    if not await pieces_match_source(encoded, video, "TextOverlay"):
+        await asyncio.to_thread(shutil.rmtree, parts_dir, ignore_errors=True)
+        return False
+    await join_video_pieces(piece_paths, input_path, output_path, parts_dir, media.duration)
+
+    await asyncio.to_thread(shutil.rmtree, parts_dir, ignore_errors=True)
+    return True
+
+
+async def overlay_piece_specs(
+    pieces: List[Tuple[float, float, bool]],
+    overlays: List[TextOverlay],
+    video_width: int,
+    video_height: int,
+    preview_width: int,
+    encode_args: List[str],
+    parts_dir: Path,
+) -> List[tuple]:
+    """
+    video_piece_commands specs for (start, end, reencode) pieces: copied as-is,
+    or re-encoded with the overlays they contain (times shifted to the piece).
+    """
+    piece_specs = []
+    for i, (start, end, reencode) in enumerate(pieces):
+        if not reencode:
+            piece_specs.append((start, end, None))
+            continue
+        window_overlays = [
+            overlay.model_copy(update={"startTime": overlay.startTime - start})
+            for overlay in overlays
+            if overlay.startTime < end and overlay.startTime + overlay.duration > start
+        ]
+        if not window_overlays:
+            piece_specs.append((start, end, encode_args))
+        elif TEXT_OVERLAY_RENDERER == "raster":
+            layer = await build_text_layer(window_overlays, video_width, video_height, preview_width,
+                                           end - start, parts_dir, f"text_{i}")
+            piece_specs.append((start, end, [
+                "-filter_complex", layer.overlay_filter("[0:v]", "[1:v]", "[v]"),
+                "-map", "[v]",
+                *encode_args,
+            ], layer.input_args))
+        else:
+            filters = []
+            for overlay in window_overlays:
+                filters.extend(build_drawtext_filters(overlay, video_width, video_height, preview_width))
+            piece_specs.append((start, end, ["-vf", ",".join(filters), *encode_args]))
+    return piece_specs
+
+
+async def apply_text_overlays_chunked(
+    input_path: Path,
+    output_path: Path,
+    overlays: List[TextOverlay],
+    video_width: int,
+    video_height: int,
+    preview_width: int,
+    video_args: List[str] = EXPORT_VIDEO_ENCODE_ARGS,
+) -> bool:
+    """
+    Burn in text overlays over the whole video as parallel chunk encodes.
+
+    Chunks start on keyframes, so each one seeks straight to its first frame;
+    every chunk is re-encoded with the overlays it contains and the pieces
+    are joined with the concat demuxer, copying the audio track untouched.
+    Returns False without writing anything when the video is too short to
+    split; the caller then encodes it in one process.
+    """
+    media = await probe_media(input_path)
+    video = media.video
+    if video is None:
+        return False
+    index = await keyframe_index.get(input_path)
+    ranges = plan_chunk_ranges(media.duration, index.at_or_after)
+    if len(ranges) < 2:
+        return False
+
+    parts_dir = output_path.parent / f"{output_path.stem}_chunks"
+    parts_dir.mkdir(parents=True, exist_ok=True)
+
+    encode_args = chunk_encode_args(video_args)
+    piece_specs = await overlay_piece_specs([(start, end, True) for start, end in ranges], overlays,
+                                            video_width, video_height, preview_width, encode_args, parts_dir)
+    piece_paths, commands = video_piece_commands(input_path, piece_specs, parts_dir)
+    await run_chunked_encode("text overlays", commands, media.duration)
+    await join_video_pieces(piece_paths, input_path, output_path, parts_dir, media.duration)
+
+    await asyncio.to_thread(shutil.rmtree, parts_dir, ignore_errors=True)
+    return True
+
+
+# ============================================
+# Media Metadata
+# ============================================
+
+def media_identity(path: Path, content_id: Optional[str] = None) -> str:
+    """
+    Key for memoizing facts about a media file.
+
+    The content hash when known; otherwise the file's inode, size and mtime,
+    which work-dir hard links to a cached blob share with the blob itself.
+    """
+    if content_id:
+        return content_id
+    st = path.stat()
+    return f"file:{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+
+@dataclass
+class MediaMemoStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    builds: int = 0
+    build_seconds: float = 0.0
+
+
+class MediaMemo:
+    """
+    Computes a fact about a media file once per content and keeps it around.
+
+    Results for cached sources are written next to the blob as a `kind`
+    sidecar, so they survive restarts and are evicted with the source; every
+    result also lives in a small in-memory LRU. Concurrent requests for the
+    same content share one build. Subclasses implement _build, _encode and
+    _decode.
+    """
+
+    kind = ""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, object]" = OrderedDict()
+        self.stats = MediaMemoStats()
+        self._building: Dict[str, asyncio.Task] = {}
+
+    async def _build(self, path: Path):
+        raise NotImplementedError
+
+    def _encode(self, value) -> bytes:
+        raise NotImplementedError
+
+    def _decode(self, data: bytes):
+        raise NotImplementedError
+
+    def _remember(self, key: str, value) -> None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get(self, path: Path, content_id: Optional[str] = None):
+        """Value for the media at `path` (content hash `content_id`, if known)."""
+        key = media_identity(path, content_id)
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+            self.stats.memory_hits += 1
+            return value
+
+        # The build runs as its own task, so a caller being cancelled doesn't cancel it for the others
+        build = self._building.get(key)
+        if build is None:
+            build = asyncio.create_task(self._load_or_build(path, content_id))
+            self._building[key] = build
+            build.add_done_callback(lambda task: self._built(key, task))
+        return await asyncio.shield(build)
+
+    def peek(self, content_id: str):
+        """The value in memory for content `content_id`, or None; never builds."""
+        return self.entries.get(content_id)
+
+    def _built(self, key: str, task: asyncio.Task) -> None:
+        del self._building[key]
+        if not task.cancelled() and task.exception() is None:  # Errors reach the waiters
+            self._remember(key, task.result())
+
+    async def _load_or_build(self, path: Path, content_id: Optional[str]):
+        sidecar = source_cache.sidecar_path(content_id, self.kind) if content_id else None
+        if sidecar is not None and sidecar.exists():
+            try:
+                value = self._decode(await asyncio.to_thread(sidecar.read_bytes))
+                self.stats.disk_hits += 1
+                return value
+            except (OSError, ValueError) as e:
+                print(f"[MediaMemo] Rebuilding unreadable {sidecar.name}: {e}")
+
+        started = time.monotonic()
+        value = await self._build(path)
+        self.stats.builds += 1
+        self.stats.build_seconds += time.monotonic() - started
+
+        if sidecar is not None:
+            data = self._encode(value)
+
+            def write() -> None:
+                sidecar.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = sidecar.with_name(f"{sidecar.name}.tmp-{uuid.uuid4().hex}")
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, sidecar)
+            await asyncio.to_thread(write)
+        return value
+
+    def snapshot(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "maxEntries": self.max_entries,
+            "memoryHits": self.stats.memory_hits,
+            "diskHits": self.stats.disk_hits,
+            "builds": self.stats.builds,
+            "buildSeconds": round(self.stats.build_seconds, 3),
+        }
+
+
+def _parse_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class MediaProbeStore(MediaMemo):
+    """
+    Stream layout of media files: one probe per content, shared by every stage.
+
+    PROBE_BACKEND=ffprobe runs one ffprobe with JSON output; 'pyav' reads the
+    container headers in-process (no subprocess) when PyAV is installed.
+    """
+
+    kind = "probe"
+
+    async def _build(self, path: Path) -> MediaInfo:
+        if PROBE_BACKEND == "pyav":
+            try:
+                import av  # noqa: F401 - optional dependency
+            except ImportError:
+                print("[Probe] PyAV not installed, using ffprobe")
+            else:
+                info = await asyncio.to_thread(self._probe_pyav, path)
+                print(f"[Probe] {path.name} (pyav): {self._describe(info)}")
+                return info
+
+        info = await self._probe_ffprobe(path)
+        print(f"[Probe] {path.name}: {self._describe(info)}")
+        return info
+
+    @staticmethod
+    def _describe(info: MediaInfo) -> str:
+        parts = [f"{info.duration:.2f}s"]
+        if info.video:
+            parts.append(f"{info.video.codecName} {info.video.width}x{info.video.height}@{info.video.frameRate} {info.video.pixFmt}")
+        if info.audio:
+            parts.append(f"{info.audio.codecName} {info.audio.sampleRate}Hz {info.audio.channelLayout or info.audio.channels}")
+        return ", ".join(parts)
+
+    @staticmethod
+    async def _probe_ffprobe(path: Path) -> MediaInfo:
+        cmd = [
+            "ffprobe",
+            "-v", "error",
+            "-show_entries",
+            "stream=index,codec_type,codec_name,profile,level,width,height,r_frame_rate,pix_fmt,"
+            "sample_rate,channels,channel_layout,duration:format=duration,format_name,bit_rate",
+            "-of", "json",
+            str(path)
+        ]
+        returncode, stdout, stderr = await ffprobe_pool.run(cmd)
+        if returncode != 0:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Could not read media file: {stderr[-300:]}"
+            )
+
+        data = json.loads(stdout)
+        streams = []
+        for st in data.get("streams", []):
+            frame_rate = st.get("r_frame_rate")
+            streams.append(MediaStream(
+                index=st.get("index", len(streams)),
+                codecType=st.get("codec_type", "unknown"),
+                codecName=st.get("codec_name"),
+                width=_parse_int(st.get("width")),
+                height=_parse_int(st.get("height")),
+                frameRate=frame_rate if frame_rate not in (None, "0/0") else None,
+                pixFmt=st.get("pix_fmt"),
+                profile=st.get("profile"),
+                level=level if (level := _parse_int(st.get("level"))) and level > 0 else None,
+                sampleRate=_parse_int(st.get("sample_rate")),
+                channels=_parse_int(st.get("channels")),
+                channelLayout=st.get("channel_layout"),
+                duration=_parse_float(st.get("duration")),
+            ))
+        fmt = data.get("format", {})
+        return MediaInfo(
+            duration=_parse_float(fmt.get("duration")) or 0.0,
+            formatName=fmt.get("format_name"),
+            bitRate=_parse_int(fmt.get("bit_rate")),
+            streams=streams,
+        )
+
+    @staticmethod
+    def _probe_pyav(path: Path) -> MediaInfo:
+        import av
+
+        try:
+            container = av.open(str(path))
+        except av.error.FFmpegError as e:
+            raise HTTPException(status_code=400, detail=f"Could not read media file: {e}")
+        with container:
+            streams = []
+            for st in container.streams:
+                ctx = st.codec_context
+                rate = getattr(st, "average_rate", None) or getattr(st, "guessed_rate", None)
+                layout = getattr(ctx, "layout", None)
+                streams.append(MediaStream(
+                    index=st.index,
+                    codecType=st.type,
+                    codecName=ctx.name if ctx else None,
+                    width=getattr(ctx, "width", None),
+                    height=getattr(ctx, "height", None),
+                    frameRate=f"{rate.numerator}/{rate.denominator}" if rate else None,
+                    pixFmt=getattr(ctx, "pix_fmt", None),
+                    profile=getattr(ctx, "profile", None),
+                    level=level if (level := getattr(ctx, "level", None)) and level > 0 else None,
+                    sampleRate=getattr(ctx, "sample_rate", None),
+                    channels=getattr(ctx, "channels", None),
+                    channelLayout=layout.name if layout else None,
+                    duration=float(st.duration * st.time_base) if st.duration and st.time_base else None,
+                ))
+            return MediaInfo(
+                duration=container.duration / 1_000_000 if container.duration else 0.0,
+                formatName=container.format.name,
+                bitRate=container.bit_rate or None,
+                streams=streams,
+            )
+
+    def _encode(self, value: MediaInfo) -> bytes:
+        return value.model_dump_json().encode()
+
+    def _decode(self, data: bytes) -> MediaInfo:
+        return MediaInfo.model_validate_json(data)
+
+
+media_probe = MediaProbeStore(MEDIA_MEMO_MEMORY_ENTRIES)
+
+
+async def probe_media(path: Path, content_id: Optional[str] = None) -> MediaInfo:
+    """Stream layout of a media file, probed once per content."""
+    return await media_probe.get(path, content_id)
+
+
+class KeyframeIndex:
+    """
+    Keyframe positions of a source's first video stream.
+
+    Timestamps (seconds, ascending) and packet byte offsets are kept in two
+    parallel arrays, so an index of an hour-long source is a few KB and
+    lookups are a binary search.
+    """
+
+    MAGIC = b"KFI1"
+
+    def __init__(self, timestamps: array, offsets: array):
+        self.timestamps = timestamps  # array('d')
+        self.offsets = offsets  # array('q'), -1 where the demuxer reports no position
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def at_or_before(self, t: float) -> Optional[float]:
+        """Latest keyframe at or before `t`."""
+        i = bisect.bisect_right(self.timestamps, t)
+        return self.timestamps[i - 1] if i > 0 else None
+
+    def at_or_after(self, t: float) -> Optional[float]:
+        """Earliest keyframe at or after `t`."""
+        i = bisect.bisect_left(self.timestamps, t)
+        return self.timestamps[i] if i < len(self.timestamps) else None
+
+    def between(self, start: float, end: float) -> List[float]:
+        """Keyframes in [start, end]."""
+        lo = bisect.bisect_left(self.timestamps, start)
+        hi = bisect.bisect_right(self.timestamps, end)
+        return list(self.timestamps[lo:hi])
+
+    def offset_of(self, t: float) -> Optional[int]:
+        """Byte offset of the keyframe at or before `t`."""
+        i = bisect.bisect_right(self.timestamps, t)
+        if i == 0 or self.offsets[i - 1] < 0:
+            return None
+        return self.offsets[i - 1]
+
+    def to_bytes(self) -> bytes:
+        return (self.MAGIC + struct.pack("<I", len(self))
+                + self.timestamps.tobytes() + self.offsets.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "KeyframeIndex":
+        if data[:4] != cls.MAGIC:
+            raise ValueError("not a keyframe index")
+        (count,) = struct.unpack_from("<I", data, 4)
+        timestamps, offsets = array("d"), array("q")
+        body = 8
+        timestamps.frombytes(data[body:body + 8 * count])
+        offsets.frombytes(data[body + 8 * count:body + 16 * count])
+        if len(timestamps) != count or len(offsets) != count:
+            raise ValueError("truncated keyframe index")
+        return cls(timestamps, offsets)
+
+
+class KeyframeIndexStore(MediaMemo):
+    """
+    Keyframe index of each source, built from one demux-only ffprobe pass
+    over the packets (no decoding).
+    """
+
+    kind = "keyframes"
+
+    async def _build(self, path: Path) -> KeyframeIndex:
+        cmd = [
+            "ffprobe",
+            "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "packet=pts_time,pos,flags",
+            "-of", "csv=p=0",
+            str(path)
+        ]
+        started = time.monotonic()
+        returncode, stdout, stderr = await ffprobe_pool.run(cmd)
+        if returncode != 0:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to index keyframes: {stderr[-300:]}"
+            )
+
+        keyframes = []
+        for line in stdout.splitlines():
+            parts = line.split(",")
+            if len(parts) < 3 or "K" not in parts[2] or parts[0] in ("", "N/A"):
+                continue
+            pos = int(parts[1]) if parts[1] not in ("", "N/A") else -1
+            keyframes.append((float(parts[0]), pos))
+        keyframes.sort()
+        index = KeyframeIndex(array("d", (t for t, _ in keyframes)), array("q", (p for _, p in keyframes)))
+        print(f"[Keyframes] Indexed {path.name}: {len(index)} keyframes in {time.monotonic() - started:.2f}s")
+        return index
+
+    def _encode(self, value: KeyframeIndex) -> bytes:
+        return value.to_bytes()
+
+    def _decode(self, data: bytes) -> KeyframeIndex:
+        return KeyframeIndex.from_bytes(data)
+
+
+keyframe_index = KeyframeIndexStore(MEDIA_MEMO_MEMORY_ENTRIES)
+
+
+# ============================================
+# Single-Pass Export
+# ============================================
+
+@dataclass
+class CompiledGraph:
+    """Inputs and filter graph of one FFmpeg invocation that renders a whole export."""
+    input_args: List[str]
+    filter_graph: str
+    video_label: str
+    audio_label: str
+    duration: float  # Output duration in seconds
+
+
+def clip_audio_settings(clip: VideoClip) -> tuple[Optional[float], bool]:
+    """
+    Resolve a clip's audio settings to (volume, muted).
+
+    volume is None when no adjustment is needed. volume=0 means mute
+    (replaces the legacy muted flag) and volume is capped at 200%.
+    """
+    if not clip.audioInfo:
+        return None, False
+    muted = clip.audioInfo.muted or clip.audioInfo.volume == 0
+    volume = None
+    if not muted and clip.audioInfo.volume != 1.0:
+        volume = min(clip.audioInfo.volume, 2.0)
+    return volume, muted
+
+
+@dataclass
+class TimelineClip:
+    """One clip of a compiled timeline: `duration` seconds of `path` from `start`."""
+    path: Path
+    media: MediaInfo
+    start: float
+    duration: float
+    volume: Optional[float] = None  # None = unchanged
+    muted: bool = False
+
+    @classmethod
+    def from_export_clip(cls, clip: VideoClip, path: Path, media: MediaInfo) -> "TimelineClip":
+        volume, muted = clip_audio_settings(clip)
+        return cls(path=path, media=media, start=clip.trimStart,
+                   duration=clip.sourceDuration - clip.trimStart - clip.trimEnd, volume=volume, muted=muted)
+
+
+def compile_export_graph(
+    clips: List[TimelineClip],
+    transitions: List[dict],
+    overlays: List[TextOverlay],
+    output_width: int,
+    output_height: int,
+    frame_rate: str,
+    preview_width: Optional[int] = None,
+    text_layer: Optional[TextLayer] = None,
+    scale_flags: Optional[str] = None,
+) -> CompiledGraph:
+    """
+    Compile an export timeline into a single FFmpeg filter graph.
+
+    Each clip becomes its own input, seeked with -ss/-t so only the kept range
+    is decoded, then:
+      video: trim -> setpts -> scale/pad to the output size -> fps -> yuv420p -> settb
+      audio: atrim -> asetpts -> volume -> 48kHz stereo, padded to the clip length
+             (silence from anullsrc when the clip is muted or has no audio)
+    Neighbouring clips are joined with xfade/acrossfade where a transition is
+    set and with concat otherwise. Text overlays are drawn last on the joined
+    video (as one pre-rasterized `text_layer` when given, else drawtext), so
+    the whole export is encoded exactly once. Every input is scaled to the
+    output size right after its trim, so small (preview) outputs keep the
+    rest of the graph cheap; `scale_flags` picks the scaler algorithm.
+    """
+    transition_map = {t['fromClipIndex']: t for t in transitions}
+    W, H = output_width, output_height
+    scale_opts = f":flags={scale_flags}" if scale_flags else ""
+
+    input_args: List[str] = []
+    parts: List[str] = []
+    durations: List[float] = []
+
+    for i, clip in enumerate(clips):
+        duration = clip.duration
+        durations.append(duration)
+        if clip.start > 0:
+            input_args.extend(["-ss", str(clip.start)])
+        input_args.extend(["-t", str(duration), "-i", str(clip.path)])
+
+        parts.append(
+            f"[{i}:v]trim=duration={duration},setpts=PTS-STARTPTS,"
+            f"scale={W}:{H}:force_original_aspect_ratio=decrease{scale_opts},"
+            f"pad={W}:{H}:(ow-iw)/2:(oh-ih)/2,setsar=1,"
+            f"fps={frame_rate},format=yuv420p,settb=AVTB[v{i}]"
+        )
+
+        audio_format = (
+            f"aformat=sample_fmts=fltp:sample_rates={EXPORT_AUDIO_SAMPLE_RATE}:channel_layouts=stereo"
+        )
+        if clip.muted or not clip.media.has_audio:
+            parts.append(
+                f"anullsrc=channel_layout=stereo:sample_rate={EXPORT_AUDIO_SAMPLE_RATE},"
+                f"atrim=duration={duration},{audio_format}[a{i}]"
+            )
+        else:
+            volume_filter = f"volume={clip.volume}," if clip.volume is not None else ""
+            parts.append(
+                f"[{i}:a]atrim=duration={duration},asetpts=PTS-STARTPTS,{volume_filter}"
+                f"{audio_format},apad=whole_dur={duration},atrim=duration={duration}[a{i}]"
+            )
+
+    # Join clips left to right
+    video_label, audio_label = "[v0]", "[a0]"
+    total_duration = durations[0]
+    for i in range(len(clips) - 1):
+        trans = transition_map.get(i)
+        if trans and trans['duration'] > 0:
+            # A transition can't be longer than either side of it
+            trans_duration = min(trans['duration'], total_duration, durations[i + 1])
+            offset = total_duration - trans_duration
+            parts.append(
+                f"{video_label}[v{i+1}]xfade=transition={trans['type']}:"
+                f"duration={trans_duration:.3f}:offset={offset:.3f}[vj{i}]"
+            )
+            parts.append(f"{audio_label}[a{i+1}]acrossfade=d={trans_duration:.3f}[aj{i}]")
+            total_duration += durations[i + 1] - trans_duration
+        else:
+            parts.append(f"{video_label}[v{i+1}]concat=n=2:v=1:a=0[vj{i}]")
+            parts.append(f"{audio_label}[a{i+1}]concat=n=2:v=0:a=1[aj{i}]")
+            total_duration += durations[i + 1]
+        video_label, audio_label = f"[vj{i}]", f"[aj{i}]"
+
+    # Text overlays on the joined video: one pre-rasterized layer, or drawtext per line
+    drawtext_filters: List[str] = []
+    if text_layer is not None:
+        input_args.extend(text_layer.input_args)
+        parts.append(text_layer.overlay_filter(video_label, f"[{len(clips)}:v]", "[outv]"))
+        video_label = "[outv]"
+    else:
+        for overlay in overlays:
+            drawtext_filters.extend(
+                build_drawtext_filters(overlay, W, H, preview_width or 400)
+            )
+    if drawtext_filters:
+        parts.append(f"{video_label}{','.join(drawtext_filters)}[outv]")
+        video_label = "[outv]"
+
+    return CompiledGraph(
+        input_args=input_args,
+        filter_graph=";\n".join(parts),
+        video_label=video_label,
+        audio_label=audio_label,
+        duration=total_duration,
+    )
 
-    clip_mappings = []
-    concat_position = 0.0
 
-    for i, clip in enumerate(sorted_clips):
-        effective_duration = clip.sourceDuration - clip.trimStart - clip.trimEnd
-        editor_start = clip.startTime
-        editor_end = editor_start + effective_duration
+async def filter_graph_args(graph: CompiledGraph, output_path: Path, work_dir: Path,
+                            maps: Optional[List[str]] = None) -> List[str]:
+    """
+    Inputs, filter graph and output maps of a compiled graph, as FFmpeg args.
 
-        # Check if there's a transition INTO this clip (reduces concat position)
-        transition_offset = 0.0
-        if transitions and i > 0:
-            for trans in transitions:
-                if trans.get('toClipIndex') == i or (hasattr(trans, 'toClipIndex') and trans.toClipIndex == i):
-                    duration = trans.get('duration', 0) if isinstance(trans, dict) else trans.duration
-                    transition_offset = duration
-                    break
+    Graphs longer than FILTER_SCRIPT_MIN_CHARS are written to a script file
+    and passed with -filter_complex_script to stay clear of argv limits.
+    `maps` replaces the default maps of the graph's video and audio labels.
+    """
+    if len(graph.filter_graph) > FILTER_SCRIPT_MIN_CHARS:
+        script_path = work_dir / f"{output_path.stem}_filter_graph.txt"
+        async with aiofiles.open(script_path, "w") as f:
+            await f.write(graph.filter_graph)
+        filter_args = ["-filter_complex_script", str(script_path)]
+        print(f"[SinglePass] Filter graph ({len(graph.filter_graph)} chars) written to {script_path}")
+    else:
+        filter_args = ["-filter_complex", graph.filter_graph]
+    return graph.input_args + filter_args + (maps or ["-map", graph.video_label, "-map", graph.audio_label])
 
-        # Adjust concat position for transition overlap
-        concat_start = max(0, concat_position - transition_offset)
-        concat_end = concat_start + effective_duration
 
-        clip_mappings.append({
-            'clip_index': i,
-            'editor_start': editor_start,
-            'editor_end': editor_end,
-            'concat_start': concat_start,
-            'concat_end': concat_end,
-            'effective_duration': effective_duration,
-        })
+async def run_filter_graph(
+    graph: CompiledGraph,
+    output_path: Path,
+    work_dir: Path,
+    encode_args: Optional[List[str]] = None,
+    mux_args: Optional[List[str]] = None,
+) -> FFmpegProgress:
+    """Encode a compiled graph to `output_path` in one FFmpeg process (muxed with `mux_args`, if any)."""
+    if encode_args is None:
+        encode_args = EXPORT_VIDEO_ENCODE_ARGS + EXPORT_AUDIO_ENCODE_ARGS
+
+    progress = await run_ffmpeg(
+        await filter_graph_args(graph, output_path, work_dir) + [*encode_args, *(mux_args or []), str(output_path)],
+        expected_duration=graph.duration,
+    )
+    encode_stats.record("single", graph.duration, progress.elapsed)
+    return progress
 
-        # Move concat position forward (accounting for transition overlap already applied)
-        concat_position = concat_end
 
-    print(f"[TimeRemap] Clip timeline mappings:")
-    for m in clip_mappings:
-        print(f"[TimeRemap]   Clip {m['clip_index']}: editor [{m['editor_start']:.2f}-{m['editor_end']:.2f}] -> concat [{m['concat_start']:.2f}-{m['concat_end']:.2f}]")
+def hls_renditions(output_height: int, ladder: bool) -> List[Tuple[Optional[int], int]]:
+    """
+    (height, max video kbps) of each HLS rendition, full size (height None) first.
 
-    # Now remap each overlay
-    remapped_overlays = []
+    The full-size rendition is capped by the HLS_LADDER rung at or above its
+    height (the top rung if none is); with `ladder`, the rungs below it follow.
+    """
+    rungs = sorted(
+        ((int(height), int(kbps)) for height, kbps in (rung.split(":") for rung in HLS_LADDER.split(",") if rung.strip())),
+        reverse=True,
+    )
+    if not rungs:
+        return [(None, 0)]
+    top_kbps = next((kbps for height, kbps in reversed(rungs) if height >= output_height), rungs[0][1])
+    renditions: List[Tuple[Optional[int], int]] = [(None, top_kbps)]
+    if ladder:
+        renditions += [(height, kbps) for height, kbps in rungs if height < output_height]
+    return renditions
+
+
+async def run_filter_graph_hls(
+    graph: CompiledGraph,
+    hls_dir: Path,
+    work_dir: Path,
+    video_args: List[str],
+    audio_args: List[str],
+    renditions: List[Tuple[Optional[int], int]],
+) -> FFmpegProgress:
+    """
+    Encode a compiled graph into HLS in `hls_dir`, one rendition per entry of `renditions`.
 
-    for overlay in overlays:
-        original_start = overlay.startTime
-        original_end = original_start + overlay.duration
+    Writes fMP4 segments of about HLS_SEGMENT_SECONDS (a keyframe starts
+    each), an event playlist per rendition (stream_<n>.m3u8) that grows as
+    segments finish, and master.m3u8. Segments and playlists are written to
+    temp files and renamed, so anything listed is complete.
+    """
+    count = len(renditions)
+    filters = [graph.filter_graph]
+    if count > 1:
+        filters.append(f"{graph.video_label}split={count}" + "".join(f"[hv{i}]" for i in range(count)))
+        filters.append(f"{graph.audio_label}asplit={count}" + "".join(f"[ha{i}]" for i in range(count)))
+    maps: List[str] = []
+    rate_args: List[str] = []
+    for i, (height, kbps) in enumerate(renditions):
+        video = graph.video_label if count == 1 else f"[hv{i}]"
+        if height:
+            filters.append(f"{video}scale=-2:{height}[hs{i}]")
+            video = f"[hs{i}]"
+        maps += ["-map", video, "-map", graph.audio_label if count == 1 else f"[ha{i}]"]
+        if kbps:
+            # Capped rates give the master playlist the BANDWIDTH players switch renditions on
+            rate_args += [f"-maxrate:v:{i}", f"{kbps}k", f"-bufsize:v:{i}", f"{kbps * 2}k"]
+    hls_graph = CompiledGraph(
+        input_args=graph.input_args,
+        filter_graph=";\n".join(filters),
+        video_label=graph.video_label,
+        audio_label=graph.audio_label,
+        duration=graph.duration,
+    )
 
-        # Find which clip(s) this overlay belongs to based on editor timeline
-        # An overlay might span multiple clips, so we use the start time to anchor it
-        matched_clip = None
-        for mapping in clip_mappings:
-            # Check if overlay starts within this clip's editor timeline span
-            if mapping['editor_start'] <= original_start < mapping['editor_end']:
-                matched_clip = mapping
-                break
+    hls_dir.mkdir(parents=True, exist_ok=True)
+    progress = await run_ffmpeg(
+        await filter_graph_args(hls_graph, hls_dir / "stream.m3u8", work_dir, maps=maps) + [
+            *video_args, *rate_args, *audio_args,
+            "-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})",
+            "-f", "hls",
+            "-hls_time", str(HLS_SEGMENT_SECONDS),
+            "-hls_playlist_type", "event",
+            "-hls_segment_type", "fmp4",
+            "-hls_flags", "independent_segments+temp_file",
+            "-hls_fmp4_init_filename", "init.mp4",
+            "-hls_segment_filename", str(hls_dir / "stream_%v_%05d.m4s"),
+            "-master_pl_name", "master.m3u8",
+            "-var_stream_map", " ".join(f"v:{i},a:{i}" for i in range(count)),
+            str(hls_dir / "stream_%v.m3u8"),
+        ],
+        expected_duration=graph.duration,
+    )
+    encode_stats.record("single", graph.duration, progress.elapsed)
+    return progress
 
-        if matched_clip is None:
-            # Overlay starts before first clip or after last clip
-            # Try to find the closest clip
-            if original_start < clip_mappings[0]['editor_start']:
-                matched_clip = clip_mappings[0]
-                print(f"[TimeRemap] Overlay '{overlay.text[:20]}...' starts before first clip, anchoring to clip 0")
-            else:
-                matched_clip = clip_mappings[-1]
-                print(f"[TimeRemap] Overlay '{overlay.text[:20]}...' starts after last clip, anchoring to last clip")
 
-        # Calculate the offset within the clip (in editor timeline)
-        offset_within_clip = original_start - matched_clip['editor_start']
+def timeline_layout(durations: List[float], transitions: List[dict]) -> Tuple[List[float], List[Tuple[float, float]], float]:
+    """
+    Where each clip lands on the joined output: (clip start offsets, transition
+    windows as (start, end), total duration). Mirrors compile_export_graph.
+    """
+    transition_map = {t['fromClipIndex']: t for t in transitions}
+    offsets = [0.0]
+    windows: List[Tuple[float, float]] = []
+    total = durations[0]
+    for i in range(len(durations) - 1):
+        trans = transition_map.get(i)
+        if trans and trans['duration'] > 0:
+            trans_duration = min(trans['duration'], total, durations[i + 1])
+            windows.append((total - trans_duration, total))
+            total -= trans_duration
+        offsets.append(total)
+        total += durations[i + 1]
+    return offsets, windows, total
+
+
+def slice_timeline(
+    clips: List[TimelineClip],
+    transitions: List[dict],
+    start: float,
+    end: float,
+) -> Tuple[List[int], List[TimelineClip], List[dict]]:
+    """
+    The part of a timeline that lands on output [start, end), as its own timeline.
 
-        # Apply same offset in concatenated timeline
-        new_start = matched_clip['concat_start'] + offset_within_clip
+    Returns the indices of the clips involved, those clips narrowed to the
+    range, and the transitions between them re-indexed. `start` and `end`
+    must not fall inside a transition window.
+    """
+    durations = [clip.duration for clip in clips]
+    offsets, _, _ = timeline_layout(durations, transitions)
+    indices: List[int] = []
+    sliced: List[TimelineClip] = []
+    for i, clip in enumerate(clips):
+        head = max(0.0, start - offsets[i])
+        tail = max(0.0, offsets[i] + durations[i] - end)
+        if durations[i] - head - tail < 1e-3:
+            continue
+        indices.append(i)
+        sliced.append(replace(clip, start=clip.start + head, duration=clip.duration - head - tail))
+    local = {index: n for n, index in enumerate(indices)}
+    sliced_transitions = [
+        {**t, 'fromClipIndex': local[t['fromClipIndex']], 'toClipIndex': local[t['fromClipIndex']] + 1}
+        for t in transitions
+        if t['fromClipIndex'] in local and t['fromClipIndex'] + 1 in local
+    ]
+    return indices, sliced, sliced_transitions
 
-        # Clamp to valid range (0 to total duration)
-        total_concat_duration = clip_mappings[-1]['concat_end']
-        new_start = max(0, min(new_start, total_concat_duration - 0.1))
 
-        # Ensure duration doesn't extend past video end
-        new_duration = min(overlay.duration, total_concat_duration - new_start)
+async def render_timeline_chunked(
+    clips: List[TimelineClip],
+    transitions: List[dict],
+    overlays: List[TextOverlay],
+    output_width: int,
+    output_height: int,
+    frame_rate: str,
+    output_path: Path,
+    work_dir: Path,
+    video_args: List[str],
+    audio_args: List[str],
+    preview_width: Optional[int] = None,
+    scale_flags: Optional[str] = None,
+    mux_args: Optional[List[str]] = None,
+) -> bool:
+    """
+    Render a timeline as parallel chunk encodes of the single-pass graph.
+
+    The output is cut on the frame grid outside every transition window, so
+    each chunk is an independent timeline: the clips it covers with tightened
+    trims, their transitions, and the overlays shifted into it. Chunks are
+    encoded with matched settings and closed GOPs (audio as PCM, so the joins
+    are sample-exact), then joined with the concat demuxer; the audio is
+    encoded once at the join. Returns False when the timeline is too short
+    to split.
+    """
+    _, windows, total = timeline_layout([clip.duration for clip in clips], transitions)
+    fps = float(Fraction(frame_rate)) if frame_rate else 30.0
+    margin = 1.0 / fps
+
+    def snap(t: float) -> Optional[float]:
+        t = round(t * fps) / fps
+        for window_start, window_end in windows:
+            if window_start - margin < t < window_end + margin:
+                t = math.ceil((window_end + margin) * fps) / fps
+        return t if t < total else None
+
+    ranges = plan_chunk_ranges(total, snap)
+    if len(ranges) < 2:
+        return False
+
+    chunks_dir = work_dir / f"{output_path.stem}_chunks"
+    chunks_dir.mkdir(parents=True, exist_ok=True)
+    encode_args = chunk_encode_args(video_args) + ["-c:a", "pcm_s16le"]
+    commands: List[Tuple[List[str], float]] = []
+    chunk_paths: List[Path] = []
+    for k, (start, end) in enumerate(ranges):
+        _, chunk_clips, chunk_transitions = slice_timeline(clips, transitions, start, end)
+        chunk_overlays = [
+            overlay.model_copy(update={"startTime": overlay.startTime - start})
+            for overlay in overlays
+            if overlay.startTime < end and overlay.startTime + overlay.duration > start
+        ]
+        text_layer = None
+        if chunk_overlays and TEXT_OVERLAY_RENDERER == "raster":
+            text_layer = await build_text_layer(chunk_overlays, output_width, output_height, preview_width or 400,
+                                                end - start, chunks_dir, f"text_{k}")
+        graph = compile_export_graph(
+            chunk_clips,
+            chunk_transitions,
+            chunk_overlays if TEXT_OVERLAY_RENDERER != "raster" else [],
+            output_width,
+            output_height,
+            frame_rate,
+            preview_width=preview_width,
+            text_layer=text_layer,
+            scale_flags=scale_flags,
+        )
+        # Clips cut mid-chunk round to whole frames on their own; hold each chunk's
+        # video to exactly its span of the output frame grid (audio is already exact)
+        frames = round(end * fps) - round(start * fps)
+        graph = CompiledGraph(
+            input_args=graph.input_args,
+            filter_graph=f"{graph.filter_graph};\n"
+                         f"{graph.video_label}tpad=stop=-1:stop_mode=clone,trim=end_frame={frames}[vchunk]",
+            video_label="[vchunk]",
+            audio_label=graph.audio_label,
+            duration=graph.duration,
+        )
+        chunk_path = chunks_dir / f"chunk_{k}.mkv"
+        chunk_paths.append(chunk_path)
+        commands.append((
+            await filter_graph_args(graph, chunk_path, chunks_dir) + [*encode_args, str(chunk_path)],
+            graph.duration,
+        ))
+
+    await run_chunked_encode("timeline", commands, total)
+
+    # Joining is a quick remux plus the audio encode; keep the chunks' progress report
+    concat_list_path = chunks_dir / "chunks.ffconcat"
+    lines = ["ffconcat version 1.0"]
+    for path, (start, end) in zip(chunk_paths, ranges):
+        lines += [f"file '{path}'", f"duration {end - start:.6f}"]
+    async with aiofiles.open(concat_list_path, "w") as f:
+        await f.write("\n".join(lines) + "\n")
+    with report_ffmpeg_progress(lambda p: None):
+        await run_ffmpeg([
+            "-f", "concat", "-safe", "0", "-i", str(concat_list_path),
+            "-map", "0:v:0", "-map", "0:a:0",
+            "-c:v", "copy",
+            *audio_args,
+            *(mux_args or []),
+            str(output_path),
+        ], expected_duration=total)
+
+    await asyncio.to_thread(shutil.rmtree, chunks_dir, ignore_errors=True)
+    return True
 
-        print(f"[TimeRemap] Overlay '{overlay.text[:30]}': editor {original_start:.2f}s -> concat {new_start:.2f}s (clip {matched_clip['clip_index']}, offset {offset_within_clip:.2f}s)")
 
-        # Create new overlay with adjusted times
-        remapped_overlay = TextOverlay(
-            id=overlay.id,
-            startTime=new_start,
-            duration=new_duration,
-            text=overlay.text,
-            position=overlay.position,
-            style=overlay.style,
-        )
-        remapped_overlays.append(remapped_overlay)
+# ============================================
+# Work Directory Budget
+# ============================================
 
-    return remapped_overlays
+def unlink_unshared(path: Path) -> int:
+    """Delete a file; returns the bytes that frees (0 if a cache still links to it)."""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return 0
+    path.unlink(missing_ok=True)
+    return st.st_size if st.st_nlink == 1 else 0
 
 
-def build_drawtext_filters(
-    overlay: TextOverlay,
-    video_width: int,
-    video_height: int,
-    preview_width: int = 400,  # Approximate preview width in the web editor
-) -> list[str]:
-    """
-    Build FFmpeg drawtext filter strings for a text overlay.
+def work_dir_bytes(path: Path) -> int:
+    """Bytes of the files under `path`, leaving out files hard-linked from the caches."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            if st.st_nlink == 1:
+                total += st.st_size
+    return total
 
-    Returns a LIST of filter strings - one per line for multiline text.
-    This approach handles newlines reliably by rendering each line separately.
 
-    Position values (x, y) are percentages (0-100) where:
-    - x=0 is left edge, x=100 is right edge
-    - y=0 is top edge, y=100 is bottom edge
-    - x=50, y=50 is center of the video
+class WorkDirBudget:
+    """
+    Admits exports by the bytes they will hold under WORK_DIR.
+
+    Each export reserves its estimated peak footprint before it starts and
+    waits while the reservations of running exports plus its own would top
+    `max_bytes`, or while the filesystem's free space - less what running
+    exports have reserved but not yet written - can't take it. An export
+    that fits nowhere still runs once nothing else holds a reservation.
+    Waiting exports look again whenever one finishes, and every
+    WORK_DIR_RECHECK_SECONDS as running ones free their intermediates.
     """
-    style = overlay.style
 
-    # Get font path (includes validation and fallback logic)
-    font_path = get_font_path(style.fontFamily, style.fontWeight)
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.reserved: Dict[str, int] = {}  # Job id -> estimated peak bytes
+        self.waiting = 0
+        self.delayed = 0  # Admissions that had to wait
+        self._changed = asyncio.Condition()
+
+    def open(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        total = shutil.disk_usage(self.root).total
+        if self.max_bytes <= 0:
+            self.max_bytes = int(total * 0.75)
+        print(f"[WorkDir] Budget {self.max_bytes / (1024*1024):.0f} MB of {total / (1024*1024):.0f} MB at {self.root}")
+
+    def _fits(self, estimate: int) -> bool:
+        """Blocking; run it in a thread."""
+        reserved = sum(self.reserved.values())
+        if reserved + estimate > self.max_bytes:
+            return False
+        unwritten = max(reserved - work_dir_bytes(self.root), 0)
+        return estimate + unwritten <= shutil.disk_usage(self.root).free
+
+    async def admit(self, job_id: str, estimate: int) -> None:
+        """Wait until `estimate` bytes fit, then reserve them for `job_id`."""
+        async with self._changed:
+            waited = False
+            while self.reserved and not await asyncio.to_thread(self._fits, estimate):
+                if not waited:
+                    waited = True
+                    self.delayed += 1
+                    print(f"[WorkDir] Export:{job_id} waiting for {estimate / (1024*1024):.1f} MB "
+                          f"({sum(self.reserved.values()) / (1024*1024):.1f} MB reserved)")
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(self._changed.wait(), WORK_DIR_RECHECK_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self.waiting -= 1
+            self.reserved[job_id] = estimate
+
+    async def release(self, job_id: str) -> None:
+        async with self._changed:
+            self.reserved.pop(job_id, None)
+            self._changed.notify_all()
+
+    async def snapshot(self) -> dict:
+        def measure() -> dict:
+            usage = shutil.disk_usage(self.root)
+            return {
+                "maxBytes": self.max_bytes,
+                "reservedBytes": sum(self.reserved.values()),
+                "usedBytes": work_dir_bytes(self.root),
+                "freeBytes": usage.free,
+                "waiting": self.waiting,
+                "delayed": self.delayed,
+                "jobs": {
+                    job_id: {"reservedBytes": reserved, "usedBytes": work_dir_bytes(self.root / job_id)}
+                    for job_id, reserved in list(self.reserved.items())
+                },
+            }
+        return await asyncio.to_thread(measure)
+
+
+work_dir_budget = WorkDirBudget(WORK_DIR, WORK_DIR_MAX_BYTES)
 
-    # Calculate position in pixels from percentage
-    pos = overlay.position
-    x_pct = pos.get('x', 50) if isinstance(pos, dict) else getattr(pos, 'x', 50)
-    y_pct = pos.get('y', 50) if isinstance(pos, dict) else getattr(pos, 'y', 50)
 
+async def _source_size(url: str) -> Tuple[Optional[float], bool]:
+    """
+    (size, cached) of a source; size None if unknown.
+
+    Known locally first: the source cache's blob size, then bitrate x duration
+    from the memoized probe of the URL's last download. Only sources neither
+    knows cost a HEAD request, cut off after SOURCE_SIZE_HEAD_TIMEOUT_SECONDS.
+    """
+    record = source_cache.urls.get(url) if SOURCE_CACHE_ENABLED else None
+    if record is not None and record.content_id in source_cache.blobs:
+        return source_cache.blobs[record.content_id].size, True
+    content_id = source_content_ids.get(url)
+    media = media_probe.peek(content_id) if content_id else None
+    if media is not None and media.bitRate and media.duration:
+        return media.bitRate * media.duration / 8, False
     try:
-        x_pct = float(x_pct)
-        y_pct = float(y_pct)
-    except (TypeError, ValueError):
-        print(f"[Warning] Invalid position values: x={x_pct}, y={y_pct}. Using center.")
-        x_pct = 50.0
-        y_pct = 50.0
+        session = await open_http_session()
+        timeout = aiohttp.ClientTimeout(total=SOURCE_SIZE_HEAD_TIMEOUT_SECONDS)
+        async with session.head(url, allow_redirects=True, timeout=timeout) as response:
+            if response.status == 200 and response.content_length:
+                return response.content_length, False
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        pass
+    return None, False
 
-    x_pos = int((x_pct / 100) * video_width)
-    y_pos = int((y_pct / 100) * video_height)
 
-    # Scale font size and padding proportionally to video resolution
-    scale_factor = video_width / preview_width
-    scaled_font_size = int(style.fontSize * scale_factor)
-    scaled_padding = int((style.backgroundPadding or 0) * scale_factor)
+async def estimate_export_footprint(request: VideoExportRequest) -> int:
+    """
+    Peak bytes an export will hold on WORK_DIR's filesystem, estimated before it starts.
+
+    Source sizes come from the source cache or probes when known, else from
+    HEAD requests sent all at once (see _source_size): cached sources are
+    only linked into the work dir and cost nothing, the rest cost their
+    size. Each clip's output is its share of its source's bytes (the trimmed
+    duration over sourceDuration); sources of unknown size count
+    ESTIMATE_BITS_PER_PIXEL at 1080p30. With intermediates freed as soon as
+    they are read, a file render holds two outputs' worth at its peak (the
+    segments and the joined timeline, or chunks and their join), a streamed
+    one at most what it renders to a file for Supabase, and an HLS one only
+    segments not yet published.
+    """
+    urls = list(dict.fromkeys(clip.sourceUrl for clip in request.clips))
+    sizes = dict(zip(urls, await asyncio.gather(*(_source_size(url) for url in urls))))
+    for url, (size, cached) in sizes.items():
+        if not size:
+            seconds = max(clip.sourceDuration for clip in request.clips if clip.sourceUrl == url)
+            sizes[url] = (ESTIMATE_BITS_PER_PIXEL * 1920 * 1080 * 30 / 8 * seconds, cached)
+
+    inputs = sum(size for size, cached in sizes.values() if not cached)
+    output = sum(
+        sizes[clip.sourceUrl][0] * max(clip.sourceDuration - clip.trimStart - clip.trimEnd, 0.0) / clip.sourceDuration
+        for clip in request.clips if clip.sourceDuration > 0
+    )
+    _, streaming = export_render_mode(request)
+    if request.outputFormat == "hls":
+        output = 0.0
+    elif streaming:
+        output = min(output, GCS_LARGE_FILE_THRESHOLD)
+    elif not request.preview:  # Previews are small single-pass renders
+        output *= 2
+    return int(inputs + output)
 
-    # Line height with some spacing (typically 1.2x font size)
-    line_height = int(scaled_font_size * 1.2)
 
-    print(f"[Font] Family: {style.fontFamily}, Weight: {style.fontWeight}, Path: {font_path}")
-    print(f"[Font] Original size: {style.fontSize}px, Scale: {scale_factor:.2f}, Scaled: {scaled_font_size}px")
-    print(f"[Position] x={x_pct}% -> {x_pos}px, y={y_pct}% -> {y_pos}px (video: {video_width}x{video_height})")
+# ============================================
+# Stage Graph
+# ============================================
 
-    # Color conversion
-    font_color, font_color_opacity = hex_to_ffmpeg_color(style.color)
-    final_font_opacity = style.opacity * font_color_opacity
+@dataclass
+class Stage:
+    """One node of a StageGraph."""
+    name: str
+    run: Callable[..., Any]  # Async callable, called with the results of `deps`
+    deps: List[str]
+    cost: float = 1.0  # Rough relative work, for prioritizing the critical path
+    save: Optional[Callable[[Any], dict]] = None  # Result -> JSON-able checkpoint
+    load: Optional[Callable[[dict], Any]] = None  # Checkpoint -> result, None if its artifacts are gone
+    artifacts: Optional[Callable[[Any], List[Path]]] = None  # Result -> files it leaves for its dependents
+    uses: Optional[List[str]] = None  # Deps whose artifacts it reads (default: all of them)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+
+    @property
+    def seconds(self) -> float:
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+
+class StageGraph:
+    """
+    A pipeline as a dependency graph of async stages.
+
+    Each stage starts as soon as the stages it depends on have finished and
+    is called with their results, in `deps` order. Stages don't reserve CPU
+    themselves: FFmpeg runs inside them queue for ffmpeg_pool (the shared CPU
+    budget), and when slots are scarce the stage with the most estimated
+    work still ahead of it (its own cost plus its longest chain of
+    dependents) gets the next one. A failing stage cancels the rest.
+
+    With a `journal`, stages that have `save`/`load` record a checkpoint when
+    they finish, and a later run of the same graph restores the ones whose
+    checkpoint still loads instead of running them again. Only stages that
+    something still needs are run: the final stages, and the dependencies of
+    every stage that has to run.
+
+    With a `scratch` dir, the files a stage reports as `artifacts` (those
+    under `scratch`) are deleted as soon as every stage that reads them -
+    its dependents, less those whose `uses` leave it out - has finished, or
+    right away if none of them has to run. Files of the final stages are
+    kept. A stage whose restored result is still needed for its files, but
+    whose files are gone, runs again.
+    """
 
-    # Background color
-    bg_color, bg_opacity, final_bg_opacity = None, None, None
-    if style.backgroundColor:
-        bg_color, bg_opacity = hex_to_ffmpeg_color(style.backgroundColor)
-        final_bg_opacity = style.opacity * bg_opacity
+    def __init__(self, name: str, journal: Optional["StageJournal"] = None, scratch: Optional[Path] = None):
+        self.name = name
+        self.journal = journal
+        self.scratch = scratch
+        self.stages: Dict[str, Stage] = {}
+
+    def add(self, name: str, run: Callable[..., Any], deps: Optional[List[str]] = None, cost: float = 1.0,
+            save: Optional[Callable[[Any], dict]] = None, load: Optional[Callable[[dict], Any]] = None,
+            artifacts: Optional[Callable[[Any], List[Path]]] = None, uses: Optional[List[str]] = None) -> str:
+        deps = list(deps or [])
+        missing = [dep for dep in [*deps, *(uses or [])] if dep not in self.stages]
+        if missing or name in self.stages or not set(uses or []) <= set(deps):
+            raise ValueError(f"Stage {name}: unknown dependencies {missing}, uses outside deps, or duplicate name")
+        self.stages[name] = Stage(name=name, run=run, deps=deps, cost=cost, save=save, load=load,
+                                  artifacts=artifacts, uses=uses)
+        return name
+
+    def _uses(self, stage: Stage) -> Set[str]:
+        return set(stage.deps if stage.uses is None else stage.uses)
+
+    def _artifacts(self, name: str, result: Any) -> List[Path]:
+        """The files of a stage's result that live under the scratch dir."""
+        stage = self.stages[name]
+        if self.scratch is None or stage.artifacts is None:
+            return []
+        return [path for path in stage.artifacts(result) if self.scratch in path.parents]
+
+    def _restore(self) -> Dict[str, Any]:
+        """Results of the stages whose journaled checkpoint still loads."""
+        restored: Dict[str, Any] = {}
+        if self.journal is None:
+            return restored
+        for stage in self.stages.values():
+            data = self.journal.saved.get(stage.name)
+            if data is None or stage.load is None:
+                continue
+            try:
+                result = stage.load(data)
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"[Stages] {self.name}: ignoring unreadable checkpoint of {stage.name}: {e}")
+                continue
+            if result is not None:
+                restored[stage.name] = result
+        return restored
+
+    def _needed(self, restored: Dict[str, Any]) -> List[str]:
+        """
+        Stages to run: the final ones and, transitively, the deps of every
+        stage that runs. A restored dep whose files a running stage reads but
+        which are gone is dropped from `restored` and runs again.
+        """
+        has_dependents = {dep for stage in self.stages.values() for dep in stage.deps}
+        needed: Dict[str, None] = {}  # Insertion-ordered set
+
+        def need(name: str) -> None:
+            if name in needed:
+                return
+            needed[name] = None
+            stage = self.stages[name]
+            for dep in stage.deps:
+                if (dep in restored and dep in self._uses(stage)
+                        and not all(path.exists() for path in self._artifacts(dep, restored[dep]))):
+                    print(f"[Stages] {self.name}: files of {dep} are gone, running it again")
+                    del restored[dep]
+                if dep not in restored:
+                    need(dep)
+
+        for name in self.stages:
+            if name not in has_dependents and name not in restored:
+                need(name)
+        return [name for name in self.stages if name in needed]  # Keep definition order
+
+    def _priorities(self) -> Dict[str, float]:
+        """Each stage's cost plus the costliest chain of stages depending on it."""
+        dependents: Dict[str, List[str]] = {name: [] for name in self.stages}
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                dependents[dep].append(stage.name)
+        priorities: Dict[str, float] = {}
+        for name in reversed(list(self.stages)):  # Dependencies are always added first
+            priorities[name] = self.stages[name].cost + max(
+                (priorities[d] for d in dependents[name]), default=0.0
+            )
+        return priorities
+
+    async def run(self) -> Dict[str, Any]:
+        """Run (or restore) every stage still needed; returns the results by name."""
+        priorities = self._priorities()
+        restored = self._restore()
+        if restored:
+            print(f"[Stages] {self.name}: resuming with {len(restored)} finished stage(s): {', '.join(restored)}")
+        tasks: Dict[str, asyncio.Task] = {}
+        needed = self._needed(restored)
+
+        # Artifact files -> stages still to finish reading them; a file is freed when it drops to 0
+        has_dependents = {dep for stage in self.stages.values() for dep in stage.deps}
+        readers = {name: sum(1 for user in needed if name in self._uses(self.stages[user])) for name in self.stages}
+        holds: Dict[Path, int] = {}
+
+        def hold(name: str, result: Any) -> List[Path]:
+            if name not in has_dependents:
+                return []  # Final results are the caller's
+            paths = self._artifacts(name, result)
+            for path in paths:
+                holds[path] = holds.get(path, 0) + readers[name]
+            return paths
+
+        async def release(paths: List[Path]) -> None:
+            for path in paths:
+                holds[path] -= 1
+            await free([path for path in dict.fromkeys(paths) if holds[path] <= 0])
+
+        async def free(paths: List[Path]) -> None:
+            for path in paths:
+                del holds[path]
+                if not path.exists():
+                    continue  # Freed by an earlier run
+                freed = await asyncio.to_thread(unlink_unshared, path)
+                print(f"[Stages] {self.name}: freed {path.name} ({freed / (1024*1024):.1f} MB)")
+
+        async def execute(stage: Stage) -> Any:
+            results = [restored[dep] if dep in restored else await tasks[dep] for dep in stage.deps]
+            process_priority.set(priorities[stage.name])  # Task-local
+            stage.started = time.monotonic()
+            result = await stage.run(*results)
+            stage.finished = time.monotonic()
+            if self.journal is not None and stage.save is not None:
+                await self.journal.record(stage.name, stage.save(result))
+            # Hold this stage's files for its readers before letting go of the ones it read:
+            # a stage may hand on a dep's file as its own
+            await free([path for path in hold(stage.name, result) if holds[path] <= 0])
+            await release([
+                path for dep in self._uses(stage)
+                for path in self._artifacts(dep, restored[dep] if dep in restored else tasks[dep].result())
+                if path in holds
+            ])
+            return result
+
+        for name, result in restored.items():
+            hold(name, result)
+        await free([path for path, count in holds.items() if count <= 0])
+
+        started = time.monotonic()
+        for name in needed:
+            tasks[name] = asyncio.create_task(execute(self.stages[name]))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        # Measured critical path: the slowest chain of stages, each waiting on its dependencies
+        path: Dict[str, float] = {}
+        for stage in self.stages.values():
+            path[stage.name] = stage.seconds + max((path[dep] for dep in stage.deps), default=0.0)
+        wall = time.monotonic() - started
+        print(f"[Stages] {self.name}: {len(tasks)} stages in {wall:.2f}s "
+              f"(critical path {max(path.values(), default=0.0):.2f}s, stages summed {sum(s.seconds for s in self.stages.values()):.2f}s)")
+        return {**restored, **{name: task.result() for name, task in tasks.items()}}
+
+
+@dataclass
+class StageJournal:
+    """Checkpoints a StageGraph recorded on earlier runs, and where it records new ones."""
+    saved: Dict[str, dict]
+    record: Callable[[str, dict], Awaitable[None]]
 
-    # Timing
-    end_time = overlay.startTime + overlay.duration
 
-    # Split text into lines
-    lines = split_text_into_lines(overlay.text)
-    num_lines = len(lines)
+# ============================================
+# Export Jobs
+# ============================================
 
-    print(f"[TextOverlay] {num_lines} line(s): {lines}")
+# (stage, start percent, end percent) - overall progress spans each stage's range
+EXPORT_STAGES = [
+    ("downloading", 0, 15),
+    ("rendering", 15, 85),  # Single-pass mode: trims, transitions and overlays in one encode
+    ("trimming", 15, 45),
+    ("concatenating", 45, 70),
+    ("overlays", 70, 85),
+    ("uploading", 85, 97),
+    ("recording", 97, 100),
+]
+EXPORT_STAGE_RANGES = {name: (start, end) for name, start, end in EXPORT_STAGES}
 
-    # Calculate total text block height to center it on y_pos
-    total_height = num_lines * line_height
-    # Starting Y position (top of first line, adjusted to center the block)
-    start_y = y_pos - (total_height // 2) + (line_height // 2)
 
-    filters = []
-    for i, line_text in enumerate(lines):
-        if not line_text.strip():
-            # Skip empty lines but account for spacing
-            continue
+class ExportLedger:
+    """
+    SQLite ledger of export jobs and the stages they have finished.
 
-        escaped_text = escape_text_for_drawtext(line_text)
+    A job row holds the request, status and (once finished) the result; a
+    stage row holds that stage's checkpoint - artifact paths and the facts
+    needed to carry on from them. On startup the registry re-queues every
+    unfinished job, whose stage graph then resumes from its checkpoints.
 
-        # Calculate Y position for this line
-        line_y = start_y + (i * line_height)
+    One connection, used from a single writer thread: the event loop never
+    waits on the disk, and writes land in the order they were made. Ledger
+    errors are logged and don't fail exports.
+    """
 
-        filter_parts = [
-            f"drawtext=text='{escaped_text}'",
-            f"fontfile='{font_path}'",
-            f"fontsize={scaled_font_size}",
-            f"fontcolor={font_color}@{final_font_opacity}",
-        ]
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS export_jobs (
+            id TEXT PRIMARY KEY,
+            fingerprint TEXT,
+            request TEXT NOT NULL,
+            status TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            percent REAL NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            finished_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS export_stages (
+            job_id TEXT NOT NULL REFERENCES export_jobs(id) ON DELETE CASCADE,
+            stage TEXT NOT NULL,
+            data TEXT NOT NULL,
+            finished_at TEXT NOT NULL,
+            PRIMARY KEY (job_id, stage)
+        );
+    """
 
-        # X position - always center on anchor point
-        filter_parts.append(f"x={x_pos}-(tw/2)")
+    def __init__(self, path: Path):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export-ledger")
 
-        # Y position for this specific line
-        filter_parts.append(f"y={line_y}-(th/2)")
+    def open(self) -> None:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA foreign_keys = ON")
+            conn.executescript(self.SCHEMA)
+        except sqlite3.Error as e:
+            print(f"[Ledger] Cannot open {self.path}, exports won't survive a restart: {e}")
+            return
+        self._conn = conn
+        print(f"[Ledger] Opened {self.path}")
+        if WORK_DIR.resolve() in self.path.resolve().parents:
+            # The default: on Cloud Run WORK_DIR is in memory and goes with the instance
+            print(f"[Ledger] WARNING: the export ledger is inside WORK_DIR ({WORK_DIR}). Unless WORK_DIR is a "
+                  f"persistent volume, unfinished exports are lost when the instance is recycled; set "
+                  f"EXPORT_LEDGER_PATH to a file on a persistent volume")
+
+    def close(self) -> None:
+        self._writer.shutdown(wait=True)  # Let queued writes land first
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+            self._conn = None
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def _run(self, sql: str, params: tuple = ()) -> List[tuple]:
+        if self._conn is None:
+            return []
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._writer, self._execute, sql, params)
+        except sqlite3.Error as e:
+            print(f"[Ledger] Error: {e}")
+            return []
+
+    async def save_job(self, job: "ExportJob") -> None:
+        """Insert or update a job's row."""
+        await self._run(
+            "INSERT INTO export_jobs (id, fingerprint, request, status, stage, percent, attempts, result,"
+            " created_at, updated_at, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(id) DO UPDATE SET status = excluded.status, stage = excluded.stage,"
+            " percent = excluded.percent, attempts = excluded.attempts, result = excluded.result,"
+            " updated_at = excluded.updated_at, finished_at = excluded.finished_at",
+            (
+                job.id, job.fingerprint, job.request.model_dump_json(), job.status, job.stage, job.percent,
+                job.attempts, job.result.model_dump_json() if job.result else None,
+                job.created_at.isoformat(), job.updated_at.isoformat(),
+                job.finished_at.isoformat() if job.finished_at else None,
+            ),
+        )
 
-        # Background box if specified
-        if bg_color:
-            filter_parts.append(f"box=1")
-            filter_parts.append(f"boxcolor={bg_color}@{final_bg_opacity}")
-            filter_parts.append(f"boxborderw={scaled_padding}")
+    async def save_stage(self, job_id: str, stage: str, data: dict) -> None:
+        await self._run(
+            "INSERT OR REPLACE INTO export_stages (job_id, stage, data, finished_at) VALUES (?, ?, ?, ?)",
+            (job_id, stage, json.dumps(data), datetime.utcnow().isoformat()),
+        )
 
-        # Timing
-        filter_parts.append(f"enable='between(t,{overlay.startTime},{end_time})'")
+    async def stages(self, job_id: str) -> Dict[str, dict]:
+        """Checkpoints of a job's finished stages, by stage name."""
+        rows = await self._run("SELECT stage, data FROM export_stages WHERE job_id = ?", (job_id,))
+        return {stage: json.loads(data) for stage, data in rows}
+
+    async def delete_jobs(self, job_ids: List[str]) -> None:
+        for job_id in job_ids:
+            await self._run("DELETE FROM export_jobs WHERE id = ?", (job_id,))
+
+    def load_jobs(self) -> List[dict]:
+        """Every job row, oldest first. Called once on startup."""
+        if self._conn is None:
+            return []
+        columns = ["id", "fingerprint", "request", "status", "stage", "percent", "attempts", "result",
+                   "created_at", "updated_at", "finished_at"]
+        try:
+            rows = self._execute(f"SELECT {', '.join(columns)} FROM export_jobs ORDER BY created_at")
+        except sqlite3.Error as e:
+            print(f"[Ledger] Error loading jobs: {e}")
+            return []
+        return [dict(zip(columns, row)) for row in rows]
 
-        filters.append(":".join(filter_parts))
-        print(f"[TextOverlay] Line {i+1} filter: y={line_y}")
 
-    return filters
+export_ledger = ExportLedger(EXPORT_LEDGER_PATH)
 
 
-def get_video_dimensions(video_path: Path) -> tuple[int, int]:
+class ExportJob:
     """
-    Get video dimensions using ffprobe.
-    Returns: (width, height)
+    A single export running in the background.
+
+    Progress updates bump `version` and wake everyone waiting in
+    `wait_for_change`, which is how the SSE stream learns about them.
     """
-    try:
-        cmd = [
-            "ffprobe",
-            "-v", "error",
-            "-select_streams", "v:0",
-            "-show_entries", "stream=width,height",
-            "-of", "csv=p=0",
-            str(video_path)
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode == 0:
-            parts = result.stdout.strip().split(',')
-            if len(parts) >= 2:
-                width = int(parts[0])
-                height = int(parts[1])
-                print(f"[FFprobe] Video dimensions: {width}x{height}")
-                return width, height
-    except Exception as e:
-        print(f"[FFprobe] Error getting dimensions: {e}")
 
-    # Fallback to common dimensions
-    print("[FFprobe] Using fallback dimensions: 1920x1080")
-    return 1920, 1080
+    def __init__(self, request: VideoExportRequest, fingerprint: Optional[str] = None,
+                 job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.request = request
+        self.fingerprint = fingerprint
+        self.work_dir = WORK_DIR / self.id
+        self.status = "queued"
+        self.stage = "queued"
+        self.percent = 0.0
+        self.created_at = datetime.utcnow()
+        self.updated_at = self.created_at
+        self.finished_at: Optional[datetime] = None
+        self.result: Optional[VideoExportResponse] = None
+        self.error: Optional[HTTPException] = None
+        self.task: Optional[asyncio.Task] = None
+        self.attempts = 0  # Runs started, including resumes after a restart
+        self.encode: Optional[EncodeProgress] = None
+        self.playback_url: Optional[str] = None
+        self.version = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def _notify(self) -> None:
+        self.updated_at = datetime.utcnow()
+        self.version += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def progress(self, stage: str, fraction: float) -> None:
+        """
+        Record progress as a fraction (0-1) of the given pipeline stage.
+
+        Stages can overlap (a clip trims while another still downloads), so
+        the overall percent only ever moves forward.
+        """
+        start, end = EXPORT_STAGE_RANGES[stage]
+        fraction = min(max(fraction, 0.0), 1.0)
+        self.status = "running"
+        self.stage = stage
+        self.percent = max(self.percent, round(start + (end - start) * fraction, 1))
+        self._notify()
+
+    def encode_reporter(self, stage: str, start: float = 0.0, end: float = 1.0) -> Callable[[FFmpegProgress], None]:
+        """
+        Build an FFmpeg progress sink for `stage`.
+
+        The encode's own completion is mapped onto the [start, end] fraction of
+        the stage, and the raw numbers (frames, speed, ETA) are kept on the job.
+        """
+        def report(p: FFmpegProgress) -> None:
+            fraction = p.fraction
+            eta = p.eta_seconds
+            self.encode = EncodeProgress(
+                stage=stage,
+                frames=p.frames,
+                fps=p.fps,
+                speed=p.speed,
+                outTimeSeconds=round(p.out_time, 2),
+                totalSeconds=p.total_duration,
+                percent=round(fraction * 100, 1) if fraction is not None else None,
+                etaSeconds=round(eta, 1) if eta is not None else None,
+                elapsedSeconds=round(p.elapsed, 1),
+            )
+            if fraction is not None:
+                self.progress(stage, start + (end - start) * fraction)
+            else:
+                self._notify()
+        return report
+
+    def playable(self, url: str) -> None:
+        """Record that the output can be streamed from `url` before the job finishes."""
+        self.playback_url = url
+        self._notify()
+
+    def finish(self, result: VideoExportResponse, error: Optional[HTTPException] = None) -> None:
+        self.status = "completed" if result.success else "failed"
+        self.stage = self.status
+        if result.success:
+            self.percent = 100.0
+        self.result = result
+        self.error = error
+        self.finished_at = datetime.utcnow()
+        self._notify()
+
+    async def wait_for_change(self, seen_version: int, timeout: float) -> bool:
+        """Wait until `version` moves past `seen_version`. False on timeout."""
+        if self.version != seen_version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def wait(self) -> VideoExportResponse:
+        """Wait for the job to finish. Cancelling the waiter does not cancel the job."""
+        if self.task is not None:  # Jobs restored already finished have no task
+            await asyncio.shield(self.task)
+        return self.result
+
+    def to_status(self) -> ExportJobStatus:
+        return ExportJobStatus(
+            jobId=self.id,
+            status=self.status,
+            stage=self.stage,
+            percent=self.percent,
+            createdAt=self.created_at.isoformat(),
+            updatedAt=self.updated_at.isoformat(),
+            encode=self.encode,
+            playbackUrl=self.playback_url,
+            result=self.result,
+        )
 
 
-def apply_text_overlays(
-    input_path: Path,
-    output_path: Path,
-    overlays: List[TextOverlay],
-    video_width: int = None,
-    video_height: int = None,
-    preview_width: int = None,
-    preview_height: int = None,
-) -> None:
+def export_fingerprint(request: VideoExportRequest) -> str:
     """
-    Apply text overlays to a video using FFmpeg drawtext filters.
-
-    Handles multiline text by rendering each line as a separate filter,
-    stacked vertically and centered on the anchor point.
+    Canonical hash of everything that affects an export's output and destination.
 
-    Args:
-        input_path: Input video file
-        output_path: Output video file
-        overlays: List of text overlays to apply
-        video_width: Actual video width (auto-detected if not provided)
-        video_height: Actual video height (auto-detected if not provided)
-        preview_width: Width of the preview container in the web editor
-        preview_height: Height of the preview container in the web editor
+    Covers the owner, clips (in timeline order), trims, audio settings,
+    transitions, overlays and preview dimensions. Client-side ids, the project
+    name and the render mode don't change the rendered video and are left out.
     """
-    if not overlays:
-        # No overlays, just copy the file
-        shutil.copy(input_path, output_path)
-        return
+    data = request.model_dump(exclude={
+        "renderMode": True,
+        "projectName": True,
+        "clips": {"__all__": {"id"}},
+        "textOverlays": {"__all__": {"id"}},
+    })
+    data["clips"].sort(key=lambda c: c["startTime"])
+    # Overlay positions are an untyped dict, so 50 and 50.0 would otherwise differ
+    for overlay in data["textOverlays"] or []:
+        overlay["position"] = {
+            key: float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value
+            for key, value in overlay["position"].items()
+        }
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
 
-    # Auto-detect video dimensions if not provided
-    if video_width is None or video_height is None:
-        video_width, video_height = get_video_dimensions(input_path)
 
-    # Use default preview width if not provided
-    if preview_width is None:
-        preview_width = 400  # Default fallback
+class ExportJobRegistry:
+    """
+    Registry of export jobs, backed by the export ledger. Finished jobs expire
+    after EXPORT_JOB_TTL_SECONDS.
 
-    print(f"[TextOverlay] Applying {len(overlays)} overlays to video ({video_width}x{video_height})")
-    print(f"[TextOverlay] Preview dimensions: {preview_width}x{preview_height}")
+    Submissions are keyed by export_fingerprint: an identical request joins the
+    export already in flight, and one that finished successfully less than
+    EXPORT_DEDUP_SECONDS ago is answered with its stored result. At most
+    EXPORT_WORKERS exports run at once; the rest wait queued.
+    """
 
-    # Build filter complex with all text overlays chained together
-    # Note: build_drawtext_filters returns a LIST of filters (one per line for multiline text)
-    all_filters = []
-    for i, overlay in enumerate(overlays):
-        filters = build_drawtext_filters(overlay, video_width, video_height, preview_width)
-        print(f"[TextOverlay] Overlay {i+1}: {len(filters)} filter(s)")
-        all_filters.extend(filters)
+    def __init__(self):
+        self.jobs: Dict[str, ExportJob] = {}
+        self.by_fingerprint: Dict[str, str] = {}  # fingerprint -> latest job id
+        self.workers = asyncio.Semaphore(max(1, EXPORT_WORKERS))
+        self.coalesced = 0  # Joined an in-flight export
+        self.reused = 0  # Answered from a finished export
+        self.resumed = 0  # Unfinished exports picked up again after a restart
+
+    async def submit(self, request: VideoExportRequest) -> Tuple[ExportJob, bool]:
+        """Start an export, or find an identical one. Returns (job, deduplicated)."""
+        await export_ledger.delete_jobs(self._prune())
+        fingerprint = export_fingerprint(request)
+        existing = self._reusable(fingerprint)
+        if existing is not None:
+            if existing.done:
+                self.reused += 1
+                print(f"[Export:{existing.id}] Reusing finished export for identical request")
+            else:
+                self.coalesced += 1
+                print(f"[Export:{existing.id}] Identical request joined in-flight export")
+            return existing, True
+
+        job = ExportJob(request, fingerprint)
+        self._start(job)
+        await export_ledger.save_job(job)  # Accepted exports are on disk before the client hears back
+        return job, False
+
+    def _start(self, job: ExportJob) -> None:
+        self.jobs[job.id] = job
+        if job.fingerprint:
+            self.by_fingerprint[job.fingerprint] = job.id
+        job.task = asyncio.create_task(_run_export_job(job))
+
+    async def restore(self) -> None:
+        """
+        Reload the ledger on startup: finished jobs stay pollable until they
+        expire, unfinished ones are queued again and resume from their last
+        finished stages (or fail after EXPORT_MAX_ATTEMPTS runs).
+        """
+        now = datetime.utcnow()
+        for row in export_ledger.load_jobs():
+            try:
+                request = VideoExportRequest.model_validate_json(row["request"])
+            except ValueError as e:
+                print(f"[Export:{row['id']}] Unreadable ledger entry, skipping: {e}")
+                continue
+            job = ExportJob(request, row["fingerprint"], job_id=row["id"])
+            job.created_at = datetime.fromisoformat(row["created_at"])
+            job.updated_at = datetime.fromisoformat(row["updated_at"])
+            job.attempts = row["attempts"]
+            if row["finished_at"]:
+                job.finished_at = datetime.fromisoformat(row["finished_at"])
+                if (now - job.finished_at).total_seconds() > EXPORT_JOB_TTL_SECONDS:
+                    continue
+                job.status = job.stage = row["status"]
+                job.percent = row["percent"]
+                job.result = VideoExportResponse.model_validate_json(row["result"]) if row["result"] else None
+                self.jobs[job.id] = job
+                if job.fingerprint:
+                    self.by_fingerprint[job.fingerprint] = job.id
+                continue
+            if job.attempts >= EXPORT_MAX_ATTEMPTS:
+                print(f"[Export:{job.id}] Interrupted {job.attempts} times, giving up")
+                job.finish(VideoExportResponse(success=False, error="Export was interrupted too many times"))
+                self.jobs[job.id] = job
+                await export_ledger.save_job(job)
+                continue
+            print(f"[Export:{job.id}] Resuming interrupted export (attempt {job.attempts + 1})")
+            self.resumed += 1
+            self._start(job)
+
+    async def shutdown(self) -> None:
+        """
+        Stop running exports without failing them; their ledger entries and
+        work dirs are kept, so the next start resumes them.
+        """
+        running = [job.task for job in self.jobs.values() if job.task is not None and not job.task.done()]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    def _reusable(self, fingerprint: str) -> Optional[ExportJob]:
+        job = self.jobs.get(self.by_fingerprint.get(fingerprint, ""))
+        if job is None:
+            return None
+        if not job.done:
+            return job
+        if job.status == "completed" and EXPORT_DEDUP_SECONDS > 0:
+            age = (datetime.utcnow() - job.finished_at).total_seconds()
+            if age <= EXPORT_DEDUP_SECONDS:
+                return job
+        return None
+
+    def get(self, job_id: str) -> Optional[ExportJob]:
+        return self.jobs.get(job_id)
+
+    def _prune(self) -> List[str]:
+        """Forget expired jobs. Returns their ids."""
+        now = datetime.utcnow()
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.finished_at and (now - job.finished_at).total_seconds() > EXPORT_JOB_TTL_SECONDS
+        ]
+        for job_id in expired:
+            job = self.jobs.pop(job_id)
+            if self.by_fingerprint.get(job.fingerprint) == job_id:
+                del self.by_fingerprint[job.fingerprint]
+        return expired
 
-    # Chain all filters together
-    filter_complex = ",".join(all_filters)
-    print(f"[TextOverlay] Full filter complex length: {len(filter_complex)} chars")
+    def snapshot(self) -> dict:
+        return {
+            "jobs": len(self.jobs),
+            "running": sum(1 for job in self.jobs.values() if job.status == "running"),
+            "queued": sum(1 for job in self.jobs.values() if job.status == "queued"),
+            "workers": EXPORT_WORKERS,
+            "coalesced": self.coalesced,
+            "reused": self.reused,
+            "resumed": self.resumed,
+        }
 
-    run_ffmpeg([
-        "-i", str(input_path),
-        "-vf", filter_complex,
-        "-c:v", "libx264",
-        "-preset", "fast",
-        "-crf", "18",
-        "-c:a", "copy",
-        str(output_path)
-    ])
 
+export_jobs = ExportJobRegistry()
 
-# ============================================
-# Endpoints
-# ============================================
 
-@app.get("/health")
-async def health_check():
-    """Health check endpoint."""
-    # Verify FFmpeg is available
+async def _run_export_job(job: ExportJob) -> None:
+    """
+    Run the export pipeline for `job` once a worker is free and its work dir
+    footprint fits the budget, record the outcome, then clean up. A cancelled job (the instance shutting down) is
+    left unfinished in the ledger, work dir included, to resume on restart.
+    """
     try:
-        result = subprocess.run(
-            ["ffmpeg", "-version"],
-            capture_output=True,
-            text=True
-        )
-        ffmpeg_available = result.returncode == 0
-    except FileNotFoundError:
-        ffmpeg_available = False
-
-    return {
-        "status": "healthy",
-        "ffmpeg": ffmpeg_available,
-        "timestamp": datetime.utcnow().isoformat()
-    }
+        # Estimated before taking a worker, so slow origins answering its HEADs don't hold one up
+        footprint = await estimate_export_footprint(job.request)
+        async with export_jobs.workers:
+            await work_dir_budget.admit(job.id, footprint)
+            try:
+                job.attempts += 1
+                job.status = "running"
+                await export_ledger.save_job(job)
+                result = await run_export_pipeline(job.request, job)
+            finally:
+                await work_dir_budget.release(job.id)
+        job.finish(result)
+    except HTTPException as e:
+        print(f"[Export:{job.id}] Error: {e.detail}")
+        job.finish(VideoExportResponse(success=False, error=str(e.detail)), error=e)
+    except asyncio.CancelledError:
+        print(f"[Export:{job.id}] Interrupted at stage '{job.stage}', will resume on restart")
+        raise
+    except Exception as e:
+        print(f"[Export:{job.id}] Error: {str(e)}")
+        job.finish(VideoExportResponse(success=False, error=str(e)))
 
+    await export_ledger.save_job(job)
+    # Cleanup work directory (the result has already been published)
+    if job.work_dir.exists():
+        await asyncio.to_thread(shutil.rmtree, job.work_dir, ignore_errors=True)
+        print(f"[Export:{job.id}] Cleaned up work directory")
 
-@app.get("/debug/fonts")
-async def debug_fonts():
-    """Debug endpoint to check font availability."""
-    font_status = {}
-
-    # Check all fonts in the maps
-    all_fonts = {
-        **{f"regular/{k}": v for k, v in FONT_MAP.items()},
-        **{f"bold/{k}": v for k, v in FONT_BOLD_MAP.items()},
-        **{f"light/{k}": v for k, v in FONT_LIGHT_MAP.items()},
-    }
 
-    for name, path in all_fonts.items():
-        try:
-            font_path = Path(path)
-            if font_path.exists():
-                size = font_path.stat().st_size
-                font_status[name] = {
-                    "path": path,
-                    "exists": True,
-                    "size_bytes": size,
-                    "valid": size > 1000,  # Valid if > 1KB
-                }
-            else:
-                font_status[name] = {
-                    "path": path,
-                    "exists": False,
-                    "size_bytes": 0,
-                    "valid": False,
-                }
-        except Exception as e:
-            font_status[name] = {
-                "path": path,
-                "exists": False,
-                "error": str(e),
-                "valid": False,
-            }
+@dataclass
+class ExportSource:
+    """One distinct source of an export, downloaded and probed."""
+    path: Path
+    download: DownloadResult
+    media: MediaInfo
 
-    # Check DejaVu fallback
-    dejavu_paths = [
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-    ]
-    for path in dejavu_paths:
-        try:
-            font_path = Path(path)
-            if font_path.exists():
-                size = font_path.stat().st_size
-                font_status[f"fallback/{Path(path).stem}"] = {
-                    "path": path,
-                    "exists": True,
-                    "size_bytes": size,
-                    "valid": size > 1000,
-                }
-            else:
-                font_status[f"fallback/{Path(path).stem}"] = {
-                    "path": path,
-                    "exists": False,
-                    "valid": False,
-                }
-        except Exception as e:
-            font_status[f"fallback/{Path(path).stem}"] = {
-                "path": path,
-                "error": str(e),
-                "valid": False,
-            }
+    def checkpoint(self) -> dict:
+        download = self.download
+        return {
+            "path": str(self.path),
+            "download": {
+                "url": download.url,
+                "bytes": download.bytes,
+                "seconds": download.seconds,
+                "cacheHit": download.cache_hit,
+                "contentId": download.content_id,
+            },
+            "media": self.media.model_dump(),
+        }
 
-    # Summary
-    valid_count = sum(1 for f in font_status.values() if f.get("valid", False))
-    total_count = len(font_status)
+    @classmethod
+    def from_checkpoint(cls, data: dict) -> "ExportSource":
+        # Restored even once its file is freed: the uploads only need its facts, and a
+        # stage that reads the file makes the graph fetch it again
+        path = Path(data["path"])
+        download = data["download"]
+        return cls(
+            path=path,
+            download=DownloadResult(url=download["url"], path=path, bytes=download["bytes"],
+                                    seconds=download["seconds"], cache_hit=download["cacheHit"],
+                                    content_id=download["contentId"]),
+            media=MediaInfo.model_validate(data["media"]),
+        )
 
-    return {
-        "summary": f"{valid_count}/{total_count} fonts available",
-        "fonts": font_status,
-    }
 
+def saved_artifact(data: dict) -> Optional[Path]:
+    """The file a stage checkpoint points at, if it's still there."""
+    path = Path(data["path"])
+    return path if path.is_file() and path.stat().st_size > 0 else None
 
-@app.post("/video/export", response_model=VideoExportResponse)
-async def export_video(request: VideoExportRequest):
-    """
-    Export video by trimming and concatenating clips, then applying text overlays.
 
-    Uses lossless stream copy (-c copy) for concatenation to preserve original quality.
-    Text overlays are rendered using FFmpeg drawtext filter.
-    Uploads result to Supabase storage and creates media_files record.
-    """
-    start_time = datetime.now()
-    job_id = str(uuid.uuid4())[:8]
-    work_dir = WORK_DIR / job_id
+def save_path_checkpoint(path: Path) -> dict:
+    return {"path": str(path)}
 
-    text_overlay_count = len(request.textOverlays) if request.textOverlays else 0
-    transition_count = len(request.transitions) if request.transitions else 0
-    print(f"[Export:{job_id}] Starting export with {len(request.clips)} clips, {text_overlay_count} text overlays, and {transition_count} transitions")
 
-    try:
-        # Create work directory
-        work_dir.mkdir(parents=True, exist_ok=True)
+def resolve_export_clip(clip: VideoClip, media: MediaInfo) -> VideoClip:
+    """The clip with the probed source duration in place of the client's sourceDuration."""
+    if media.duration > 0 and media.duration != clip.sourceDuration:
+        return clip.model_copy(update={"sourceDuration": media.duration})
+    return clip
 
-        # Sort clips by timeline position
-        sorted_clips = sorted(request.clips, key=lambda c: c.startTime)
 
-        # Step 1: Download all videos
-        print(f"[Export:{job_id}] Step 1: Downloading videos...")
-        downloaded_paths: List[Path] = []
+def export_render_mode(request: VideoExportRequest) -> Tuple[str, bool]:
+    """(render mode, whether the render streams into storage instead of a file) of an export."""
+    render_mode = request.renderMode or EXPORT_RENDER_MODE
+    if request.preview:
+        render_mode = "single_pass"  # One small encode is what makes previews fast
+    elif request.outputFormat == "hls":
+        render_mode = "single_pass"  # Segments come out of the one progressive encode
+    # Streamed and HLS exports render inside the upload stage, straight into storage
+    streaming = render_mode == "single_pass" and (EXPORT_UPLOAD_MODE == "stream" or request.outputFormat == "hls")
+    return render_mode, streaming
 
-        for i, clip in enumerate(sorted_clips):
-            input_path = work_dir / f"input_{i}.mp4"
-            await download_file(clip.sourceUrl, input_path)
-            downloaded_paths.append(input_path)
 
-        # Step 2: Trim each video (if needed)
-        print(f"[Export:{job_id}] Step 2: Trimming videos...")
-        trimmed_paths: List[Path] = []
+def _add_multi_pass_stages(
+    graph: StageGraph,
+    request: VideoExportRequest,
+    job: "ExportJob",
+    sorted_clips: List[VideoClip],
+    clip_sources: List[str],
+) -> str:
+    """
+    Add the stages of a multi-pass render to `graph`: one trim per clip, each
+    depending only on its own source, then the join, then the overlays.
+    Returns the name of the final stage, whose result is the output path.
 
-        for i, clip in enumerate(sorted_clips):
-            input_path = downloaded_paths[i]
-            effective_duration = clip.sourceDuration - clip.trimStart - clip.trimEnd
-
-            # Extract audio settings
-            audio_volume = None
-            audio_muted = False
-            if clip.audioInfo:
-                # volume=0 means mute (replaces legacy muted flag)
-                audio_muted = clip.audioInfo.muted or clip.audioInfo.volume == 0
-                if not audio_muted and clip.audioInfo.volume != 1.0:
-                    audio_volume = min(clip.audioInfo.volume, 2.0)  # Cap at 200%
-                print(f"[Export:{job_id}] Clip {i+1} audio: volume={clip.audioInfo.volume}, muted={audio_muted}")
-
-            needs_trim = clip.trimStart > 0 or clip.trimEnd > 0
-            needs_audio_change = audio_muted or (audio_volume is not None and audio_volume != 1.0)
-
-            if needs_trim or needs_audio_change:
-                # Need to process (trim and/or audio adjustment)
-                trimmed_path = work_dir / f"trimmed_{i}.mp4"
-                print(f"[Export:{job_id}] Processing clip {i+1}: start={clip.trimStart}, duration={effective_duration}, audio_vol={audio_volume}, muted={audio_muted}")
-                trim_video(input_path, trimmed_path, clip.trimStart, effective_duration,
-                          audio_volume=audio_volume, audio_muted=audio_muted)
-                trimmed_paths.append(trimmed_path)
-            else:
-                # No processing needed
-                trimmed_paths.append(input_path)
+    Trimmed segments and the joined timeline are looked up in the render cache
+    first, so a re-export only re-encodes the stages whose inputs changed.
+    """
+    job_id = job.id
+    work_dir = job.work_dir
+    trimmed_count = 0
+
+    async def trim(i: int, source: ExportSource) -> Tuple[Path, Optional[str], VideoClip]:
+        """Trim clip i. Returns (segment path, segment identity for the timeline cache key, resolved clip)."""
+        nonlocal trimmed_count
+        clip = resolve_export_clip(sorted_clips[i], source.media)
+        input_path = source.path
+        content_id = source.download.content_id
+        effective_duration = clip.sourceDuration - clip.trimStart - clip.trimEnd
 
-        # Calculate clip durations for transition offset calculations
-        clip_durations = [
-            clip.sourceDuration - clip.trimStart - clip.trimEnd
-            for clip in sorted_clips
-        ]
+        # Extract audio settings
+        audio_volume, audio_muted = clip_audio_settings(clip)
+        if clip.audioInfo:
+            print(f"[Export:{job_id}] Clip {i+1} audio: volume={clip.audioInfo.volume}, muted={audio_muted}")
+
+        needs_trim = clip.trimStart > 0 or clip.trimEnd > 0
+        needs_audio_change = audio_muted or (audio_volume is not None and audio_volume != 1.0)
+        # Sources not already in the segment encoding are normalized so the join can stream-copy
+        needs_normalize = len(sorted_clips) > 1 and not is_segment_compatible(source.media)
+
+        segment_path, segment_id = input_path, content_id
+        if needs_trim or needs_audio_change or needs_normalize:
+            # Need to process (trim and/or audio adjustment)
+            segment_path = work_dir / f"trimmed_{i}.mp4"
+            segment_id = None
+            if content_id:
+                segment_id = RenderCache.key(
+                    stage="segment",
+                    source=content_id,
+                    trimStart=clip.trimStart,
+                    trimEnd=clip.trimEnd,
+                    volume=audio_volume,
+                    muted=audio_muted,
+                    video=SEGMENT_VIDEO_ENCODE_ARGS,
+                    audio=SEGMENT_AUDIO_ENCODE_ARGS,
+                )
 
-        # Step 3: Concatenate all videos (with transitions if specified)
+            if segment_id and await render_cache.get(segment_id, segment_path):
+                print(f"[Export:{job_id}] Clip {i+1}: reusing cached segment")
+            else:
+                print(f"[Export:{job_id}] Processing clip {i+1}: start={clip.trimStart}, duration={effective_duration}, audio_vol={audio_volume}, muted={audio_muted}")
+                with report_ffmpeg_progress(job.encode_reporter("trimming", i / len(sorted_clips), (i + 1) / len(sorted_clips))):
+                    await trim_video(input_path, segment_path, clip.trimStart, effective_duration,
+                                     audio_volume=audio_volume, audio_muted=audio_muted,
+                                     content_id=content_id)
+                if segment_id:
+                    await render_cache.put(segment_id, segment_path)
+        trimmed_count += 1
+        job.progress("trimming", trimmed_count / len(sorted_clips))
+        return segment_path, segment_id, clip
+
+    async def join(*segments: Tuple[Path, Optional[str], VideoClip]) -> Tuple[Path, List[VideoClip], List[float]]:
+        """Concatenate the segments (with transitions if specified)."""
         print(f"[Export:{job_id}] Step 3: Concatenating videos...")
+        job.progress("concatenating", 0.0)
+        trimmed_paths = [path for path, _, _ in segments]
+        segment_ids = [segment_id for _, segment_id, _ in segments]
+        clips = [clip for _, _, clip in segments]
+        clip_durations = [clip.sourceDuration - clip.trimStart - clip.trimEnd for clip in clips]
         concat_output_path = work_dir / "concat_output.mp4"
+        transitions_list = transitions_as_dicts(request.transitions)
+        timeline_key = None
+        if all(segment_ids):
+            timeline_key = RenderCache.key(
+                stage="timeline",
+                inputs=segment_ids,
+                durations=[round(d, 6) for d in clip_durations],
+                transitions=transitions_list,
+            )
 
-        if request.transitions and len(request.transitions) > 0:
+        timeline_cached = timeline_key is not None and await render_cache.get(timeline_key, concat_output_path)
+        if timeline_cached:
+            print(f"[Export:{job_id}] Reusing cached timeline")
+        elif request.transitions and len(request.transitions) > 0:
             print(f"[Export:{job_id}] Using transition-aware concatenation with {len(request.transitions)} transitions")
             for trans in request.transitions:
                 print(f"[Export:{job_id}]   Transition: {trans.type} ({trans.duration}s) between clips {trans.fromClipIndex} and {trans.toClipIndex}")
 
-            # Convert Pydantic models to dicts for processing
-            transitions_list = [
-                {
-                    'fromClipIndex': t.fromClipIndex,
-                    'toClipIndex': t.toClipIndex,
-                    'type': t.type,
-                    'duration': t.duration
-                }
-                for t in request.transitions
-            ]
-
-            concatenate_videos_with_transitions(
-                trimmed_paths,
-                clip_durations,
-                transitions_list,
-                concat_output_path,
-                work_dir
-            )
+            with report_ffmpeg_progress(job.encode_reporter("concatenating")):
+                await concatenate_videos_with_transitions(
+                    trimmed_paths,
+                    clip_durations,
+                    transitions_list,
+                    concat_output_path,
+                    work_dir
+                )
         else:
             print(f"[Export:{job_id}] No transitions, using simple concatenation")
-            concatenate_videos(trimmed_paths, concat_output_path, work_dir)
+            await concatenate_videos(trimmed_paths, concat_output_path, work_dir)
 
-        # Step 4: Apply text overlays (if any)
+        if timeline_key and not timeline_cached:
+            await render_cache.put(timeline_key, concat_output_path)
+        return concat_output_path, clips, clip_durations
+
+    async def overlays(joined: Tuple[Path, List[VideoClip], List[float]]) -> Path:
+        """Apply text overlays (if any)."""
+        concat_output_path, clips, clip_durations = joined
+        job.progress("overlays", 0.0)
         output_path = work_dir / "output.mp4"
         if request.textOverlays and len(request.textOverlays) > 0:
             print(f"[Export:{job_id}] Step 4: Applying {len(request.textOverlays)} text overlays...")
@@ -1224,145 +5431,667 @@ async def export_video(request: VideoExportRequest):
             preview_height = request.previewDimensions.height if request.previewDimensions else None
             print(f"[Export:{job_id}] Preview dimensions from request: {preview_width}x{preview_height}")
 
-            # CRITICAL: Remap overlay times from editor timeline to concatenated video timeline
-            # The editor timeline has gaps between clips, but the concatenated video is seamless
-            print(f"[Export:{job_id}] Remapping overlay times from editor timeline to concatenated timeline...")
-            transitions_for_remap = None
-            if request.transitions:
-                transitions_for_remap = [
-                    {
-                        'fromClipIndex': t.fromClipIndex,
-                        'toClipIndex': t.toClipIndex,
-                        'type': t.type,
-                        'duration': t.duration
-                    }
-                    for t in request.transitions
-                ]
-            remapped_overlays = remap_overlay_times_to_concatenated_timeline(
-                request.textOverlays,
-                sorted_clips,
-                transitions_for_remap
-            )
-
-            for i, overlay in enumerate(remapped_overlays):
-                text_preview = overlay.text[:30] if len(overlay.text) > 30 else overlay.text
-                original_start = request.textOverlays[i].startTime
-                print(f"[Export:{job_id}]   Overlay {i+1}: text='{text_preview}', editor_time={original_start:.2f}s -> concat_time={overlay.startTime:.2f}s, duration={overlay.duration:.2f}s")
-
-                # Detailed position logging
-                pos = overlay.position
-                print(f"[Export:{job_id}]   Position raw: {pos} (type={type(pos).__name__})")
-                if isinstance(pos, dict):
-                    x_val = pos.get('x', 'MISSING')
-                    y_val = pos.get('y', 'MISSING')
-                    print(f"[Export:{job_id}]   Position parsed: x={x_val} (type={type(x_val).__name__}), y={y_val} (type={type(y_val).__name__})")
-                else:
-                    print(f"[Export:{job_id}]   Position is not a dict!")
+            remapped_overlays = _remap_export_overlays(request, clips, job_id)
 
-                # Detailed style logging
-                style = overlay.style
-                print(f"[Export:{job_id}]   Style raw: fontFamily={style.fontFamily}, fontSize={style.fontSize}, fontWeight={style.fontWeight}")
-                print(f"[Export:{job_id}]   Style raw: color={style.color}, textAlign={style.textAlign}, opacity={style.opacity}")
-                print(f"[Export:{job_id}]   Style raw: bgColor={style.backgroundColor}, bgPadding={style.backgroundPadding}")
+            output_duration = export_output_duration(request, clip_durations)
 
             # Auto-detect video dimensions and apply overlays with preview dimensions for proper scaling
-            apply_text_overlays(
-                concat_output_path,
-                output_path,
-                remapped_overlays,  # Use remapped overlays with corrected times
-                preview_width=preview_width,
-                preview_height=preview_height,
-            )
+            with report_ffmpeg_progress(job.encode_reporter("overlays")):
+                await apply_text_overlays(
+                    concat_output_path,
+                    output_path,
+                    remapped_overlays,  # Use remapped overlays with corrected times
+                    preview_width=preview_width,
+                    preview_height=preview_height,
+                    expected_duration=output_duration,
+                    video_args=PREVIEW_VIDEO_ENCODE_ARGS if request.preview else EXPORT_VIDEO_ENCODE_ARGS,
+                )
         else:
             print(f"[Export:{job_id}] Step 4: No text overlays to apply, using concatenated output...")
-            shutil.copy(concat_output_path, output_path)
+            await asyncio.to_thread(SourceCache._link, concat_output_path, output_path)
+        return output_path
+
+    # Step 2: Trim each video (if needed), each as soon as its source is ready
+    print(f"[Export:{job_id}] Step 2: Trimming videos as their sources arrive...")
+    trims = []
+    for i, clip in enumerate(sorted_clips):
+        trim_seconds = max(clip.sourceDuration - clip.trimStart - clip.trimEnd, 0.0)
+        trims.append(graph.add(f"trim:{i}", lambda source, i=i: trim(i, source),
+                               deps=[clip_sources[i]], cost=trim_seconds,
+                               save=save_trim_checkpoint, load=load_trim_checkpoint,
+                               artifacts=lambda trimmed: [trimmed[0]]))
+    timeline_seconds = sum(graph.stages[name].cost for name in trims)
+    graph.add("join", join, deps=trims, cost=timeline_seconds,
+              save=save_join_checkpoint, load=load_join_checkpoint, artifacts=lambda joined: [joined[0]])
+    return graph.add("overlays", overlays, deps=["join"],
+                     cost=timeline_seconds if request.textOverlays else 0.0,
+                     save=save_path_checkpoint, load=saved_artifact, artifacts=lambda path: [path])
+
+
+def save_trim_checkpoint(trimmed: Tuple[Path, Optional[str], VideoClip]) -> dict:
+    path, segment_id, clip = trimmed
+    return {"path": str(path), "segmentId": segment_id, "clip": clip.model_dump()}
+
+
+def load_trim_checkpoint(data: dict) -> Optional[Tuple[Path, Optional[str], VideoClip]]:
+    path = saved_artifact(data)
+    return (path, data["segmentId"], VideoClip.model_validate(data["clip"])) if path else None
+
+
+def save_join_checkpoint(joined: Tuple[Path, List[VideoClip], List[float]]) -> dict:
+    path, clips, clip_durations = joined
+    return {"path": str(path), "clips": [clip.model_dump() for clip in clips], "durations": clip_durations}
+
+
+def load_join_checkpoint(data: dict) -> Optional[Tuple[Path, List[VideoClip], List[float]]]:
+    path = saved_artifact(data)
+    if path is None:
+        return None
+    return path, [VideoClip.model_validate(clip) for clip in data["clips"]], data["durations"]
+
+
+async def _render_export_single_pass(
+    request: VideoExportRequest,
+    job: "ExportJob",
+    sorted_clips: List[VideoClip],
+    downloaded_paths: List[Path],
+    clip_durations: List[float],
+    clip_media: List[MediaInfo],
+    content_ids: List[Optional[str]],
+    output_path: Optional[Path] = None,
+    mux_args: Optional[List[str]] = None,
+) -> Path:
+    """
+    Render an export with one compiled FFmpeg filter graph. Returns the output path.
+
+    Preview requests render the same graph at roughly the editor's preview
+    size with a fast scaler and the ultrafast preset. `output_path` defaults
+    to output.mp4 in the job's work dir; `mux_args` go before it. HLS
+    requests render into `output_path` as a directory of segments and
+    playlists instead (see run_filter_graph_hls).
+    """
+    job_id = job.id
+    work_dir = job.work_dir
+    print(f"[Export:{job_id}] Step 2: Rendering timeline in a single pass{' (preview)' if request.preview else ''}...")
+    job.progress("rendering", 0.0)
+
+    # Output takes the first clip's size and frame rate; other clips are letterboxed to it
+    output_width, output_height = clip_media[0].dimensions
+    if request.preview:
+        output_width, output_height = preview_output_size(output_width, output_height, request.previewDimensions)
+        print(f"[Export:{job_id}] Preview output: {output_width}x{output_height}")
+    remapped_overlays = []
+    if request.textOverlays:
+        remapped_overlays = _remap_export_overlays(request, sorted_clips, job_id)
+
+    preview_width = request.previewDimensions.width if request.previewDimensions else None
+    transitions = transitions_as_dicts(request.transitions)
+    scale_flags = "fast_bilinear" if request.preview else None
+    video_args, audio_args = (
+        (PREVIEW_VIDEO_ENCODE_ARGS, PREVIEW_AUDIO_ENCODE_ARGS) if request.preview
+        else (EXPORT_VIDEO_ENCODE_ARGS, EXPORT_AUDIO_ENCODE_ARGS)
+    )
+    output_path = output_path or work_dir / "output.mp4"
+
+    # Long timelines: independent chunks encoded in parallel. HLS segments have to
+    # come out in timeline order while encoding, so HLS is always one encode
+    hls = request.outputFormat == "hls"
+    timeline = [
+        TimelineClip.from_export_clip(clip, path, media)
+        for clip, path, media in zip(sorted_clips, downloaded_paths, clip_media)
+    ]
+    with report_ffmpeg_progress(job.encode_reporter("rendering")):
+        if not hls and await render_timeline_chunked(timeline, transitions, remapped_overlays,
+                                         output_width, output_height, clip_media[0].frame_rate, output_path,
+                                         work_dir, video_args, audio_args, preview_width=preview_width,
+                                         scale_flags=scale_flags, mux_args=mux_args):
+            return output_path
+
+    text_layer = None
+    if remapped_overlays and TEXT_OVERLAY_RENDERER == "raster":
+        text_layer = await build_text_layer(
+            remapped_overlays, output_width, output_height, preview_width or 400,
+            export_output_duration(request, clip_durations), work_dir,
+        )
+
+    graph = compile_export_graph(
+        timeline,
+        transitions,
+        remapped_overlays,
+        output_width,
+        output_height,
+        clip_media[0].frame_rate,
+        preview_width=preview_width,
+        text_layer=text_layer,
+        scale_flags=scale_flags,
+    )
+    print(f"[Export:{job_id}] Compiled filter graph: {len(graph.filter_graph)} chars, {graph.duration:.2f}s output")
+
+    with report_ffmpeg_progress(job.encode_reporter("rendering")):
+        if hls:
+            await run_filter_graph_hls(graph, output_path, work_dir, video_args, audio_args,
+                                       hls_renditions(output_height, request.hlsLadder))
+        else:
+            await run_filter_graph(graph, output_path, work_dir, encode_args=video_args + audio_args, mux_args=mux_args)
+    return output_path
+
+
+def preview_output_size(width: int, height: int, preview: Optional[PreviewDimensions]) -> tuple[int, int]:
+    """
+    Fit a width x height source into the editor's preview box (or PREVIEW_DEFAULT_HEIGHT).
+
+    Never upscales; both sides are rounded down to even numbers for yuv420p.
+    """
+    if preview and preview.width > 0 and preview.height > 0:
+        scale = min(preview.width / width, preview.height / height)
+    else:
+        scale = PREVIEW_DEFAULT_HEIGHT / height
+    scale = min(scale, 1.0)
+    return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+
+def transitions_as_dicts(transitions: Optional[List[Transition]]) -> List[dict]:
+    """Convert Pydantic transitions to the dicts used by the concatenation helpers."""
+    return [
+        {
+            'fromClipIndex': t.fromClipIndex,
+            'toClipIndex': t.toClipIndex,
+            'type': t.type,
+            'duration': t.duration
+        }
+        for t in (transitions or [])
+    ]
+
+
+def export_output_duration(request: VideoExportRequest, clip_durations: List[float]) -> float:
+    """Output length: clips joined back to back, minus the transition overlaps."""
+    return sum(clip_durations) - sum(
+        t.duration for t in (request.transitions or [])
+        if 0 <= t.fromClipIndex < len(clip_durations) - 1
+    )
+
+
+def estimate_export_bytes(clip_media: List[MediaInfo], clip_durations: List[float]) -> int:
+    """
+    Rough encoded size of an export, made before encoding it.
+
+    Each clip counts its source's bitrate over the clip's duration, scaled to
+    the output frame size (the first clip's); sources with no known bitrate
+    count ESTIMATE_BITS_PER_PIXEL per output pixel per frame.
+    """
+    output_width, output_height = clip_media[0].dimensions
+    output_pixels = output_width * output_height
+    total_bits = 0.0
+    for media, duration in zip(clip_media, clip_durations):
+        width, height = media.dimensions
+        if media.bitRate:
+            bits_per_second = media.bitRate * output_pixels / (width * height)
+        else:
+            bits_per_second = ESTIMATE_BITS_PER_PIXEL * output_pixels * float(Fraction(media.frame_rate))
+        total_bits += bits_per_second * max(duration, 0.0)
+    return int(total_bits / 8)
+
+
+def _remap_export_overlays(request: VideoExportRequest, sorted_clips: List[VideoClip], job_id: str) -> List[TextOverlay]:
+    """Remap the request's overlays onto the output timeline and log them."""
+    # CRITICAL: Remap overlay times from editor timeline to concatenated video timeline
+    # The editor timeline has gaps between clips, but the concatenated video is seamless
+    print(f"[Export:{job_id}] Remapping overlay times from editor timeline to concatenated timeline...")
+    transitions_for_remap = transitions_as_dicts(request.transitions) if request.transitions else None
+    remapped_overlays = remap_overlay_times_to_concatenated_timeline(
+        request.textOverlays,
+        sorted_clips,
+        transitions_for_remap
+    )
+
+    for i, overlay in enumerate(remapped_overlays):
+        text_preview = overlay.text[:30] if len(overlay.text) > 30 else overlay.text
+        original_start = request.textOverlays[i].startTime
+        print(f"[Export:{job_id}]   Overlay {i+1}: text='{text_preview}', editor_time={original_start:.2f}s -> concat_time={overlay.startTime:.2f}s, duration={overlay.duration:.2f}s")
+
+        # Detailed position logging
+        pos = overlay.position
+        print(f"[Export:{job_id}]   Position raw: {pos} (type={type(pos).__name__})")
+        if isinstance(pos, dict):
+            x_val = pos.get('x', 'MISSING')
+            y_val = pos.get('y', 'MISSING')
+            print(f"[Export:{job_id}]   Position parsed: x={x_val} (type={type(x_val).__name__}), y={y_val} (type={type(y_val).__name__})")
+        else:
+            print(f"[Export:{job_id}]   Position is not a dict!")
+
+        # Detailed style logging
+        style = overlay.style
+        print(f"[Export:{job_id}]   Style raw: fontFamily={style.fontFamily}, fontSize={style.fontSize}, fontWeight={style.fontWeight}")
+        print(f"[Export:{job_id}]   Style raw: color={style.color}, textAlign={style.textAlign}, opacity={style.opacity}")
+        print(f"[Export:{job_id}]   Style raw: bgColor={style.backgroundColor}, bgPadding={style.backgroundPadding}")
+
+    return remapped_overlays
+
+
+async def run_export_pipeline(request: VideoExportRequest, job: "ExportJob") -> VideoExportResponse:
+    """
+    Export video by trimming and concatenating clips, then applying text overlays.
+
+    Uses lossless stream copy (-c copy) for concatenation to preserve original quality.
+    Text overlays are rendered using FFmpeg drawtext filter.
+    Uploads result to Supabase storage and creates media_files record.
+    Preview requests render a small draft to short-lived GCS storage instead.
+
+    Reports stage progress on `job`. Every finished stage is checkpointed in
+    the export ledger, and a resumed job restores those stages instead of
+    running them again. Errors propagate to the caller, which also owns
+    cleanup of the job's work directory.
+    """
+    start_time = datetime.now()
+    job_id = job.id
+    work_dir = job.work_dir
+
+    text_overlay_count = len(request.textOverlays) if request.textOverlays else 0
+    transition_count = len(request.transitions) if request.transitions else 0
+    print(f"[Export:{job_id}] Starting export with {len(request.clips)} clips, {text_overlay_count} text overlays, and {transition_count} transitions")
+
+    # Create work directory
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    # Sort clips by timeline position
+    sorted_clips = sorted(request.clips, key=lambda c: c.startTime)
+
+    # Step 1: Download all videos (concurrently, each distinct URL once). Downloads,
+    # probes, trims and the render run as one stage graph: every source is probed as
+    # soon as it lands and each clip is trimmed as soon as its own source is ready
+    print(f"[Export:{job_id}] Step 1: Downloading videos...")
+    job.progress("downloading", 0.0)
+    url_paths: Dict[str, Path] = {}
+    for clip in sorted_clips:
+        if clip.sourceUrl not in url_paths:
+            url_paths[clip.sourceUrl] = work_dir / f"input_{len(url_paths)}.mp4"
+
+    # Stages finished by an earlier, interrupted run of this job are restored, not redone
+    journal = StageJournal(
+        saved=await export_ledger.stages(job_id),
+        record=lambda stage, data: export_ledger.save_stage(job_id, stage, data),
+    )
+    graph = StageGraph(f"Export:{job_id}", journal=journal, scratch=work_dir)
+    download_slots = asyncio.Semaphore(max(1, DOWNLOAD_CONCURRENCY))
+    downloaded = 0
+
+    async def prepare_source(url: str, path: Path) -> ExportSource:
+        nonlocal downloaded
+        async with download_slots:
+            download = await fetch_source(url, path)
+        downloaded += 1
+        job.progress("downloading", downloaded / len(url_paths))
+        # Probe each distinct source once; the real duration wins over the client's sourceDuration
+        return ExportSource(path=path, download=download, media=await probe_media(path, download.content_id))
+
+    source_stages = {
+        url: graph.add(f"source:{k}", lambda url=url, path=path: prepare_source(url, path),
+                       save=ExportSource.checkpoint, load=ExportSource.from_checkpoint,
+                       artifacts=lambda source: [source.path])
+        for k, (url, path) in enumerate(url_paths.items())
+    }
+    clip_sources = [source_stages[clip.sourceUrl] for clip in sorted_clips]
+
+    render_mode, streaming = export_render_mode(request)
+    hls = request.outputFormat == "hls"
+    print(f"[Export:{job_id}] Render mode: {render_mode}{' (preview)' if request.preview else ''}")
+    if render_mode == "single_pass":
+        async def render(*sources: ExportSource, output_path: Optional[Path] = None,
+                         mux_args: Optional[List[str]] = None) -> Path:
+            clips = [resolve_export_clip(clip, source.media) for clip, source in zip(sorted_clips, sources)]
+            return await _render_export_single_pass(
+                request, job, clips,
+                [source.path for source in sources],
+                [clip.sourceDuration - clip.trimStart - clip.trimEnd for clip in clips],
+                [source.media for source in sources],
+                [source.download.content_id for source in sources],
+                output_path=output_path,
+                mux_args=mux_args,
+            )
+        if not streaming:
+            final_stage = graph.add("render", render, deps=clip_sources,
+                                    save=save_path_checkpoint, load=saved_artifact, artifacts=lambda path: [path])
+    else:
+        final_stage = _add_multi_pass_stages(graph, request, job, sorted_clips, clip_sources)
+
+    # Destinations are named after the job, so an upload retried after a restart
+    # overwrites its earlier attempt instead of leaving a second copy behind
+    timestamp = int(job.created_at.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    storage_path = f"{request.userId}/{request.companyId or 'default'}/{timestamp}_export.mp4"
+    if request.preview:
+        # Previews go to short-lived storage and never into the media library
+        storage_path = f"{PREVIEW_STORAGE_PREFIX}/{request.userId}/{request.companyId or 'default'}/{timestamp}_preview.mp4"
+    if hls:
+        # A directory of segments and playlists, entered through the master playlist
+        storage_path = f"{storage_path.rsplit('.', 1)[0]}/master.m3u8"
+
+    def resolve_sources(source_results: Tuple[ExportSource, ...]) -> List[DownloadResult]:
+        """Settle the clips on their probed durations; returns the downloads, in source order."""
+        sources = dict(zip(source_stages, source_results))
+        for i, clip in enumerate(sorted_clips):
+            media = sources[clip.sourceUrl].media
+            if media.duration > 0 and abs(media.duration - clip.sourceDuration) > SOURCE_DURATION_TOLERANCE_SECONDS:
+                print(f"[Export:{job_id}] Clip {i+1}: sourceDuration {clip.sourceDuration}s, probed {media.duration}s - used probed")
+            sorted_clips[i] = resolve_export_clip(clip, media)
+
+        download_results = [source.download for source in source_results]
+        total_downloaded = sum(r.bytes for r in download_results)
+        print(f"[Export:{job_id}] Downloaded {len(download_results)} source(s), {total_downloaded} bytes")
+        return download_results
+
+    def upload_result(public_url: str, storage_type: str, output_size: int, upload_throughput: UploadStats,
+                      download_results: List[DownloadResult]) -> dict:
+        return {
+            "publicUrl": public_url,
+            "storageType": storage_type,
+            "fileSize": output_size,
+            # Calculate total duration
+            "duration": sum(clip.sourceDuration - clip.trimStart - clip.trimEnd for clip in sorted_clips),
+            "downloads": [r.to_stats().model_dump() for r in download_results],
+            "upload": upload_throughput.model_dump(),
+        }
+
+    async def upload(output_path: Path, *source_results: ExportSource) -> dict:
+        """Step 5: Upload to storage (GCS for large files and previews, Supabase for smaller)."""
+        download_results = resolve_sources(source_results)
 
         # Get output file size
         output_size = output_path.stat().st_size
         print(f"[Export:{job_id}] Output file size: {output_size} bytes ({output_size / (1024*1024):.1f} MB)")
 
-        # Step 5: Upload to storage (GCS for large files, Supabase for smaller)
-        supabase = get_supabase_client()
-        timestamp = int(datetime.now().timestamp() * 1000)
-        storage_path = f"{request.userId}/{request.companyId or 'default'}/{timestamp}_export.mp4"
-
-        # Choose storage based on file size
-        if output_size > GCS_LARGE_FILE_THRESHOLD:
+        job.progress("uploading", 0.0)
+        if request.preview:
+            print(f"[Export:{job_id}] Step 5: Uploading preview to GCS...")
+            public_url, upload_throughput = await run_storage_call(upload_to_gcs, output_path, storage_path)
+            storage_type = "gcs"
+        elif output_size > GCS_LARGE_FILE_THRESHOLD:
             # Large file: use GCS
             print(f"[Export:{job_id}] Step 5: File > 50MB, uploading to GCS...")
-            public_url = upload_to_gcs(output_path, storage_path)
+            public_url, upload_throughput = await run_storage_call(upload_to_gcs, output_path, storage_path)
             storage_type = "gcs"
             print(f"[Export:{job_id}] Uploaded to GCS: {storage_path}")
         else:
             # Normal file: use Supabase
             print(f"[Export:{job_id}] Step 5: Uploading to Supabase storage...")
-            with open(output_path, "rb") as f:
-                output_data = f.read()
-
-            upload_result = supabase.storage.from_("media-studio-videos").upload(
-                storage_path,
-                output_data,
-                file_options={"content-type": "video/mp4"}
-            )
-
-            public_url = supabase.storage.from_("media-studio-videos").get_public_url(storage_path)
+            public_url, upload_throughput = await upload_to_supabase(output_path, storage_path, "video/mp4", upsert=True)
             storage_type = "supabase"
             print(f"[Export:{job_id}] Uploaded to Supabase: {public_url}")
 
-        # Step 6: Create media_files record
-        print(f"[Export:{job_id}] Step 6: Creating media record...")
-        safe_name = "".join(c for c in (request.projectName or "Exported Video") if c.isalnum() or c in " -_")
-
-        # Calculate total duration
-        total_duration = sum(
-            clip.sourceDuration - clip.trimStart - clip.trimEnd
-            for clip in sorted_clips
+        return upload_result(public_url, storage_type, output_size, upload_throughput, download_results)
+
+    async def render_and_publish_hls(*results: ExportSource) -> dict:
+        """Steps 2-5 of an HLS export: render segments and publish them to GCS as they finish."""
+        clip_results, source_results = results[:len(clip_sources)], results[len(clip_sources):]
+        download_results = resolve_sources(source_results)
+        print(f"[Export:{job_id}] Steps 2-5: Rendering HLS{' with a ladder' if request.hlsLadder else ''}, publishing segments as they finish...")
+        hls_dir = work_dir / "hls"
+        await asyncio.to_thread(shutil.rmtree, hls_dir, ignore_errors=True)  # Leftovers of an interrupted run
+        publisher = HlsPublisher(hls_dir, storage_path.rsplit("/", 1)[0])
+        upload_throughput = await encode_and_publish_hls(
+            lambda: render(*clip_results, output_path=hls_dir), publisher, job.playable,
+        )
+        return upload_result(publisher.master_url, "gcs", upload_throughput.bytes, upload_throughput, download_results)
+
+    async def render_and_upload(*results: ExportSource) -> dict:
+        """Steps 2-5 of a streamed export: render into GCS directly when the output is bound for it."""
+        clip_results, source_results = results[:len(clip_sources)], results[len(clip_sources):]
+        if not request.preview:
+            estimate = estimate_export_bytes(
+                [source.media for source in clip_results],
+                [clip.sourceDuration - clip.trimStart - clip.trimEnd
+                 for clip in (resolve_export_clip(clip, source.media) for clip, source in zip(sorted_clips, clip_results))],
+            )
+            print(f"[Export:{job_id}] Estimated output size: {estimate / (1024*1024):.1f} MB")
+            if estimate <= GCS_LARGE_FILE_THRESHOLD:
+                # Bound for Supabase, which needs the size up front: render to a file first
+                return await upload(await render(*clip_results), *source_results)
+
+        download_results = resolve_sources(source_results)
+        print(f"[Export:{job_id}] Steps 2-5: Rendering straight into GCS...")
+        public_url, upload_throughput = await encode_and_stream_to_gcs(
+            lambda path, mux_args: render(*clip_results, output_path=path, mux_args=mux_args),
+            work_dir, storage_path,
         )
+        print(f"[Export:{job_id}] Output file size: {upload_throughput.bytes} bytes "
+              f"({upload_throughput.bytes / (1024*1024):.1f} MB), uploaded to GCS: {storage_path}")
+        return upload_result(public_url, "gcs", upload_throughput.bytes, upload_throughput, download_results)
 
+    async def record(uploaded: dict) -> dict:
+        """Step 6: Create media_files record."""
+        print(f"[Export:{job_id}] Step 6: Creating media record...")
+        job.progress("recording", 0.0)
+        supabase = get_supabase_client()
+        if job.attempts > 1:
+            # An interrupted earlier run may have inserted the record just before going down
+            existing = await run_storage_call(
+                supabase.table("media_files").select("id").eq("storage_path", storage_path).limit(1).execute)
+            if existing.data:
+                return {"mediaFileId": existing.data[0]["id"]}
+
+        safe_name = "".join(c for c in (request.projectName or "Exported Video") if c.isalnum() or c in " -_")
         media_record = {
             "user_id": request.userId,
             "company_id": request.companyId if request.companyId else None,
-            "file_name": f"{safe_name}.mp4",
+            "file_name": f"{safe_name}.{'m3u8' if hls else 'mp4'}",
             "file_type": "video",
-            "file_format": "mp4",
-            "file_size": output_size,
+            "file_format": "m3u8" if hls else "mp4",
+            "file_size": uploaded["fileSize"],
             "storage_path": storage_path,
-            "public_url": public_url,
-            "duration": int(total_duration),
+            "public_url": uploaded["publicUrl"],
+            "duration": int(uploaded["duration"]),
             "prompt": f"Edited video: {safe_name}",
             "model_used": "editor-export",
         }
 
-        result = supabase.table("media_files").insert(media_record).execute()
-        media_file_id = result.data[0]["id"] if result.data else None
+        result = await run_storage_call(supabase.table("media_files").insert(media_record).execute)
+        return {"mediaFileId": result.data[0]["id"] if result.data else None}
 
-        # Calculate processing time
-        processing_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
-        print(f"[Export:{job_id}] Complete in {processing_time_ms}ms (storage: {storage_type})")
+    # The uploads read the sources' download and probe facts, but only the clips' files
+    if hls:
+        graph.add("upload", render_and_publish_hls, deps=[*clip_sources, *source_stages.values()],
+                  save=lambda uploaded: uploaded, load=lambda data: data, uses=clip_sources)
+    elif streaming:
+        graph.add("upload", render_and_upload, deps=[*clip_sources, *source_stages.values()],
+                  save=lambda uploaded: uploaded, load=lambda data: data, uses=clip_sources)
+    else:
+        graph.add("upload", upload, deps=[final_stage, *source_stages.values()],
+                  save=lambda uploaded: uploaded, load=lambda data: data, uses=[final_stage])
+    if not request.preview:
+        graph.add("record", record, deps=["upload"], save=lambda recorded: recorded, load=lambda data: data)
+
+    results = await graph.run()
+    uploaded = results["upload"]
+    media_file_id = results["record"]["mediaFileId"] if "record" in results else None
+
+    # Calculate processing time
+    processing_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
+    print(f"[Export:{job_id}] {'Preview complete' if request.preview else 'Complete'} in {processing_time_ms}ms "
+          f"(storage: {uploaded['storageType']})")
+
+    return VideoExportResponse(
+        success=True,
+        videoUrl=uploaded["publicUrl"],
+        storagePath=storage_path,
+        fileSize=uploaded["fileSize"],
+        mediaFileId=media_file_id,
+        processingTimeMs=processing_time_ms,
+        storageType=uploaded["storageType"],
+        downloads=[DownloadStats.model_validate(stats) for stats in uploaded["downloads"]],
+        upload=UploadStats.model_validate(uploaded["upload"]) if uploaded.get("upload") else None,
+        preview=request.preview,
+    )
 
-        return VideoExportResponse(
-            success=True,
-            videoUrl=public_url,
-            storagePath=storage_path,
-            fileSize=output_size,
-            mediaFileId=media_file_id,
-            processingTimeMs=processing_time_ms,
-            storageType=storage_type
-        )
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"[Export:{job_id}] Error: {str(e)}")
-        return VideoExportResponse(
-            success=False,
-            error=str(e)
+# ============================================
+# Endpoints
+# ============================================
+
+@app.get("/health")
+async def health_check():
+    """Health check endpoint."""
+    # Verify FFmpeg is available (outside the pool, so health never queues behind encodes)
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-version",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
         )
+        ffmpeg_available = await proc.wait() == 0
+    except FileNotFoundError:
+        ffmpeg_available = False
+
+    return {
+        "status": "healthy",
+        "ffmpeg": ffmpeg_available,
+        "ffmpegPool": ffmpeg_pool.snapshot(),
+        "ffprobePool": ffprobe_pool.snapshot(),
+        "encodeChunkPool": encode_chunk_pool.snapshot(),
+        "encodeSpeed": encode_stats.snapshot(),
+        "uploadSpeed": upload_stats.snapshot(),
+        "workDir": await work_dir_budget.snapshot(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@app.get("/debug/fonts")
+async def debug_fonts():
+    """Font availability, parsed metrics and resolved fallbacks, as checked at startup."""
+    return font_registry.snapshot()
+
+
+@app.get("/media/probe", response_model=MediaInfo)
+async def get_media_info(url: str):
+    """Codec, dimensions, frame rate, pixel format, audio layout and duration of every stream in a source."""
+    work_dir = WORK_DIR / f"probe_{uuid.uuid4().hex[:8]}"
+    try:
+        work_dir.mkdir(parents=True, exist_ok=True)
+        input_path = work_dir / "input.mp4"
+        download = await fetch_source(url, input_path)
+        return await probe_media(input_path, download.content_id)
     finally:
-        # Cleanup work directory
-        if work_dir.exists():
-            shutil.rmtree(work_dir, ignore_errors=True)
-            print(f"[Export:{job_id}] Cleaned up work directory")
+        await asyncio.to_thread(shutil.rmtree, work_dir, ignore_errors=True)
+
+
+@app.get("/media/keyframes", response_model=KeyframeIndexResponse)
+async def get_keyframes(url: str, at: Optional[float] = None):
+    """
+    Keyframe index of a source video, built on first request and cached.
+
+    With `at`, also returns the keyframes at-or-before and at-or-after that time.
+    """
+    work_dir = WORK_DIR / f"keyframes_{uuid.uuid4().hex[:8]}"
+    try:
+        work_dir.mkdir(parents=True, exist_ok=True)
+        input_path = work_dir / "input.mp4"
+        download = await fetch_source(url, input_path)
+        index = await keyframe_index.get(input_path, download.content_id)
+    finally:
+        await asyncio.to_thread(shutil.rmtree, work_dir, ignore_errors=True)
+
+    average_gop = None
+    if len(index) > 1:
+        average_gop = round((index.timestamps[-1] - index.timestamps[0]) / (len(index) - 1), 3)
+
+    response = KeyframeIndexResponse(
+        contentId=download.content_id,
+        count=len(index),
+        averageGopSeconds=average_gop,
+        keyframes=[
+            KeyframeEntry(time=t, offset=pos if pos >= 0 else None)
+            for t, pos in zip(index.timestamps, index.offsets)
+        ],
+    )
+    if at is not None:
+        response.at = at
+        response.keyframeBefore = index.at_or_before(at)
+        response.keyframeAfter = index.at_or_after(at)
+    return response
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss/eviction counters and sizes of the on-instance caches."""
+    return {
+        "sources": source_cache.snapshot(),
+        "probes": media_probe.snapshot(),
+        "keyframes": keyframe_index.snapshot(),
+        "renders": render_cache.snapshot(),
+        "textLayers": text_layer_cache.snapshot(),
+        "exports": export_jobs.snapshot(),
+    }
+
+
+@app.post("/video/export", response_model=VideoExportResponse)
+async def export_video(request: VideoExportRequest):
+    """
+    Export video and wait for the result.
+
+    Runs the same background job as POST /video/export/jobs and holds the
+    connection until it finishes. Prefer the job API for long projects.
+    """
+    job, deduplicated = await export_jobs.submit(request)
+    result = await job.wait()
+    if job.error:
+        raise job.error
+    if deduplicated:
+        result = result.model_copy(update={"deduplicated": True})
+    return result
+
+
+@app.post("/video/export/jobs", response_model=ExportJobSubmitResponse, status_code=202)
+async def submit_export_job(request: VideoExportRequest):
+    """Start an export in the background and return its job id immediately."""
+    job, deduplicated = await export_jobs.submit(request)
+    print(f"[Export:{job.id}] Submitted export job")
+    return ExportJobSubmitResponse(
+        jobId=job.id,
+        status=job.status,
+        statusUrl=f"/video/export/jobs/{job.id}",
+        eventsUrl=f"/video/export/jobs/{job.id}/events",
+        deduplicated=deduplicated,
+    )
+
+
+def _get_export_job_or_404(job_id: str) -> ExportJob:
+    job = export_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Export job not found: {job_id}")
+    return job
+
+
+@app.get("/video/export/jobs/{job_id}", response_model=ExportJobStatus)
+async def get_export_job(job_id: str):
+    """Current stage, percent and (once finished) result of an export job."""
+    return _get_export_job_or_404(job_id).to_status()
+
+
+@app.get("/video/export/jobs/{job_id}/events")
+async def stream_export_job(job_id: str):
+    """
+    Server-Sent Events stream of export job progress.
+
+    Sends a `progress` event with the job status on every change and a final
+    `complete` event (carrying the result) when the job finishes.
+    """
+    job = _get_export_job_or_404(job_id)
+
+    async def event_stream():
+        seen_version = -1
+        while True:
+            if job.version != seen_version:
+                seen_version = job.version
+                event = "complete" if job.done else "progress"
+                yield f"event: {event}\ndata: {job.to_status().model_dump_json()}\n\n"
+                if job.done:
+                    return
+            elif not await job.wait_for_change(seen_version, SSE_HEARTBEAT_SECONDS):
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # ============================================
@@ -1382,6 +6111,7 @@ class AudioExtractResponse(BaseModel):
     audioUrl: Optional[str] = None
     duration: Optional[float] = None
     fileSize: Optional[int] = None
+    upload: Optional[UploadStats] = None  # Upload throughput
     error: Optional[str] = None
 
 
@@ -1414,7 +6144,7 @@ class TranscribeResponse(BaseModel):
 # AUDIO PROCESSING HELPERS
 # ============================================
 
-def extract_audio_ffmpeg(input_path: Path, output_path: Path, output_format: str = "mp3") -> float:
+async def extract_audio_ffmpeg(input_path: Path, output_path: Path, output_format: str = "mp3") -> float:
     """
     Extract audio from video using FFmpeg.
     Returns the audio duration in seconds.
@@ -1424,7 +6154,7 @@ def extract_audio_ffmpeg(input_path: Path, output_path: Path, output_format: str
     else:  # wav
         codec_args = ["-acodec", "pcm_s16le"]
 
-    run_ffmpeg([
+    await run_ffmpeg([
         "-i", str(input_path),
         "-vn",  # No video
         *codec_args,
@@ -1434,7 +6164,7 @@ def extract_audio_ffmpeg(input_path: Path, output_path: Path, output_format: str
     ])
 
     # Get duration
-    return get_video_duration_ffprobe(output_path)
+    return (await probe_media(output_path)).duration
 
 
 def segments_to_srt(segments: List[dict]) -> str:
@@ -1543,7 +6273,7 @@ async def extract_audio(request: AudioExtractRequest):
 
         # Download video
         input_path = work_dir / "input.mp4"
-        await download_file(request.videoUrl, input_path)
+        await fetch_source(request.videoUrl, input_path)
 
         # Extract audio
         ext = request.outputFormat.lower()
@@ -1551,27 +6281,16 @@ async def extract_audio(request: AudioExtractRequest):
             ext = "mp3"
 
         output_path = work_dir / f"audio.{ext}"
-        duration = extract_audio_ffmpeg(input_path, output_path, ext)
+        duration = await extract_audio_ffmpeg(input_path, output_path, ext)
 
         # Get file size
         file_size = output_path.stat().st_size
         print(f"[AudioExtract:{job_id}] Extracted audio: {duration:.1f}s, {file_size} bytes")
 
         # Upload to Supabase storage
-        supabase = get_supabase_client()
         timestamp = int(datetime.now().timestamp() * 1000)
         storage_path = f"{request.userId}/audio/{timestamp}_extracted.{ext}"
-
-        with open(output_path, "rb") as f:
-            audio_data = f.read()
-
-        supabase.storage.from_("media-studio-videos").upload(
-            storage_path,
-            audio_data,
-            file_options={"content-type": f"audio/{ext}"}
-        )
-
-        public_url = supabase.storage.from_("media-studio-videos").get_public_url(storage_path)
+        public_url, upload = await upload_to_supabase(output_path, storage_path, f"audio/{ext}")
         print(f"[AudioExtract:{job_id}] Uploaded to: {public_url}")
 
         return AudioExtractResponse(
@@ -1579,6 +6298,7 @@ async def extract_audio(request: AudioExtractRequest):
             audioUrl=public_url,
             duration=duration,
             fileSize=file_size,
+            upload=upload,
         )
 
     except HTTPException:
@@ -1617,14 +6337,14 @@ async def transcribe_audio(request: TranscribeRequest):
 
         # Download the audio/video file
         input_path = work_dir / "input"
-        await download_file(request.audioUrl, input_path)
+        await fetch_source(request.audioUrl, input_path)
 
         # Check if it's a video file (extract audio if needed)
         audio_path = work_dir / "audio.mp3"
 
         # Try to extract audio (works for both video and audio files)
         try:
-            extract_audio_ffmpeg(input_path, audio_path, "mp3")
+            await extract_audio_ffmpeg(input_path, audio_path, "mp3")
         except Exception as e:
             print(f"[Transcribe:{job_id}] Audio extraction failed, assuming input is already audio: {e}")
             # If extraction fails, assume input is already audio
@@ -1651,13 +6371,14 @@ async def transcribe_audio(request: TranscribeRequest):
         timestamp = int(datetime.now().timestamp() * 1000)
         srt_path = f"{request.userId}/captions/{timestamp}_captions.srt"
 
-        supabase.storage.from_("media-studio-videos").upload(
+        await run_storage_call(
+            supabase.storage.from_(SUPABASE_BUCKET).upload,
             srt_path,
             srt_content.encode('utf-8'),
             file_options={"content-type": "text/plain"}
         )
 
-        srt_url = supabase.storage.from_("media-studio-videos").get_public_url(srt_path)
+        srt_url = await run_storage_call(supabase.storage.from_(SUPABASE_BUCKET).get_public_url, srt_path)
         print(f"[Transcribe:{job_id}] SRT uploaded to: {srt_url}")
 
         return TranscribeResponse(
@@ -63,13 +63,17 @@ echo "Public access enabled on bucket"
 
 # Step 5: Set lifecycle rule to auto-delete old exports (optional but recommended)
 echo ""
-echo "Step 5: Setting lifecycle rule (auto-delete after 30 days)..."
+echo "Step 5: Setting lifecycle rules (auto-delete after 30 days, previews and leftover upload parts after 1 day)..."
 cat > /tmp/lifecycle.json << 'EOF'
 {
   "rule": [
     {
       "action": {"type": "Delete"},
       "condition": {"age": 30}
+    },
+    {
+      "action": {"type": "Delete"},
+      "condition": {"age": 1, "matchesPrefix": ["previews/", "upload-parts/"]}
     }
   ]
 }
@@ -80,7 +84,7 @@ gcloud storage buckets update gs://$BUCKET_NAME \
     --project $PROJECT_ID
 
 rm /tmp/lifecycle.json
-echo "Lifecycle rule set: files auto-delete after 30 days"
+echo "Lifecycle rule set: files auto-delete after 30 days, previews and leftover upload parts after 1 day"
 
 # Step 6: Set CORS for browser downloads (if needed)
 echo ""
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# main.py is a single module at the service root; keep its scratch dirs out of /tmp/media-processing
+os.environ.setdefault("WORK_DIR", tempfile.mkdtemp(prefix="media-processing-tests-"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
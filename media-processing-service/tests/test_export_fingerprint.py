@@ -0,0 +1,71 @@
+import copy
+
+from main import VideoExportRequest, export_fingerprint
+
+BASE = {
+    "userId": "user-1",
+    "projectName": "Launch teaser",
+    "clips": [
+        {"id": "clip-a", "sourceUrl": "https://cdn.example.com/a.mp4", "sourceDuration": 12.5,
+         "startTime": 0.0, "trimStart": 1.0, "trimEnd": 0.5, "audioInfo": {"volume": 0.8}},
+        {"id": "clip-b", "sourceUrl": "https://cdn.example.com/b.mp4", "sourceDuration": 8.0,
+         "startTime": 11.0, "trimStart": 0.0, "trimEnd": 2.0},
+    ],
+    "transitions": [{"fromClipIndex": 0, "toClipIndex": 1, "type": "fade", "duration": 0.5}],
+    "textOverlays": [
+        {"id": "overlay-1", "startTime": 2.0, "duration": 3.0, "text": "Hello",
+         "position": {"x": 50.0, "y": 80.0}, "style": {"fontSize": 48, "opacity": 0.9}},
+    ],
+    "previewDimensions": {"width": 640, "height": 360},
+}
+
+
+def fingerprint(data):
+    return export_fingerprint(VideoExportRequest.model_validate(data))
+
+
+def variant(**changes):
+    data = copy.deepcopy(BASE)
+    for path, value in changes.items():
+        target = data
+        *parents, key = path.split("__")
+        for part in parents:
+            target = target[int(part)] if part.isdigit() else target[part]
+        target[key] = value
+    return data
+
+
+def test_fingerprint_ignores_field_and_clip_order():
+    reordered = {key: BASE[key] for key in reversed(list(BASE))}
+    reordered["clips"] = [dict(reversed(list(clip.items()))) for clip in reversed(BASE["clips"])]
+    assert fingerprint(reordered) == fingerprint(BASE)
+
+
+def test_fingerprint_ignores_number_formatting():
+    data = variant(clips__0__trimStart=1, clips__0__startTime=0, clips__1__sourceDuration=8,
+                   textOverlays__0__startTime=2, textOverlays__0__position={"y": 80, "x": 50})
+    assert fingerprint(data) == fingerprint(BASE)
+
+
+def test_fingerprint_ignores_ids_project_name_and_render_mode():
+    data = variant(clips__0__id="other", textOverlays__0__id="other", projectName="Renamed",
+                   renderMode="multi_pass")
+    assert fingerprint(data) == fingerprint(BASE)
+
+
+def test_fingerprint_changes_with_overlays():
+    base = fingerprint(BASE)
+    assert fingerprint(variant(textOverlays__0__text="Hello!")) != base
+    assert fingerprint(variant(textOverlays__0__startTime=2.5)) != base
+    assert fingerprint(variant(textOverlays__0__position={"x": 50.0, "y": 70.0})) != base
+    assert fingerprint(variant(textOverlays__0__style={"fontSize": 48, "opacity": 1.0})) != base
+    assert fingerprint(variant(textOverlays=None)) != base
+
+
+def test_fingerprint_changes_with_the_edit():
+    base = fingerprint(BASE)
+    assert fingerprint(variant(clips__0__trimEnd=0.75)) != base
+    assert fingerprint(variant(clips__0__audioInfo={"volume": 1.0})) != base
+    assert fingerprint(variant(transitions__0__type="wipeleft")) != base
+    assert fingerprint(variant(userId="user-2")) != base
+    assert fingerprint(variant(preview=True)) != base
@@ -0,0 +1,40 @@
+import pytest
+
+import main
+from main import hls_renditions
+
+
+@pytest.fixture(autouse=True)
+def ladder(monkeypatch):
+    monkeypatch.setattr(main, "HLS_LADDER", "1080:6000,720:3000,480:1500,360:800")
+
+
+def test_height_on_a_rung_takes_that_rung():
+    assert hls_renditions(720, ladder=False) == [(None, 3000)]
+    assert hls_renditions(720, ladder=True) == [(None, 3000), (480, 1500), (360, 800)]
+
+
+def test_height_between_rungs_takes_the_rung_above():
+    assert hls_renditions(900, ladder=False) == [(None, 6000)]
+    assert hls_renditions(900, ladder=True) == [(None, 6000), (720, 3000), (480, 1500), (360, 800)]
+
+
+def test_height_above_the_top_rung_takes_the_top_rung():
+    assert hls_renditions(2160, ladder=True) == [
+        (None, 6000), (1080, 6000), (720, 3000), (480, 1500), (360, 800),
+    ]
+
+
+def test_height_below_the_bottom_rung_takes_the_bottom_rung():
+    assert hls_renditions(240, ladder=False) == [(None, 800)]
+    assert hls_renditions(240, ladder=True) == [(None, 800)]
+
+
+def test_ladder_order_and_spacing_in_the_setting_do_not_matter(monkeypatch):
+    monkeypatch.setattr(main, "HLS_LADDER", "360:800, 1080:6000,480:1500,720:3000,")
+    assert hls_renditions(900, ladder=True) == [(None, 6000), (720, 3000), (480, 1500), (360, 800)]
+
+
+def test_empty_ladder_leaves_the_full_size_rendition_uncapped(monkeypatch):
+    monkeypatch.setattr(main, "HLS_LADDER", "")
+    assert hls_renditions(1080, ladder=True) == [(None, 0)]
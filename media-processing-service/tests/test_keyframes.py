@@ -0,0 +1,59 @@
+from array import array
+
+import pytest
+
+from main import SMART_TRIM_MIN_COPY_SECONDS, KeyframeIndex, plan_smart_trim
+
+
+def make_index(timestamps, offsets=None):
+    if offsets is None:
+        offsets = [i * 1000 for i in range(len(timestamps))]
+    return KeyframeIndex(array("d", timestamps), array("q", offsets))
+
+
+def test_index_round_trips_through_bytes():
+    index = make_index([0.0, 2.002, 4.004, 6.006], [48, 10_240, -1, 3_000_000_000])
+    restored = KeyframeIndex.from_bytes(index.to_bytes())
+    assert list(restored.timestamps) == list(index.timestamps)
+    assert list(restored.offsets) == list(index.offsets)
+    assert restored.offset_of(4.5) is None  # No position reported for that keyframe
+    assert restored.offset_of(7.0) == 3_000_000_000
+
+
+def test_empty_index_round_trips_through_bytes():
+    restored = KeyframeIndex.from_bytes(make_index([]).to_bytes())
+    assert len(restored) == 0
+
+
+def test_from_bytes_rejects_bad_data():
+    data = make_index([0.0, 2.0, 4.0]).to_bytes()
+    with pytest.raises(ValueError):
+        KeyframeIndex.from_bytes(b"XXXX" + data[4:])
+    with pytest.raises(ValueError):
+        KeyframeIndex.from_bytes(data[:-4])
+
+
+def test_smart_trim_copies_between_keyframes_and_reencodes_the_edges():
+    index = make_index([0.0, 2.0, 4.0, 6.0, 8.0])
+    assert plan_smart_trim(index, 1.0, 7.0) == [(1.0, 2.0, False), (2.0, 6.0, True), (6.0, 7.0, False)]
+
+
+def test_smart_trim_cut_on_keyframes_has_no_reencoded_pieces():
+    index = make_index([0.0, 2.0, 4.0, 6.0, 8.0])
+    assert plan_smart_trim(index, 2.0, 6.0) == [(2.0, 6.0, True)]
+    # Within the tolerance of a keyframe counts as on it
+    assert plan_smart_trim(index, 2.0005, 5.9995) == [(2.0, 6.0, True)]
+
+
+def test_smart_trim_without_keyframes_inside_the_range():
+    index = make_index([0.0, 10.0])
+    assert plan_smart_trim(index, 2.0, 8.0) is None
+
+
+def test_smart_trim_needs_enough_copyable_video():
+    index = make_index([0.0, 2.0, 2.0 + SMART_TRIM_MIN_COPY_SECONDS / 2, 10.0])
+    assert plan_smart_trim(index, 1.0, 5.0) is None
+
+
+def test_smart_trim_with_empty_index():
+    assert plan_smart_trim(make_index([]), 0.0, 5.0) is None
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from main import StageGraph, StageJournal
+
+
+def memory_journal(saved=None):
+    saved = dict(saved or {})
+
+    async def record(name, data):
+        saved[name] = data
+    return StageJournal(saved=saved, record=record)
+
+
+def test_stages_run_after_their_deps_with_their_results():
+    async def scenario():
+        graph = StageGraph("test")
+
+        async def source():
+            return 2
+
+        async def double(x):
+            return x * 2
+
+        async def add(a, b):
+            return a + b
+        graph.add("source", source)
+        graph.add("double", double, deps=["source"])
+        graph.add("sum", add, deps=["source", "double"])
+        return await graph.run()
+
+    assert asyncio.run(scenario()) == {"source": 2, "double": 4, "sum": 6}
+
+
+def test_failed_stage_cancels_its_dependents_and_siblings():
+    ran = []
+    cancelled = []
+
+    async def scenario():
+        graph = StageGraph("test")
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("boom")
+
+        async def dependent(_):
+            ran.append("dependent")
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append("slow")
+                raise
+        graph.add("fail", fail)
+        graph.add("dependent", dependent, deps=["fail"])
+        graph.add("slow", slow)
+        await graph.run()
+
+    with pytest.raises(RuntimeError, match="boom"):
+        asyncio.run(scenario())
+    assert ran == []
+    assert cancelled == ["slow"]
+
+
+def test_checkpointed_stage_is_restored_instead_of_run_again():
+    calls = {"expensive": 0, "final": 0}
+
+    def build(journal):
+        graph = StageGraph("test", journal=journal)
+
+        async def expensive():
+            calls["expensive"] += 1
+            return 21
+
+        async def final(x):
+            calls["final"] += 1
+            if calls["final"] == 1:
+                raise RuntimeError("crash after the checkpoint")
+            return x * 2
+        graph.add("expensive", expensive, save=lambda result: {"value": result}, load=lambda data: data["value"])
+        graph.add("final", final, deps=["expensive"])
+        return graph
+
+    journal = memory_journal()
+    with pytest.raises(RuntimeError):
+        asyncio.run(build(journal).run())
+    assert journal.saved == {"expensive": {"value": 21}}
+
+    results = asyncio.run(build(memory_journal(journal.saved)).run())
+    assert results == {"expensive": 21, "final": 42}
+    assert calls == {"expensive": 1, "final": 2}
+
+
+def test_restored_stage_runs_again_when_its_files_are_gone(tmp_path):
+    calls = []
+
+    def build(journal):
+        graph = StageGraph("test", journal=journal, scratch=tmp_path)
+
+        async def produce():
+            calls.append("produce")
+            path = tmp_path / "segment.bin"
+            path.write_bytes(b"data")
+            return path
+
+        async def consume(path):
+            return path.read_bytes()
+        graph.add("produce", produce, save=lambda path: {"path": str(path)},
+                  load=lambda data: tmp_path / "segment.bin", artifacts=lambda path: [path])
+        graph.add("consume", consume, deps=["produce"])
+        return graph
+
+    journal = memory_journal({"produce": {"path": str(tmp_path / "segment.bin")}})
+    assert asyncio.run(build(journal).run())["consume"] == b"data"
+    assert calls == ["produce"]
+    # Freed once its only reader finished
+    assert not (tmp_path / "segment.bin").exists()